@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""Throughput of reading and writing across formats, compressions and record
+shapes, run with asv (see asv.conf.json): `time_*` benchmarks measure wall
+time, `peakmem_*` the peak RSS, and `track_*` the reads and megabytes of
+uncompressed data per second. Combinations that do not apply (e.g. paired
+long reads) are skipped.
+"""
+import shutil
+import tempfile
+from .common import (
+    COMPRESSIONS, FORMATS, MB, SHAPES, check_case, data_paths, get_data, load,
+    open_reader, open_writer, read, timed, write)
+
+APIS = ('records', 'batches')
+
+class Read(object):
+    """Reading a file, record by record or in batches.
+    """
+    params = (SHAPES, FORMATS, COMPRESSIONS, APIS)
+    param_names = ('shape', 'format', 'compression', 'api')
+    timeout = 600
+
+    def setup(self, shape, file_format, compression, api):
+        check_case(shape, file_format, compression)
+        self.paths, self.info = get_data(shape, file_format, compression)
+
+    def time_read(self, shape, file_format, compression, api):
+        read(self.paths, file_format, api)
+
+    def peakmem_read(self, shape, file_format, compression, api):
+        read(self.paths, file_format, api)
+
+    def track_reads_per_sec(self, shape, file_format, compression, api):
+        return self.info['records'] / timed(
+            read, self.paths, file_format, api)
+    track_reads_per_sec.unit = 'reads/s'
+
+    def track_mb_per_sec(self, shape, file_format, compression, api):
+        return self.info['bytes'] / MB / timed(
+            read, self.paths, file_format, api)
+    track_mb_per_sec.unit = 'MB/s'
+
+class Write(object):
+    """Writing records (or batches) that are already in memory.
+    """
+    params = (SHAPES, FORMATS, COMPRESSIONS, APIS)
+    param_names = ('shape', 'format', 'compression', 'api')
+    timeout = 600
+
+    def setup(self, shape, file_format, compression, api):
+        check_case(shape, file_format, compression, writing=True)
+        paths, self.info = get_data(shape, file_format)
+        self.items = load(paths, file_format, api)
+        self.temp = tempfile.mkdtemp()
+        self.outputs = [
+            self.temp + '/' + path.name
+            for path in data_paths(shape, file_format, compression)]
+
+    def teardown(self, shape, file_format, compression, api):
+        shutil.rmtree(self.temp)
+
+    def _write(self, file_format, compression, api):
+        write(self.items, open_writer(self.outputs, file_format, compression),
+              api)
+
+    def time_write(self, shape, file_format, compression, api):
+        self._write(file_format, compression, api)
+
+    def peakmem_write(self, shape, file_format, compression, api):
+        self._write(file_format, compression, api)
+
+    def track_reads_per_sec(self, shape, file_format, compression, api):
+        return self.info['records'] / timed(
+            self._write, file_format, compression, api)
+    track_reads_per_sec.unit = 'reads/s'
+
+    def track_mb_per_sec(self, shape, file_format, compression, api):
+        return self.info['bytes'] / MB / timed(
+            self._write, file_format, compression, api)
+    track_mb_per_sec.unit = 'MB/s'
+
+class RoundTrip(object):
+    """Reading a file in batches and writing it in the same format and
+    compression.
+    """
+    params = (SHAPES, FORMATS, COMPRESSIONS)
+    param_names = ('shape', 'format', 'compression')
+    timeout = 600
+
+    def setup(self, shape, file_format, compression):
+        check_case(shape, file_format, compression, writing=True)
+        self.paths, self.info = get_data(shape, file_format, compression)
+        self.temp = tempfile.mkdtemp()
+        self.outputs = [self.temp + '/' + path.name for path in self.paths]
+
+    def teardown(self, shape, file_format, compression):
+        shutil.rmtree(self.temp)
+
+    def _round_trip(self, file_format, compression):
+        with open_reader(self.paths, file_format) as reader:
+            write(reader.iter_batches(),
+                  open_writer(self.outputs, file_format, compression),
+                  'batches')
+
+    def time_round_trip(self, shape, file_format, compression):
+        self._round_trip(file_format, compression)
+
+    def peakmem_round_trip(self, shape, file_format, compression):
+        self._round_trip(file_format, compression)
+
+    def track_reads_per_sec(self, shape, file_format, compression):
+        return self.info['records'] / timed(
+            self._round_trip, file_format, compression)
+    track_reads_per_sec.unit = 'reads/s'
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""Benchmark data and the seqio operations under test.
+
+Data are generated with the synthetic generators in
+tests/data/create_test_data.py the first time a file is needed, and are
+cached in `DATA_DIR` so that every run (and every commit in the history)
+reads the same files. Each record shape has an uncompressed file per format;
+compressed files are made from it.
+
+Environment variables:
+    SEQIO_BENCH_SCALE: Multiplies the size of every data set (default 1:
+        200,000 150 bp reads, 2,000 reads of ~10 kb and one 25 Mb chromosome).
+    SEQIO_BENCH_DATA: The directory in which data are cached (default
+        ~/.cache/seqio-benchmarks).
+"""
+from itertools import chain
+import json
+import os
+from pathlib import Path
+import sys
+import time
+
+sys.path.insert(
+    0, str(Path(__file__).resolve().parent.parent / 'tests' / 'data'))
+
+from create_test_data import (
+    format_fasta, format_fastq, format_sam, gen_chromosomes, gen_long_reads,
+    gen_short_reads, write_data)
+
+SCALE = float(os.environ.get('SEQIO_BENCH_SCALE', '1'))
+
+DATA_DIR = Path(os.environ.get(
+    'SEQIO_BENCH_DATA', Path.home() / '.cache' / 'seqio-benchmarks'
+)) / 'scale-{:g}'.format(SCALE)
+
+SHAPES = ('short', 'long', 'chromosome')
+
+FORMATS = ('fastq', 'fasta', 'interleaved', 'paired', 'sam')
+
+COMPRESSIONS = ('none', 'gzip-1', 'gzip-6', 'gzip-9', 'bgzf')
+"""'gzip-N' is gzip at level N, and 'bgzf' is BGZF at the default level. SAM
+data are stored as BAM when compressed, at the given level."""
+
+SHAPE_FORMATS = {
+    'short': FORMATS,
+    'long': ('fastq', 'fasta', 'sam'),
+    'chromosome': ('fasta',),
+}
+
+EXTENSIONS = {
+    'fastq': '.fq', 'interleaved': '.fq', 'paired': '.fq', 'fasta': '.fa',
+    'sam': '.sam',
+}
+
+SAM_HEADER = b'@HD\tVN:1.6\tSO:unsorted\n'
+
+LINE_LENGTH = 60
+
+MB = 1e6
+
+def generate(shape: str, paired: bool = False):
+    """Generates the records of a data set; pairs of records if `paired`.
+    """
+    if shape == 'short':
+        return gen_short_reads(int(200000 * SCALE), paired=paired)
+    if shape == 'long':
+        return gen_long_reads(int(2000 * SCALE))
+    return gen_chromosomes([int(25000000 * SCALE)])
+
+def check_case(shape: str, file_format: str, compression: str = 'none',
+               writing: bool = False):
+    """Raises NotImplementedError, which asv reports as a skipped benchmark,
+    for combinations of parameters that do not apply.
+    """
+    if file_format not in SHAPE_FORMATS[shape]:
+        raise NotImplementedError()
+    if writing and file_format == 'sam' and compression == 'none':
+        # only BAM output is supported
+        raise NotImplementedError()
+
+def parse_compression(compression: str):
+    """Returns a tuple (compression, level) of arguments for
+    :class:`seqio.io.SequenceWriter`.
+    """
+    if compression == 'none':
+        return None, None
+    if compression == 'bgzf':
+        return 'bgzf', None
+    name, level = compression.split('-')
+    return name, int(level)
+
+def data_paths(shape: str, file_format: str, compression: str) -> list:
+    suffix = EXTENSIONS[file_format]
+    if compression != 'none':
+        suffix = '.bam' if file_format == 'sam' else suffix + '.gz'
+    mates = ('.1', '.2') if file_format == 'paired' else ('',)
+    return [
+        DATA_DIR / '{}-{}-{}{}{}'.format(
+            shape, file_format, compression, mate, suffix)
+        for mate in mates]
+
+def get_data(shape: str, file_format: str, compression: str = 'none'):
+    """Returns the paths of a data set, creating the files if necessary, and
+    a dict with the number of 'records' (mates count separately) and the
+    'bytes' of uncompressed data.
+    """
+    paths = data_paths(shape, file_format, compression)
+    info_path = DATA_DIR / '{}-{}.json'.format(shape, file_format)
+    if not info_path.exists():
+        DATA_DIR.mkdir(parents=True, exist_ok=True)
+        info = write_uncompressed(shape, file_format)
+        with open(info_path, 'w') as out:
+            json.dump(info, out)
+    with open(info_path) as inp:
+        info = json.load(inp)
+    for path, source in zip(paths, data_paths(shape, file_format, 'none')):
+        if not path.exists():
+            with _atomic(path) as temp:
+                compress(source, temp, file_format, compression)
+    return paths, info
+
+class _atomic(object):
+    """Yields a temporary path that is moved to `path` on success.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.temp = path.with_name('.tmp-' + path.name)
+
+    def __enter__(self):
+        return self.temp
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        if exception_type is None:
+            os.replace(self.temp, self.path)
+        elif self.temp.exists():
+            self.temp.unlink()
+
+def write_uncompressed(shape: str, file_format: str) -> dict:
+    paths = data_paths(shape, file_format, 'none')
+    if file_format == 'paired':
+        for mate, path in enumerate(paths):
+            with _atomic(path) as temp:
+                write_data(temp, format_fastq(
+                    pair[mate] for pair in generate(shape, True)))
+    else:
+        if file_format == 'interleaved':
+            chunks = format_fastq(chain.from_iterable(generate(shape, True)))
+        elif file_format == 'fastq':
+            chunks = format_fastq(generate(shape))
+        elif file_format == 'fasta':
+            chunks = format_fasta(generate(shape), LINE_LENGTH)
+        else:
+            chunks = chain((SAM_HEADER,), format_sam(generate(shape)))
+        with _atomic(paths[0]) as temp:
+            write_data(temp, chunks)
+    return dict(
+        records=count_records(paths, file_format),
+        bytes=sum(path.stat().st_size for path in paths))
+
+def count_records(paths, file_format: str) -> int:
+    if file_format == 'sam':
+        with open(paths[0], 'rb') as inp:
+            return sum(1 for line in inp if not line.startswith(b'@'))
+    return read(paths, file_format, 'batches')
+
+def compress(source, dest, file_format: str, compression: str):
+    from seqio.compression import BlockCompressedWriter
+    import seqio.sam
+    name, level = parse_compression(compression)
+    if file_format == 'sam':
+        level_args = {} if level is None else dict(level=level)
+        with seqio.sam.open(str(source)) as reader, seqio.sam.BamWriter(
+                str(dest), **level_args) as writer:
+            for batch in reader.iter_batches():
+                writer.write_batch(batch)
+    elif name == 'bgzf':
+        with open(source, 'rb') as inp, BlockCompressedWriter(
+                str(dest), 'bgzf') as out:
+            for chunk in iter(lambda: inp.read(1 << 20), b''):
+                out.write(chunk)
+    else:
+        with open(source, 'rb') as inp:
+            write_data(dest, iter(lambda: inp.read(1 << 20), b''), level)
+
+# Operations
+
+def open_reader(paths, file_format: str):
+    import seqio.fasta
+    import seqio.fastq
+    import seqio.sam
+    paths = [str(path) for path in paths]
+    if file_format == 'fasta':
+        return seqio.fasta.open(*paths)
+    if file_format == 'sam':
+        return seqio.sam.open(*paths)
+    return seqio.fastq.open(*paths, interleaved=file_format == 'interleaved')
+
+def open_writer(paths, file_format: str, compression: str):
+    from seqio.fasta import Fasta
+    from seqio.fastq import Fastq
+    from seqio.io import (
+        InterleavedFileWriter, PairedFileWriter, SequenceWriter)
+    from seqio.sam import BamWriter
+    name, level = parse_compression(compression)
+    kwargs = {} if level is None else dict(level=level)
+    paths = [str(path) for path in paths]
+    if file_format == 'sam':
+        return BamWriter(paths[0], **kwargs)
+    if name is not None:
+        kwargs.update(compression=name)
+    if file_format == 'fasta':
+        return SequenceWriter(
+            paths[0], Fasta(line_length=LINE_LENGTH), **kwargs)
+    if file_format == 'interleaved':
+        return InterleavedFileWriter(paths[0], Fastq(), **kwargs)
+    if file_format == 'paired':
+        return PairedFileWriter(
+            str(paths), *(SequenceWriter(path, Fastq(), **kwargs)
+                          for path in paths), Fastq())
+    return SequenceWriter(paths[0], Fastq(), **kwargs)
+
+def read(paths, file_format: str, api: str) -> int:
+    """Reads a data set record by record ('records') or in batches
+    ('batches').
+
+    Returns:
+        The number of records read (mates count separately).
+    """
+    count = 0
+    with open_reader(paths, file_format) as reader:
+        if api == 'batches':
+            for batch in reader.iter_batches():
+                count += len(batch[0]) * 2 if reader.paired else len(batch)
+        else:
+            for _ in reader:
+                count += 1
+            if reader.paired:
+                count *= 2
+    return count
+
+def load(paths, file_format: str, api: str) -> list:
+    """Reads a data set into memory as a list of records (or pairs) or of
+    batches (or pairs of batches).
+    """
+    with open_reader(paths, file_format) as reader:
+        if api == 'batches':
+            return list(reader.iter_batches())
+        return list(reader)
+
+def write(items, writer, api: str):
+    """Writes items returned by :func:`load` and closes the writer.
+    """
+    with writer:
+        if api == 'batches':
+            method = writer.write_batch
+        else:
+            method = writer.write
+        for item in items:
+            if isinstance(item, tuple):
+                method(*item)
+            else:
+                method(item)
+
+def timed(fn, *args) -> float:
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""Comparisons with other libraries that read and write the same formats.
+Benchmarks of libraries that are not installed are skipped.
+"""
+from importlib import import_module
+import shutil
+import tempfile
+from .common import MB, get_data, load, open_writer, read, timed, write
+
+def require(name):
+    """Imports a library, or skips the benchmark if it is not installed.
+    """
+    try:
+        return import_module(name)
+    except ImportError:
+        raise NotImplementedError()
+
+def read_dnaio(paths):
+    dnaio = require('dnaio')
+    count = 0
+    with dnaio.open(*paths) as reader:
+        for _ in reader:
+            count += 1
+    return count
+
+def read_screed(paths):
+    screed = require('screed')
+    count = 0
+    with screed.open(paths[0]) as reader:
+        for _ in reader:
+            count += 1
+    return count
+
+def read_pysam(paths, file_format):
+    pysam = require('pysam')
+    count = 0
+    if file_format == 'sam':
+        with pysam.AlignmentFile(str(paths[0]), check_sq=False) as reader:
+            for _ in reader.fetch(until_eof=True):
+                count += 1
+    else:
+        with pysam.FastxFile(str(paths[0])) as reader:
+            for _ in reader:
+                count += 1
+    return count
+
+READERS = {
+    'seqio': lambda paths, file_format: read(paths, file_format, 'records'),
+    'seqio-batches': lambda paths, file_format: read(
+        paths, file_format, 'batches'),
+    'dnaio': lambda paths, file_format: read_dnaio(paths),
+    'screed': lambda paths, file_format: read_screed(paths),
+    'pysam': read_pysam,
+}
+
+class CompareRead(object):
+    """Reading single-end FASTQ, and SAM/BAM, with each library.
+    """
+    params = (
+        tuple(READERS), ('short', 'long'), ('fastq', 'sam'),
+        ('none', 'gzip-6'))
+    param_names = ('library', 'shape', 'format', 'compression')
+    timeout = 600
+
+    def setup(self, library, shape, file_format, compression):
+        if file_format == 'sam':
+            if library not in ('seqio', 'seqio-batches', 'pysam'):
+                raise NotImplementedError()
+            require('pysam')
+        elif library != 'pysam' and not library.startswith('seqio'):
+            require(library)
+        self.paths, self.info = get_data(shape, file_format, compression)
+        self.reader = READERS[library]
+
+    def time_read(self, library, shape, file_format, compression):
+        self.reader(self.paths, file_format)
+
+    def peakmem_read(self, library, shape, file_format, compression):
+        self.reader(self.paths, file_format)
+
+    def track_reads_per_sec(self, library, shape, file_format, compression):
+        return self.info['records'] / timed(
+            self.reader, self.paths, file_format)
+    track_reads_per_sec.unit = 'reads/s'
+
+    def track_mb_per_sec(self, library, shape, file_format, compression):
+        return self.info['bytes'] / MB / timed(
+            self.reader, self.paths, file_format)
+    track_mb_per_sec.unit = 'MB/s'
+
+class CompareWrite(object):
+    """Writing single-end FASTQ with each library that can.
+    """
+    params = (('seqio', 'seqio-batches', 'dnaio'), ('short', 'long'),
+              ('none', 'gzip-6'))
+    param_names = ('library', 'shape', 'compression')
+    timeout = 600
+
+    def setup(self, library, shape, compression):
+        paths, self.info = get_data(shape, 'fastq')
+        self.temp = tempfile.mkdtemp()
+        self.output = self.temp + '/out.fq'
+        if compression != 'none':
+            self.output += '.gz'
+        if library == 'dnaio':
+            dnaio = require('dnaio')
+            self.items = [
+                dnaio.SequenceRecord(
+                    record.name.decode(), record.sequence.decode(),
+                    record.qualities.decode())
+                for record in load(paths, 'fastq', 'records')]
+        else:
+            self.items = load(
+                paths, 'fastq',
+                'batches' if library == 'seqio-batches' else 'records')
+        self.library = library
+        self.level = None if compression == 'none' else 6
+
+    def teardown(self, library, shape, compression):
+        shutil.rmtree(self.temp)
+
+    def _write(self):
+        if self.library == 'dnaio':
+            import dnaio
+            kwargs = (
+                {} if self.level is None
+                else dict(compression_level=self.level))
+            with dnaio.open(self.output, mode='w', **kwargs) as writer:
+                for record in self.items:
+                    writer.write(record)
+            return
+        write(
+            self.items,
+            open_writer(
+                [self.output], 'fastq',
+                'none' if self.level is None else 'gzip-6'),
+            'batches' if self.library == 'seqio-batches' else 'records')
+
+    def time_write(self, library, shape, compression):
+        self._write()
+
+    def peakmem_write(self, library, shape, compression):
+        self._write()
+
+    def track_reads_per_sec(self, library, shape, compression):
+        return self.info['records'] / timed(self._write)
+    track_reads_per_sec.unit = 'reads/s'
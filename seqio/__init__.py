@@ -1,22 +1,31 @@
 # -*- coding: utf-8 -*-
 """
 """
+# Importing seqio must stay cheap: format modules (and their dependencies,
+# e.g. numpy, xphyle and pysam) are only imported when a format is used.
 from importlib import import_module
-from seqio.types import PathOrFile, ModeArg
-from xphyle.utils import is_iterable
+import os
+
+ENTRY_POINT_GROUP = 'seqio.formats'
+"""Entry point group through which other packages provide formats. Each entry
+point names a format and refers to its implementation (a module or object
+with an `open` function), which is only loaded when the format is used."""
 
 class Formats(object):
-    """Container for file format instances.
+    """Container for file format instances. Formats may be registered by
+    module name, and are imported on first use.
     """
     def __init__(self):
         self.formats = {}
+        self._entry_points = None
     
-    def register(name: str, mod) -> bool:
+    def register(self, name: str, mod) -> bool:
         """Register a file format.
         
         Args:
             name: The format name.
-            mod: The format implementation (a module or object).
+            mod: The format implementation (a module or object), or the name
+                of a module to import when the format is first used.
         
         Returns:
             True if the format already exists and was replaced, otherwise False.
@@ -25,25 +34,79 @@ class Formats(object):
         self.formats[name] = mod
         return exists
     
-    def guess_from_file(path_or_file: PathOrFile):
-        pass
-
-    def guess_from_path_spec(path_spec):
-        pass
+    def discover(self):
+        """Registers the formats provided by other packages through the
+        `ENTRY_POINT_GROUP` entry point group, without loading them. Formats
+        that are already registered take precedence.
+        """
+        from importlib.metadata import entry_points
+        self._entry_points = {
+            entry_point.name: entry_point
+            for entry_point in entry_points(group=ENTRY_POINT_GROUP)}
+    
+    @property
+    def names(self):
+        if self._entry_points is None:
+            self.discover()
+        return sorted(set(self.formats) | set(self._entry_points))
+    
+    def get(self, name: str):
+        """Returns the implementation of a format, importing it if necessary.
+        
+        Raises:
+            ValueError if the format is not registered.
+        """
+        if name not in self.formats:
+            if self._entry_points is None:
+                self.discover()
+            if name not in self._entry_points:
+                raise ValueError("Unknown file format {!r}".format(name))
+            self.formats[name] = self._entry_points[name].load()
+        mod = self.formats[name]
+        if isinstance(mod, str):
+            mod = self.formats[name] = import_module(mod)
+        return mod
+    
+    def guess_from_file(
+            self, path_or_file: 'PathOrFile', readable: bool = True):
+        """Guess the format of a file from its first bytes (see
+        :func:`seqio.sniff.sniff_file`), or from its name if it is not being
+        read or its content is not recognized (e.g. it is empty).
+        
+        Returns:
+            The format implementation, or None if the format is not known.
+        """
+        from seqio.sniff import guess_format_from_name, sniff_file
+        name = None
+        if readable:
+            name = sniff_file(path_or_file).file_format
+        if name is None:
+            path = getattr(path_or_file, 'name', path_or_file)
+            if isinstance(path, (str, os.PathLike)):
+                name = guess_format_from_name(path)
+        return None if name is None else self.get(name)
+    
+    def guess_from_path_spec(self, path_spec, readable: bool = True):
+        """Guess the format of the files matched by a
+        :class:`xphyle.paths.PathSpec` from the first one.
+        """
+        paths = path_spec.find()
+        if not paths:
+            return None
+        return self.guess_from_file(paths[0].path, readable)
 
 FORMATS = Formats()
 
 # register known formats
 for fmt in ('fasta', 'fastq', 'sam'):
-    mod = import_module('seqio.{}'.format(fmt))
-    FORMATS.register(fmt, mod)
+    FORMATS.register(fmt, 'seqio.{}'.format(fmt))
 
-FilesArg = Union[PathSpec, PathOrFile, Iterable[PathOrFile]]
-"""A path, iterable of paths, or :class:`xphyle.paths.PathSpec`."""
+def get_format(name: str):
+    return FORMATS.get(name)
 
 def open(
-        files1: FilesArg, files2: FilesArg = None, mode: ModeArg = 'rb',
-        file_format: FormatArg = None, **kwargs) -> SequenceReader:
+        files1: 'FilesArg', files2: 'FilesArg' = None,
+        mode: 'ModeArg' = 'rb', file_format: 'FormatArg' = None, **kwargs):
     """Open a sequence file reader/writer.
     
     Args:
@@ -66,10 +129,17 @@ def open(
         binary, data are read as bytes and may be optionally converted to
         strings by calling the appropriate methods (e.g. name_str,
         sequence_str).
+        
+        When reading a single FASTQ file whose first two records are mates,
+        the file is opened as interleaved unless `interleaved` is given.
     
     Returns:
-        A :class:`SequenceReader`.
+        A reader or writer.
     """
+    from seqio.sniff import sniff_file
+    from seqio.types import FileMode, PathSpec
+    from xphyle.utils import is_iterable
+    
     if isinstance(mode, str):
         mode = FileMode(mode)
     
@@ -86,6 +156,11 @@ def open(
             file_format = FORMATS.guess_from_path_spec(test_item, mode.readable)
         else:
             file_format = FORMATS.guess_from_file(test_item, mode.readable)
+            if (mode.readable and not files2 and
+                    'interleaved' not in kwargs):
+                sniffed = sniff_file(test_item)
+                if sniffed.file_format == 'fastq':
+                    kwargs['interleaved'] = sniffed.interleaved
         
         if file_format is None:
             raise ValueError("Cannot guess file format")
@@ -95,4 +170,23 @@ def open(
         file_format = get_format(file_format)
     
     files = (files1, files2) if files2 else (files1,)
-    return file_format.open(*files, mode=mode, **kwargs)
+    return file_format.open(*files, mode=mode.value, **kwargs)
+
+def sort(input, output, key: str = 'name', memory='4G', threads: int = None,
+         **kwargs) -> int:
+    """Sort reads by name, sequence or minimizer with bounded memory, spilling
+    sorted runs to temporary files. Paired-end reads are sorted jointly.
+    
+    Args:
+        input: A reader, a path, or a tuple of two paths for paired-end files.
+        output: A writer, a path, or a tuple of two paths.
+        key: 'name', 'sequence' or 'minimizer'.
+        memory: The approximate amount of memory to use, e.g. '4G'.
+        threads: The number of threads that sort runs.
+        kwargs: Additional arguments to :func:`seqio.sorting.sort`.
+    
+    Returns:
+        The number of records (or pairs) written.
+    """
+    from seqio.sorting import sort
+    return sort(input, output, key, memory, threads, **kwargs)
@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""Asyncio readers and writers.
+
+The blocking work of a reader or writer (opening, decompressing, parsing,
+formatting and compressing) runs in a thread pool in whole batches, so the
+event loop makes one executor call per batch rather than per record. All
+readers and writers share one bounded pool (see :func:`get_executor`) unless
+given their own executor.
+
+A reader fetches the next batch in the background while the current one is
+consumed, and only one call per reader or writer is running at any time.
+Cancelling a task that is awaiting a batch does not lose the batch, and
+`aclose` waits for any running call to finish before closing the underlying
+file, even if the closing task is itself cancelled.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+import os
+from threading import Lock
+from seqio.io import DEFAULT_BATCH_SIZE
+
+DEFAULT_THREADS = min(8, (os.cpu_count() or 1) + 2)
+"""Default number of threads in the shared executor."""
+
+DEFAULT_WRITE_BATCH_SIZE = 4096
+"""Default number of records buffered by :meth:`AsyncWriter.write` before they
+are written in one executor call."""
+
+_executor = None
+_executor_lock = Lock()
+
+def get_executor() -> ThreadPoolExecutor:
+    """Returns the thread pool shared by all asyncio readers and writers,
+    creating it (with `DEFAULT_THREADS` threads) on first use.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                DEFAULT_THREADS, thread_name_prefix='seqio-aio')
+        return _executor
+
+class AsyncSeqIO(object):
+    """Base class for asyncio wrappers of readers and writers.
+
+    Args:
+        seqio: The reader or writer.
+        executor: The executor that runs blocking calls. Defaults to the
+            shared executor.
+    """
+    def __init__(self, seqio, executor=None):
+        self.seqio = seqio
+        self.executor = executor or get_executor()
+        self._running = None
+        self._closing = None
+
+    @property
+    def name(self):
+        return self.seqio.name
+
+    @property
+    def paired(self) -> bool:
+        return self.seqio.paired
+
+    @property
+    def closed(self) -> bool:
+        return self._closing is not None
+
+    def _submit(self, fn, *args):
+        """Schedules `fn(*args)` to run in the executor once the previous call
+        finishes.
+
+        Returns:
+            The task of the call.
+        """
+        loop = asyncio.get_running_loop()
+        previous = self._running
+        async def run():
+            if previous is not None:
+                await asyncio.wait((previous,))
+            return await loop.run_in_executor(self.executor, fn, *args)
+        self._running = asyncio.ensure_future(run())
+        return self._running
+
+    async def _run(self, fn, *args):
+        """Runs `fn(*args)` in the executor once the previous call finishes.
+        The call is shielded from cancellation, so it always runs to
+        completion.
+        """
+        if self._closing is not None:
+            raise ValueError("I/O operation on closed {}".format(self.name))
+        return await asyncio.shield(self._submit(fn, *args))
+
+    async def _close(self):
+        if self._running is not None:
+            await asyncio.wait((self._running,))
+        await asyncio.get_running_loop().run_in_executor(
+            self.executor, self.seqio.close)
+
+    async def aclose(self):
+        """Closes the reader or writer once any running call has finished.
+        """
+        if self._closing is None:
+            self._closing = asyncio.ensure_future(self._close())
+        await asyncio.shield(self._closing)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exception_type, exception_value, traceback):
+        await self.aclose()
+
+    def __repr__(self):
+        return "<{0}(seqio={1!r})>".format(self.__class__.__name__, self.seqio)
+
+class AsyncReader(AsyncSeqIO):
+    """Iterates asynchronously over the records of a reader (`async for`).
+    Records are parsed `size` at a time in the executor, and the next batch is
+    fetched while the records of the current one are yielded.
+
+    Args:
+        reader: A reader, e.g. from :func:`seqio.open`.
+        size: The number of records per batch.
+        executor: The executor that runs blocking calls.
+    """
+    def __init__(self, reader, size: int = DEFAULT_BATCH_SIZE, executor=None):
+        super(AsyncReader, self).__init__(reader, executor)
+        self.size = size
+        self._batches = None
+        self._next_batch = None
+        self._records = iter(())
+
+    def _fetch(self):
+        """Reads the next batch (a :class:`seqio.batch.RecordBatch`, a tuple
+        of aligned batches, or a list of records for readers without batch
+        support), or None at the end of the input.
+        """
+        if self._batches is None:
+            if hasattr(self.seqio, 'iter_batches'):
+                self._batches = self.seqio.iter_batches(self.size)
+            else:
+                reader = iter(self.seqio)
+                self._batches = iter(
+                    lambda: list(islice(reader, self.size)), [])
+        return next(self._batches, None)
+
+    async def next_batch(self):
+        """Returns the next batch, or None at the end of the input. Must not
+        be mixed with iterating over records.
+        """
+        if self._next_batch is None:
+            self._next_batch = asyncio.ensure_future(self._run(self._fetch))
+        try:
+            batch = await asyncio.shield(self._next_batch)
+        except asyncio.CancelledError:
+            # the batch is kept for the next call unless the fetch itself
+            # was cancelled
+            if self._next_batch.cancelled():
+                self._next_batch = None
+            raise
+        self._next_batch = None
+        if batch is not None and self._closing is None:
+            self._next_batch = asyncio.ensure_future(self._run(self._fetch))
+            # retrieve any exception so that it is not logged if the
+            # prefetched batch is never awaited
+            self._next_batch.add_done_callback(_ignore_result)
+        return batch
+
+    async def iter_batches(self):
+        """Iterate asynchronously over batches.
+        """
+        while True:
+            batch = await self.next_batch()
+            if batch is None:
+                return
+            yield batch
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while True:
+            record = next(self._records, None)
+            if record is not None:
+                return record
+            batch = await self.next_batch()
+            if batch is None:
+                raise StopAsyncIteration()
+            if isinstance(batch, tuple):
+                self._records = zip(*batch)
+            else:
+                self._records = iter(batch)
+
+class AsyncWriter(AsyncSeqIO):
+    """Writes records and batches asynchronously. Records passed to
+    :meth:`write` are buffered and written `batch_size` at a time in the
+    executor; batches are written (in order) with one executor call each.
+
+    Args:
+        writer: A writer, e.g. from :func:`seqio.open`.
+        batch_size: The number of records buffered by :meth:`write`.
+        executor: The executor that runs blocking calls.
+    """
+    def __init__(self, writer, batch_size: int = DEFAULT_WRITE_BATCH_SIZE,
+                 executor=None):
+        super(AsyncWriter, self).__init__(writer, executor)
+        self.batch_size = batch_size
+        self._buffer = []
+
+    async def write(self, *records):
+        """Buffers a record (or a pair of records for a paired writer), and
+        writes the buffer once it holds `batch_size` records.
+        """
+        self._buffer.append(records)
+        if len(self._buffer) >= self.batch_size:
+            await self._write_buffer()
+
+    async def write_batch(self, *batches):
+        """Writes a batch (or two aligned batches for a paired writer) of
+        :class:`seqio.batch.RecordBatch` objects or sequences of records.
+        """
+        await self._write_buffer()
+        await self._run(self.seqio.write_batch, *batches)
+
+    def _write_records(self, buffer):
+        for records in buffer:
+            self.seqio.write(*records)
+
+    async def _write_buffer(self):
+        if self._buffer:
+            buffer = self._buffer
+            self._buffer = []
+            await self._run(self._write_records, buffer)
+
+    async def flush(self):
+        """Writes any buffered records and flushes the writer.
+        """
+        await self._write_buffer()
+        await self._run(self.seqio.flush)
+
+    async def _close(self):
+        # the file is closed even if the final write fails, and the error is
+        # then raised by aclose
+        try:
+            if self._buffer:
+                buffer = self._buffer
+                self._buffer = []
+                await self._submit(self._write_records, buffer)
+        finally:
+            await super(AsyncWriter, self)._close()
+
+def _ignore_result(future):
+    if not future.cancelled():
+        future.exception()
+
+class AsyncOpener(object):
+    """The result of :func:`open`: await it for the reader or writer, or use
+    it as an async context manager to also close it.
+    """
+    def __init__(self, args, kwargs, size, executor):
+        self.args = args
+        self.kwargs = kwargs
+        self.size = size
+        self.executor = executor or get_executor()
+        self._seqio = None
+
+    async def _open(self):
+        import seqio
+        loop = asyncio.get_running_loop()
+        opened = await loop.run_in_executor(
+            self.executor, partial(seqio.open, *self.args, **self.kwargs))
+        if hasattr(opened, 'write_batch'):
+            return AsyncWriter(
+                opened, self.size or DEFAULT_WRITE_BATCH_SIZE, self.executor)
+        return AsyncReader(
+            opened, self.size or DEFAULT_BATCH_SIZE, self.executor)
+
+    def __await__(self):
+        return self._open().__await__()
+
+    async def __aenter__(self):
+        self._seqio = await self._open()
+        return self._seqio
+
+    async def __aexit__(self, exception_type, exception_value, traceback):
+        await self._seqio.aclose()
+
+def open(*args, size: int = None, executor=None, **kwargs) -> AsyncOpener:
+    """Open a sequence file for asynchronous reading or writing. Arguments
+    are as for :func:`seqio.open`, which is called in the executor.
+
+    Args:
+        size: The number of records per batch read by a reader, or buffered
+            by :meth:`AsyncWriter.write`.
+        executor: The executor that runs blocking calls. Defaults to the
+            shared executor.
+
+    Returns:
+        An :class:`AsyncOpener`, which is awaited (`await seqio.aio.open(...)`)
+        for an :class:`AsyncReader` or :class:`AsyncWriter`, or used as an async
+        context manager (`async with seqio.aio.open(...) as reader`).
+    """
+    return AsyncOpener(args, kwargs, size, executor)
@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""Columnar batches of sequence records.
+"""
+import numpy as np
+from seqio._utils import (
+    gather_ranges, reverse_batch, reverse_complement_batch)
+from seqio.sequences import Sequence
+
+UINT32_MAX = 2 ** 32 - 1
+
+def offsets_dtype(total: int):
+    """Returns the smallest offset dtype that can address `total` bytes.
+    """
+    return np.uint32 if total <= UINT32_MAX else np.uint64
+
+def lengths_to_offsets(lengths) -> np.ndarray:
+    """Convert an array of lengths to an array of offsets (with a leading 0).
+    """
+    lengths = np.asarray(lengths, dtype=np.uint64)
+    offsets = np.zeros(len(lengths) + 1, dtype=np.uint64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets.astype(offsets_dtype(int(offsets[-1])), copy=False)
+
+class RecordBatch(object):
+    """A batch of records stored in columnar form. Each field is stored as a
+    single concatenated byte buffer (a NumPy uint8 array) plus an offset array
+    with one more element than there are records, the same layout as an Arrow
+    binary column. The i'th name is `names[name_offsets[i]:name_offsets[i+1]]`.
+    Sequences and qualities have the same lengths, so they share `offsets`.
+
+    Args:
+        names: Concatenated record names.
+        name_offsets: Offsets of the names (uint32 or uint64).
+        sequences: Concatenated sequences.
+        offsets: Offsets of the sequences and qualities (uint32 or uint64).
+        qualities: Concatenated qualities, or None if the format does not
+            deliver qualities.
+        sequence_class: The class of the records created when a batch is
+            indexed or iterated.
+    """
+    def __init__(self, names, name_offsets, sequences, offsets,
+                 qualities=None, sequence_class=Sequence):
+        self.names = names
+        self.name_offsets = name_offsets
+        self.sequences = sequences
+        self.offsets = offsets
+        self.qualities = qualities
+        self.sequence_class = sequence_class
+
+    @classmethod
+    def from_records(cls, records, sequence_class=Sequence) -> 'RecordBatch':
+        """Create a batch from a sequence of records.
+        """
+        names = [record.name for record in records]
+        sequences = [record.sequence for record in records]
+        qualities = None
+        if records and records[0].has_qualities:
+            qualities = np.frombuffer(
+                b''.join(record.qualities for record in records),
+                dtype=np.uint8)
+        return cls(
+            np.frombuffer(b''.join(names), dtype=np.uint8),
+            lengths_to_offsets([len(name) for name in names]),
+            np.frombuffer(b''.join(sequences), dtype=np.uint8),
+            lengths_to_offsets([len(seq) for seq in sequences]),
+            qualities, sequence_class)
+
+    @classmethod
+    def concat(cls, batches) -> 'RecordBatch':
+        """Concatenate batches into a single batch.
+        """
+        batches = list(batches)
+        if len(batches) == 1:
+            return batches[0]
+        def concat_offsets(offsets):
+            lengths = np.concatenate([np.diff(o) for o in offsets])
+            return lengths_to_offsets(lengths)
+        qualities = None
+        if batches[0].qualities is not None:
+            qualities = np.concatenate([b.qualities for b in batches])
+        return cls(
+            np.concatenate([b.names for b in batches]),
+            concat_offsets([b.name_offsets for b in batches]),
+            np.concatenate([b.sequences for b in batches]),
+            concat_offsets([b.offsets for b in batches]),
+            qualities, batches[0].sequence_class)
+
+    @classmethod
+    def interleave(cls, batch1, batch2) -> 'RecordBatch':
+        """Create a batch that alternates between the records of two aligned
+        batches: batch1[0], batch2[0], batch1[1], batch2[1]...
+        """
+        count = len(batch1)
+        if len(batch2) != count:
+            raise ValueError("Batches have different numbers of records")
+        order = np.arange(2 * count).reshape(2, count).T.ravel()
+        return cls.concat((batch1, batch2)).take(order)
+
+    @property
+    def has_qualities(self) -> bool:
+        return self.qualities is not None
+
+    @property
+    def lengths(self) -> np.ndarray:
+        """The length of each sequence.
+        """
+        return np.diff(self.offsets)
+
+    @property
+    def name_lengths(self) -> np.ndarray:
+        """The length of each name.
+        """
+        return np.diff(self.name_offsets)
+
+    @property
+    def nbytes(self) -> int:
+        """The total size of the byte buffers and offset arrays.
+        """
+        return sum(
+            arr.nbytes for arr in (
+                self.names, self.name_offsets, self.sequences, self.offsets,
+                self.qualities)
+            if arr is not None)
+
+    def get_name(self, i: int) -> bytes:
+        return self.names[
+            self.name_offsets[i]:self.name_offsets[i + 1]].tobytes()
+
+    def get_sequence(self, i: int) -> bytes:
+        return self.sequences[self.offsets[i]:self.offsets[i + 1]].tobytes()
+
+    def get_qualities(self, i: int) -> bytes:
+        if self.qualities is None:
+            return None
+        return self.qualities[self.offsets[i]:self.offsets[i + 1]].tobytes()
+
+    def names_equal(self, other: 'RecordBatch') -> bool:
+        """Whether this batch has the same names, in the same order, as another
+        batch. The comparison is vectorized.
+        """
+        return (
+            np.array_equal(self.name_offsets, other.name_offsets) and
+            np.array_equal(self.names, other.names))
+
+    def reverse_complement(self) -> 'RecordBatch':
+        """Create a new batch in which every sequence is reverse-complemented
+        and every quality string is reversed. Names and offsets are shared.
+        """
+        qualities = None
+        if self.qualities is not None:
+            qualities = reverse_batch(self.qualities, self.offsets)
+        return RecordBatch(
+            self.names, self.name_offsets,
+            reverse_complement_batch(self.sequences, self.offsets),
+            self.offsets, qualities, self.sequence_class)
+
+    def take(self, indices) -> 'RecordBatch':
+        """Create a new batch from the records at `indices` (an integer array
+        or boolean mask).
+        """
+        indices = np.arange(len(self))[indices]
+        def gather(data, offsets):
+            starts = offsets[:-1][indices].astype(np.int64)
+            lengths = offsets[1:][indices].astype(np.int64) - starts
+            return gather_ranges(data, starts, lengths), lengths_to_offsets(
+                lengths)
+        names, name_offsets = gather(self.names, self.name_offsets)
+        sequences, offsets = gather(self.sequences, self.offsets)
+        qualities = None
+        if self.qualities is not None:
+            qualities = gather(self.qualities, self.offsets)[0]
+        return RecordBatch(
+            names, name_offsets, sequences, offsets, qualities,
+            self.sequence_class)
+
+    def filter(self, mask) -> 'RecordBatch':
+        """Create a new batch from the records where `mask` (a boolean array
+        with one element per record) is True. Returns this batch if every
+        record is kept.
+        """
+        mask = np.asarray(mask, dtype=bool)
+        if len(mask) != len(self):
+            raise ValueError(
+                "Mask has {0} elements but the batch has {1} records".format(
+                    len(mask), len(self)))
+        if mask.all():
+            return self
+        return self.take(mask)
+
+    def trim(self, starts=None, stops=None) -> 'RecordBatch':
+        """Create a new batch in which each record's sequence and qualities are
+        cut to the window [starts[i], stops[i]) (positions within the record,
+        e.g. from the kernels in :mod:`seqio.qc`). Names are shared.
+
+        Args:
+            starts: The first position to keep in each record; defaults to 0.
+            stops: The position after the last one to keep; defaults to (and
+                is clipped to) the record length.
+        """
+        lengths = self.lengths.astype(np.int64)
+        starts = (
+            np.zeros(len(self), dtype=np.int64) if starts is None
+            else np.asarray(starts, dtype=np.int64))
+        stops = (
+            lengths if stops is None
+            else np.minimum(np.asarray(stops, dtype=np.int64), lengths))
+        new_lengths = np.maximum(stops - starts, 0)
+        record_starts = self.offsets[:-1].astype(np.int64) + starts
+        qualities = None
+        if self.qualities is not None:
+            qualities = gather_ranges(
+                self.qualities, record_starts, new_lengths)
+        return RecordBatch(
+            self.names, self.name_offsets,
+            gather_ranges(self.sequences, record_starts, new_lengths),
+            lengths_to_offsets(new_lengths), qualities, self.sequence_class)
+
+    def slice(self, start: int, stop: int) -> 'RecordBatch':
+        """Create a batch of the records in [start, stop) without copying the
+        buffers.
+        """
+        stop = min(stop, len(self))
+        name_offsets = self.name_offsets[start:stop + 1]
+        offsets = self.offsets[start:stop + 1]
+        qualities = None
+        if self.qualities is not None:
+            qualities = self.qualities[offsets[0]:offsets[-1]]
+        return RecordBatch(
+            self.names[name_offsets[0]:name_offsets[-1]],
+            name_offsets - name_offsets[0],
+            self.sequences[offsets[0]:offsets[-1]],
+            offsets - offsets[0],
+            qualities, self.sequence_class)
+
+    def iter_views(self):
+        """Iterate over zero-copy :class:`seqio.views.SequenceView`s of the
+        records in this batch.
+        """
+        from seqio.views import ViewIterator
+        return ViewIterator(self)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int):
+        """Returns the i'th record as an instance of `sequence_class`.
+        """
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.sequence_class(
+            self.get_name(i), self.get_sequence(i), self.get_qualities(i))
+
+    def __iter__(self):
+        from seqio.views import RecordIterator
+        return RecordIterator(self)
+
+    def __repr__(self):
+        return "<RecordBatch(size={0}, nbytes={1})>".format(
+            len(self), self.nbytes)
+
+def rebatch(batches, size: int):
+    """Re-partition a stream of batches into batches of exactly `size` records
+    (the last batch may be smaller). Batches are sliced without copying where
+    possible and concatenated only when a batch spans input batches.
+
+    Args:
+        batches: An iterable of :class:`RecordBatch`, or of tuples of aligned
+            batches (which are re-partitioned together).
+        size: The number of records per output batch.
+
+    Yields:
+        Batches, or tuples of aligned batches.
+    """
+    pending = []
+    pending_size = 0
+    for item in batches:
+        paired = isinstance(item, tuple)
+        if not paired:
+            item = (item,)
+        start = 0
+        count = len(item[0])
+        while start < count:
+            stop = min(count, start + size - pending_size)
+            pending.append(tuple(b.slice(start, stop) for b in item))
+            pending_size += stop - start
+            start = stop
+            if pending_size == size:
+                out = tuple(map(RecordBatch.concat, zip(*pending)))
+                yield out if paired else out[0]
+                pending = []
+                pending_size = 0
+    if pending:
+        out = tuple(map(RecordBatch.concat, zip(*pending)))
+        yield out if paired else out[0]
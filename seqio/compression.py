@@ -0,0 +1,713 @@
+# -*- coding: utf-8 -*-
+"""Compression and decompression backends.
+
+Gzip files are decompressed by the fastest available backend: an external
+`igzip` or `pigz` process, or the in-process `isal` or `zlib-ng` bindings,
+falling back to the standard library. Other compression formats are opened
+with xphyle. By default, decompression runs in a dedicated thread that hands
+large blocks to the parser, so decompressing the next block overlaps with
+parsing the current one.
+
+BGZF files (the blocked gzip variant written by `bgzip`) are detected and
+their independent blocks are decompressed across a thread pool. A position
+in a BGZF file is addressed by a virtual offset: the file offset of a
+compressed block shifted left by 16 bits, plus the offset within the
+decompressed block.
+
+When writing, :class:`BlockCompressedWriter` splits the output into
+independent blocks (multi-member gzip or BGZF) and compresses them across a
+thread pool.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+from importlib.util import find_spec
+import io
+import os
+from pathlib import PurePath
+from shutil import which
+import struct
+from subprocess import Popen, PIPE, DEVNULL
+from typing import Union
+import zlib
+from seqio.utils import BackgroundIterator
+from xphyle import xopen
+
+DEFAULT_BLOCK_SIZE = 4 * 1024 * 1024
+"""Default number of decompressed bytes handed off by a decompression thread.
+"""
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+BGZF_MAGIC = b'\x1f\x8b\x08\x04'
+"""Gzip magic number, deflate method and FEXTRA flag."""
+
+BGZF_EOF = bytes.fromhex(
+    '1f8b08040000000000ff0600424302001b0003000000000000000000')
+"""The empty block that terminates a BGZF file."""
+
+BGZF_MAX_DATA = 65280
+"""The maximum number of uncompressed bytes per BGZF block written by
+`bgzip`."""
+
+GZIP_HEADER = GZIP_MAGIC + b'\x08\x00\x00\x00\x00\x00\x00\xff'
+"""Header of a gzip member with no flags, modification time or OS."""
+
+BLOCK_FORMATS = ('gzip', 'bgzf')
+"""Formats written by :class:`BlockCompressedWriter`."""
+
+DEFAULT_COMPRESSION_LEVEL = 6
+
+DEFAULT_MEMBER_SIZE = 1024 * 1024
+"""Default number of uncompressed bytes per member of a multi-member gzip
+file."""
+
+COMPRESSION_TASK_SIZE = 1024 * 1024
+"""Approximate number of uncompressed bytes compressed per thread pool task.
+"""
+
+COMPRESSION_MAGIC = (
+    (GZIP_MAGIC, 'gzip'),
+    (b'BZh', 'bz2'),
+    (b'\xfd7zXZ\x00', 'xz'),
+    (b'\x28\xb5\x2f\xfd', 'zstd'),
+)
+"""Magic numbers of the compression formats that can be read."""
+
+try:
+    from isal import isal_zlib as _zlib
+except ImportError:
+    import zlib as _zlib
+
+class Decompressor(object):
+    """Base class for gzip decompression backends.
+
+    Subclasses must provide:
+    * A member 'name'
+    * A function 'available(self)'
+    * A function 'open(self, path)' that returns a binary file-like object
+      of the decompressed data.
+    """
+    name = None
+
+    def available(self) -> bool:
+        raise NotImplementedError()
+
+    def open(self, path):
+        raise NotImplementedError()
+
+    def __repr__(self):
+        return "<{0}(name={1!r})>".format(self.__class__.__name__, self.name)
+
+class ProcessDecompressor(Decompressor):
+    """Decompresses with an external program that writes to stdout.
+
+    Args:
+        name: The backend name.
+        executable: The program name.
+        args: Arguments to the program, before the path.
+    """
+    def __init__(self, name, executable, args=('-dc',)):
+        self.name = name
+        self.executable = executable
+        self.args = tuple(args)
+
+    def available(self) -> bool:
+        return which(self.executable) is not None
+
+    def open(self, path):
+        path = os.fspath(path)
+        return io.BufferedReader(ProcessFile(
+            [which(self.executable)] + list(self.args) + [path], path))
+
+class ModuleDecompressor(Decompressor):
+    """Decompresses in-process with a module that provides a gzip-compatible
+    `open` function.
+
+    Args:
+        name: The backend name.
+        module: The name of the module that provides `open`.
+    """
+    def __init__(self, name, module):
+        self.name = name
+        self.module = module
+
+    def available(self) -> bool:
+        try:
+            return find_spec(self.module) is not None
+        except ImportError:
+            return False
+
+    def open(self, path):
+        return import_module(self.module).open(path, 'rb')
+
+class ProcessFile(io.RawIOBase):
+    """Raw binary reader over the stdout of a process. A non-zero exit status
+    is raised as an IOError at the end of the stream.
+
+    Args:
+        args: The command to run.
+        name: The name of the file being read.
+    """
+    def __init__(self, args, name=None):
+        super(ProcessFile, self).__init__()
+        self.args = args
+        self.name = name
+        self.process = Popen(
+            args, stdout=PIPE, stderr=PIPE, stdin=DEVNULL, bufsize=0)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buf) -> int:
+        size = self.process.stdout.readinto(buf)
+        if not size:
+            returncode = self.process.wait()
+            if returncode != 0:
+                raise IOError("{0} exited with status {1}: {2}".format(
+                    self.args[0], returncode,
+                    self.process.stderr.read().decode(
+                        errors='replace').strip()))
+        return size
+
+    def close(self):
+        if not self.closed:
+            if self.process.poll() is None:
+                self.process.terminate()
+            self.process.stdout.close()
+            self.process.stderr.close()
+            self.process.wait()
+        super(ProcessFile, self).close()
+
+DECOMPRESSORS = (
+    ProcessDecompressor('igzip', 'igzip', ('-dc',)),
+    ProcessDecompressor('pigz', 'pigz', ('-dc',)),
+    ModuleDecompressor('isal', 'isal.igzip'),
+    ModuleDecompressor('zlib-ng', 'zlib_ng.gzip_ng'),
+    ModuleDecompressor('zlib', 'gzip'),
+)
+"""Gzip decompression backends, in order of preference."""
+
+def get_decompressor(name: str = None) -> Decompressor:
+    """Returns a gzip decompression backend.
+
+    Args:
+        name: The name of a backend in `DECOMPRESSORS`, or None to select the
+            first one that is available.
+
+    Returns:
+        A :class:`Decompressor`.
+
+    Raises:
+        ValueError if the named backend is unknown or not available.
+    """
+    if name == BGZF.name:
+        return BGZF
+    for decompressor in DECOMPRESSORS:
+        if name is None or decompressor.name == name:
+            if decompressor.available():
+                return decompressor
+            if name is not None:
+                raise ValueError(
+                    "Decompressor {0!r} is not available".format(name))
+    raise ValueError("Unknown decompressor {0!r}; expected one of {1}".format(
+        name, ', '.join(d.name for d in DECOMPRESSORS)))
+
+def is_gzip(path) -> bool:
+    """Whether a file starts with the gzip magic number.
+    """
+    with io.open(path, 'rb') as fileobj:
+        return fileobj.read(2) == GZIP_MAGIC
+
+def is_bgzf(path) -> bool:
+    """Whether a file starts with a BGZF block.
+    """
+    with io.open(path, 'rb') as fileobj:
+        try:
+            return read_bgzf_block(fileobj) is not None
+        except IOError:
+            return False
+
+def guess_compression(prefix: bytes) -> str:
+    """Identifies the compression of a file from its first bytes.
+
+    Returns:
+        'bgzf', 'gzip', 'bz2', 'xz' or 'zstd', or None if the prefix does not
+        start with a known magic number.
+    """
+    # bgzip writes the 'BC' subfield first
+    if prefix[:4] == BGZF_MAGIC and prefix[12:14] == b'BC':
+        return 'bgzf'
+    for magic, compression in COMPRESSION_MAGIC:
+        if prefix.startswith(magic):
+            return compression
+    return None
+
+def decompress_prefix(prefix: bytes, compression: str) -> bytes:
+    """Decompresses as much as possible of the first bytes of a compressed
+    file. The result is empty if the prefix is too short to decompress any
+    data (e.g. less than one bzip2 block), or if the compression format is not
+    supported in-process.
+    """
+    if compression in ('gzip', 'bgzf'):
+        decompressor = zlib.decompressobj(31)
+    elif compression == 'bz2':
+        decompressor = import_module('bz2').BZ2Decompressor()
+    elif compression == 'xz':
+        decompressor = import_module('lzma').LZMADecompressor()
+    elif compression == 'zstd' and find_spec('zstandard') is not None:
+        decompressor = import_module('zstandard').ZstdDecompressor(
+            ).decompressobj()
+    else:
+        return b''
+    try:
+        return decompressor.decompress(prefix)
+    except Exception:
+        return b''
+
+# BGZF
+
+def make_virtual_offset(block_offset: int, within_block: int) -> int:
+    """Combines the file offset of a BGZF block and an offset within the
+    decompressed block into a virtual offset.
+    """
+    if not 0 <= within_block < 65536:
+        raise ValueError(
+            "Offset within block must be < 65536: {}".format(within_block))
+    return (block_offset << 16) | within_block
+
+def split_virtual_offset(virtual_offset: int):
+    """Splits a virtual offset into a tuple (block_offset, within_block).
+    """
+    return (virtual_offset >> 16, virtual_offset & 0xFFFF)
+
+def read_bgzf_block(fileobj):
+    """Reads the next raw BGZF block from a file.
+
+    Returns:
+        The compressed data and the gzip trailer (CRC32 and ISIZE), or None at
+        the end of the file.
+
+    Raises:
+        IOError if the file is not BGZF.
+    """
+    header = fileobj.read(12)
+    if not header:
+        return None
+    if len(header) < 12 or header[:4] != BGZF_MAGIC:
+        raise IOError("Invalid BGZF block header")
+    xlen = struct.unpack('<H', header[10:12])[0]
+    extra = fileobj.read(xlen)
+    bsize = None
+    i = 0
+    while i + 4 <= len(extra):
+        slen = struct.unpack('<H', extra[i + 2:i + 4])[0]
+        if extra[i:i + 2] == b'BC' and slen == 2:
+            bsize = struct.unpack('<H', extra[i + 4:i + 6])[0]
+        i += 4 + slen
+    if bsize is None:
+        raise IOError("gzip block has no BGZF block size field")
+    size = bsize + 1 - 12 - xlen
+    data = fileobj.read(size)
+    if len(data) != size or size < 8:
+        raise IOError("Truncated BGZF block")
+    return data
+
+def inflate_bgzf_block(data) -> bytes:
+    """Decompresses a block returned by :func:`read_bgzf_block` and verifies
+    its length and CRC32.
+    """
+    crc, isize = struct.unpack('<II', data[-8:])
+    block = _zlib.decompress(memoryview(data)[:-8], -15, max(isize, 1))
+    if len(block) != isize or _zlib.crc32(block) != crc:
+        raise IOError("BGZF block is corrupt")
+    return block
+
+def deflate_bgzf_block(
+        data, level: int = DEFAULT_COMPRESSION_LEVEL) -> bytes:
+    """Compresses up to 65280 bytes into a single BGZF block.
+    """
+    if len(data) > BGZF_MAX_DATA:
+        raise ValueError("BGZF blocks hold at most {} bytes".format(
+            BGZF_MAX_DATA))
+    # the standard zlib is used for compression because isal only supports
+    # levels 0-3
+    cdata = zlib.compress(data, level, -15)
+    header = BGZF_MAGIC + struct.pack(
+        '<IBBHBBHH', 0, 0, 0xff, 6, 66, 67, 2, len(cdata) + 25)
+    return header + cdata + struct.pack(
+        '<II', zlib.crc32(data) & 0xffffffff, len(data))
+
+def deflate_gzip_member(
+        data, level: int = DEFAULT_COMPRESSION_LEVEL) -> bytes:
+    """Compresses data into a single gzip member. Concatenated members form a
+    valid gzip file.
+    """
+    return GZIP_HEADER + zlib.compress(data, level, -15) + struct.pack(
+        '<II', zlib.crc32(data) & 0xffffffff, len(data) & 0xffffffff)
+
+class BgzfReader(io.BufferedIOBase):
+    """Reads a BGZF file, decompressing blocks ahead of the read position in
+    a pool of threads (zlib releases the GIL while inflating, so the blocks
+    are decompressed in parallel).
+
+    Args:
+        path: The file path.
+        threads: The number of decompression threads; 0 to decompress in the
+            calling thread. Defaults to the number of CPUs.
+        queue_size: The maximum number of blocks read ahead. Defaults to four
+            per thread.
+    """
+    def __init__(self, path, threads: int = None, queue_size: int = None):
+        super(BgzfReader, self).__init__()
+        self.name = os.fspath(path)
+        self.raw = io.open(self.name, 'rb')
+        if threads is None:
+            threads = os.cpu_count() or 1
+        self.threads = threads
+        self.queue_size = queue_size or 4 * max(threads, 1)
+        self._executor = ThreadPoolExecutor(threads) if threads else None
+        self._pending = deque()
+        self._eof = False
+        self._block = b''
+        self._block_start = self._block_end = 0
+        self._pos = 0
+
+    def _fill_queue(self):
+        while not self._eof and len(self._pending) < self.queue_size:
+            offset = self.raw.tell()
+            data = read_bgzf_block(self.raw)
+            if data is None:
+                self._eof = True
+                break
+            if self._executor:
+                data = self._executor.submit(inflate_bgzf_block, data)
+            self._pending.append((offset, self.raw.tell(), data))
+
+    def _next_block(self) -> bool:
+        """Makes the next non-empty block current. Returns False at the end of
+        the file.
+        """
+        while True:
+            self._fill_queue()
+            if not self._pending:
+                return False
+            self._block_start, self._block_end, data = (
+                self._pending.popleft())
+            if self._executor:
+                self._block = data.result()
+            else:
+                self._block = inflate_bgzf_block(data)
+            self._pos = 0
+            if self._block:
+                return True
+
+    def _cancel(self):
+        for _, _, data in self._pending:
+            if self._executor:
+                data.cancel()
+        self._pending.clear()
+
+    def readable(self) -> bool:
+        return True
+
+    def read1(self, size: int = -1) -> bytes:
+        if self._pos >= len(self._block) and not self._next_block():
+            return b''
+        end = len(self._block) if size < 0 else self._pos + size
+        data = self._block[self._pos:end]
+        self._pos += len(data)
+        return data
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None:
+            size = -1
+        parts = []
+        while size != 0:
+            data = self.read1(size)
+            if not data:
+                break
+            parts.append(data)
+            if size > 0:
+                size -= len(data)
+        return b''.join(parts)
+
+    def readinto(self, buf) -> int:
+        data = self.read(len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+    def readline(self, size: int = -1) -> bytes:
+        if size is None:
+            size = -1
+        parts = []
+        while size != 0:
+            if self._pos >= len(self._block) and not self._next_block():
+                break
+            end = self._block.find(b'\n', self._pos) + 1 or len(self._block)
+            if size > 0:
+                end = min(end, self._pos + size)
+                size -= end - self._pos
+            parts.append(self._block[self._pos:end])
+            self._pos = end
+            if parts[-1].endswith(b'\n'):
+                break
+        return b''.join(parts)
+
+    def tell_virtual(self) -> int:
+        """Returns the virtual offset of the current position.
+        """
+        if self._pos >= len(self._block):
+            return make_virtual_offset(self._block_end, 0)
+        return make_virtual_offset(self._block_start, self._pos)
+
+    def seek_virtual(self, virtual_offset: int):
+        """Moves to a virtual offset, such as one returned by `tell_virtual`
+        or read from an index.
+        """
+        block_offset, within_block = split_virtual_offset(virtual_offset)
+        self._cancel()
+        self.raw.seek(block_offset)
+        self._eof = False
+        self._block = b''
+        self._block_start = self._block_end = block_offset
+        self._pos = 0
+        if within_block:
+            if not self._next_block() or within_block > len(self._block):
+                raise IOError(
+                    "Invalid virtual offset {}".format(virtual_offset))
+            self._pos = within_block
+
+    def close(self):
+        if not self.closed:
+            self._cancel()
+            if self._executor:
+                self._executor.shutdown()
+            self.raw.close()
+        super(BgzfReader, self).close()
+
+class BgzfDecompressor(Decompressor):
+    """Decompresses BGZF files with :class:`BgzfReader`.
+    """
+    name = 'bgzf'
+
+    def available(self) -> bool:
+        return True
+
+    def open(self, path, threads: int = None):
+        return BgzfReader(path, threads)
+
+BGZF = BgzfDecompressor()
+
+class ThreadedReader(io.RawIOBase):
+    """Raw binary reader that reads (and decompresses) a file in a background
+    thread, in blocks of `block_size` bytes. The file is opened in the thread
+    on the first read.
+
+    Args:
+        opener: A callable that returns a binary file-like object.
+        name: The file name.
+        block_size: The number of bytes per block.
+        queue_size: The maximum number of blocks read ahead.
+    """
+    def __init__(self, opener, name=None, block_size: int = DEFAULT_BLOCK_SIZE,
+                 queue_size: int = 4):
+        super(ThreadedReader, self).__init__()
+        self.opener = opener
+        self.name = name
+        self.block_size = block_size
+        self.queue_size = queue_size
+        self._blocks = None
+        self._block = memoryview(b'')
+
+    def _iter_blocks(self):
+        with self.opener() as fileobj:
+            while True:
+                block = fileobj.read(self.block_size)
+                if not block:
+                    return
+                yield block
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buf) -> int:
+        if self._blocks is None:
+            self._blocks = BackgroundIterator(
+                self._iter_blocks(), self.queue_size,
+                name='decompress {}'.format(self.name))
+        while not self._block:
+            block = next(self._blocks, None)
+            if block is None:
+                return 0
+            self._block = memoryview(block)
+        size = min(len(buf), len(self._block))
+        buf[:size] = self._block[:size]
+        self._block = self._block[size:]
+        return size
+
+    def close(self):
+        if self._blocks is not None:
+            self._blocks.close()
+        super(ThreadedReader, self).close()
+
+class BlockCompressedWriter(io.BufferedIOBase):
+    """Writes a gzip file as a series of independently compressed blocks,
+    either gzip members or BGZF blocks. Blocks are compressed in a pool of
+    threads (zlib releases the GIL while deflating) and written in order.
+
+    Args:
+        path: The file path, or a binary file-like object.
+        compression: 'gzip' for multi-member gzip, which any gzip tool can
+            read, or 'bgzf' for BGZF, which can also be indexed.
+        threads: The number of compression threads; 0 to compress in the
+            calling thread. Defaults to the number of CPUs.
+        block_size: The number of uncompressed bytes per block. Defaults to
+            1 MiB for gzip and to (and is limited to) 65280 for BGZF.
+        level: The compression level (1-9).
+        queue_size: The maximum number of tasks in flight. Defaults to four
+            per thread.
+    """
+    def __init__(self, path, compression: str = 'gzip', threads: int = None,
+                 block_size: int = None,
+                 level: int = DEFAULT_COMPRESSION_LEVEL,
+                 queue_size: int = None):
+        super(BlockCompressedWriter, self).__init__()
+        if compression not in BLOCK_FORMATS:
+            raise ValueError("Block compression must be one of {}".format(
+                ', '.join(BLOCK_FORMATS)))
+        self.bgzf = compression == BGZF.name
+        if block_size is None:
+            block_size = BGZF_MAX_DATA if self.bgzf else DEFAULT_MEMBER_SIZE
+        if block_size < 1 or (self.bgzf and block_size > BGZF_MAX_DATA):
+            raise ValueError("Invalid block size {}".format(block_size))
+        if isinstance(path, (str, PurePath)):
+            self.name = os.fspath(path)
+            self.raw = io.open(self.name, 'wb')
+            self._close_raw = True
+        else:
+            self.name = getattr(path, 'name', None)
+            self.raw = path
+            self._close_raw = False
+        if threads is None:
+            threads = os.cpu_count() or 1
+        self.threads = threads
+        self.block_size = block_size
+        self.level = level
+        self.queue_size = queue_size or 4 * max(threads, 1)
+        self._deflate = deflate_bgzf_block if self.bgzf else deflate_gzip_member
+        self._task_size = (
+            max(1, COMPRESSION_TASK_SIZE // block_size) * block_size)
+        self._executor = ThreadPoolExecutor(threads) if threads else None
+        self._pending = deque()
+        self._buffer = bytearray()
+
+    def _compress(self, data) -> bytes:
+        data = memoryview(data)
+        return b''.join(
+            self._deflate(data[i:i + self.block_size], self.level)
+            for i in range(0, len(data), self.block_size))
+
+    def _submit(self, data):
+        if not self._executor:
+            self.raw.write(self._compress(data))
+            return
+        self._pending.append(self._executor.submit(self._compress, data))
+        while len(self._pending) >= self.queue_size:
+            self.raw.write(self._pending.popleft().result())
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        size = len(data)
+        self._buffer += data
+        if len(self._buffer) >= self._task_size:
+            end = len(self._buffer) - len(self._buffer) % self._task_size
+            with memoryview(self._buffer) as view:
+                full = view[:end].tobytes()
+            del self._buffer[:end]
+            for i in range(0, end, self._task_size):
+                self._submit(memoryview(full)[i:i + self._task_size])
+        return size
+
+    def flush(self):
+        """Compresses any buffered data (as a possibly short block) and writes
+        all pending blocks.
+        """
+        if self._buffer:
+            self._submit(bytes(self._buffer))
+            self._buffer = bytearray()
+        while self._pending:
+            self.raw.write(self._pending.popleft().result())
+        self.raw.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            super(BlockCompressedWriter, self).close()
+            if self.bgzf:
+                self.raw.write(BGZF_EOF)
+        finally:
+            if self._executor:
+                self._executor.shutdown()
+            if self._close_raw:
+                self.raw.close()
+
+def open_compressed(path, compression: str = None, threads: int = None,
+                    **kwargs):
+    """Opens a file for writing.
+
+    Args:
+        path: The file path, or a binary file-like object.
+        compression: 'gzip' or 'bgzf' to compress blocks in parallel with
+            :class:`BlockCompressedWriter`; otherwise the file is opened with
+            xphyle, which compresses according to `compression` (if given)
+            or the file extension.
+        threads: The number of compression threads for block compression.
+        kwargs: Additional arguments to :class:`BlockCompressedWriter` or
+            `xphyle.xopen`.
+    """
+    if compression in BLOCK_FORMATS:
+        return BlockCompressedWriter(path, compression, threads, **kwargs)
+    return xopen(path, 'wb', compression=compression, **kwargs)
+
+def open_decompressed(path, decompressor: str = None,
+                      threads: Union[bool, int] = True,
+                      block_size: int = DEFAULT_BLOCK_SIZE):
+    """Opens a (possibly compressed) file for reading.
+
+    Args:
+        path: The file path.
+        decompressor: The name of the gzip decompression backend, or None to
+            select the fastest available one (BGZF files are then read with
+            :class:`BgzfReader`).
+        threads: Whether to decompress in a background thread. For BGZF
+            files, the number of decompression threads; True for one per CPU.
+        block_size: The number of bytes per block handed off by the thread.
+
+    Returns:
+        A tuple (fileobj, backend), where backend is the
+        :class:`Decompressor` used, or None if the file is not gzipped.
+    """
+    # the compression is sniffed once per version of the file; see
+    # seqio.sniff
+    from seqio.sniff import sniff_file
+    path = os.fspath(path)
+    backend = None
+    compression = sniff_file(path).compression
+    if compression in BLOCK_FORMATS:
+        if decompressor in (None, BGZF.name) and compression == 'bgzf':
+            # True selects one thread per CPU; False decompresses in the
+            # calling thread
+            pool_size = None if threads is True else int(threads)
+            return (BGZF.open(path, pool_size), BGZF)
+        backend = get_decompressor(decompressor)
+        opener = lambda: backend.open(path)
+    else:
+        opener = lambda: xopen(path, 'rb', context_wrapper=False)
+    if not threads:
+        return (opener(), backend)
+    raw = ThreadedReader(opener, path, block_size)
+    return (io.BufferedReader(raw, block_size), backend)
@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+"""Random access to FASTA files through samtools-compatible indexes.
+
+A `.fai` index has one line per sequence with five tab-delimited columns: the
+name, the length, the (uncompressed) byte offset of the first base, the number
+of bases per line, and the number of bytes per line. BGZF-compressed files
+also need a `.gzi` index, which maps the compressed offset of each block to
+its uncompressed offset.
+"""
+from bisect import bisect_right
+from collections import OrderedDict, namedtuple
+import io
+import mmap
+import os
+import struct
+from seqio.compression import (
+    BgzfReader, is_bgzf, is_gzip, read_bgzf_block, inflate_bgzf_block)
+from seqio.io import FormatError
+
+FaiEntry = namedtuple(
+    'FaiEntry', ('name', 'length', 'offset', 'line_bases', 'line_width'))
+"""One line of a .fai index."""
+
+NEWLINES = b'\r\n'
+
+# .fai
+
+def build_fai(fileobj) -> 'OrderedDict[str, FaiEntry]':
+    """Indexes an (uncompressed) FASTA stream. As with samtools, all lines of
+    a sequence except the last must have the same length.
+
+    Args:
+        fileobj: A binary file-like object that iterates over lines.
+
+    Returns:
+        An OrderedDict mapping each sequence name to its :class:`FaiEntry`.
+    """
+    entries = OrderedDict()
+    offset = 0
+    name = None
+
+    def add_entry():
+        if name in entries:
+            raise FormatError("Duplicate sequence name {!r}".format(name))
+        entries[name] = FaiEntry(
+            name, length, seq_offset, line_bases, line_width)
+
+    for line in fileobj:
+        line_len = len(line)
+        if line[:1] == b'>':
+            if name is not None:
+                add_entry()
+            name = line[1:].split(None, 1)[0].decode()
+            seq_offset = offset + line_len
+            length = line_bases = line_width = 0
+            short_line = False
+        else:
+            bases = len(line.rstrip(NEWLINES))
+            if name is None:
+                if bases:
+                    raise FormatError(
+                        "Expected '>' at beginning of FASTA record")
+            elif bases:
+                if short_line or (line_bases and bases > line_bases):
+                    raise FormatError(
+                        "Different line lengths in sequence {!r}".format(
+                            name))
+                if not line_bases:
+                    line_bases = bases
+                    line_width = line_len
+                elif bases < line_bases or line_len != line_width:
+                    # only the last line may be shorter
+                    short_line = True
+                length += bases
+            elif line_bases:
+                short_line = True
+        offset += line_len
+    if name is not None:
+        add_entry()
+    return entries
+
+def read_fai(path) -> 'OrderedDict[str, FaiEntry]':
+    """Reads a .fai index.
+    """
+    entries = OrderedDict()
+    with io.open(path, 'rt') as fai:
+        for line in fai:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 5:
+                raise FormatError("Invalid .fai line: {!r}".format(line))
+            entries[fields[0]] = FaiEntry(
+                fields[0], *(int(field) for field in fields[1:5]))
+    return entries
+
+def write_fai(entries, path):
+    """Writes a .fai index.
+    """
+    with io.open(path, 'wt') as fai:
+        for entry in entries.values():
+            fai.write('\t'.join(str(field) for field in entry) + '\n')
+
+# .gzi
+
+def build_gzi(fileobj, compressed: int = 0, uncompressed: int = 0):
+    """Indexes the blocks of a BGZF file. Only the block headers and
+    trailers are read; nothing is decompressed.
+
+    Args:
+        fileobj: The raw (compressed) file, positioned at `compressed`.
+        compressed, uncompressed: The offsets of the first block to index,
+            for extending the index of a file that has been appended to.
+
+    Returns:
+        A list of (compressed_offset, uncompressed_offset) tuples, one per
+        block, starting with (0, 0) unless other offsets are given.
+    """
+    blocks = []
+    while True:
+        data = read_bgzf_block(fileobj)
+        if data is None:
+            return blocks
+        blocks.append((compressed, uncompressed))
+        compressed = fileobj.tell()
+        uncompressed += struct.unpack('<I', data[-4:])[0]
+
+def read_gzi(path):
+    """Reads a .gzi index (as written by `bgzip -i`).
+
+    Returns:
+        A list of (compressed_offset, uncompressed_offset) tuples, starting
+        with (0, 0).
+    """
+    with io.open(path, 'rb') as gzi:
+        count = struct.unpack('<Q', gzi.read(8))[0]
+        data = gzi.read(16 * count)
+    if len(data) != 16 * count:
+        raise FormatError("Truncated .gzi index {}".format(path))
+    values = struct.unpack('<{}Q'.format(2 * count), data)
+    return [(0, 0)] + list(zip(values[::2], values[1::2]))
+
+def write_gzi(blocks, path):
+    """Writes a .gzi index. The implicit first block (0, 0) is omitted.
+    """
+    blocks = blocks[1:]
+    with io.open(path, 'wb') as gzi:
+        gzi.write(struct.pack('<Q', len(blocks)))
+        for block in blocks:
+            gzi.write(struct.pack('<QQ', *block))
+
+def _is_current(index_path, path) -> bool:
+    return (
+        os.path.exists(index_path) and
+        os.path.getmtime(index_path) >= os.path.getmtime(path))
+
+def _try_write(write, data, path):
+    # an index that cannot be saved (e.g. in a read-only directory) is only
+    # kept in memory
+    try:
+        write(data, path)
+    except OSError:
+        pass
+
+class FastaIndex(object):
+    """Random access to the sequences of an uncompressed or BGZF-compressed
+    FASTA file. Existing `.fai` (and `.gzi`) indexes next to the file are
+    reused unless they are older than the file; otherwise the indexes are
+    built and saved. Uncompressed files are memory-mapped.
+
+    Args:
+        path: The FASTA file.
+        build: Whether to build missing indexes; if False, a missing index
+            raises an IOError.
+        cache_size: The number of decompressed BGZF blocks to cache.
+    """
+    def __init__(self, path, build: bool = True, cache_size: int = 64):
+        self.path = os.fspath(path)
+        self.bgzf = is_bgzf(self.path)
+        if not self.bgzf and is_gzip(self.path):
+            raise ValueError(
+                "Random access requires an uncompressed or BGZF-compressed "
+                "file: {}".format(self.path))
+        self._fileobj = io.open(self.path, 'rb')
+        self._data = None
+        self.cache_size = cache_size
+        self._blocks = OrderedDict()
+        if self.bgzf:
+            gzi_path = self.path + '.gzi'
+            if _is_current(gzi_path, self.path):
+                blocks = read_gzi(gzi_path)
+            elif build:
+                blocks = build_gzi(self._fileobj)
+                _try_write(write_gzi, blocks, gzi_path)
+            else:
+                raise IOError("Missing index {}".format(gzi_path))
+            self._compressed_offsets = [block[0] for block in blocks]
+            self._uncompressed_offsets = [block[1] for block in blocks]
+        elif os.path.getsize(self.path) > 0:
+            self._data = mmap.mmap(
+                self._fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+        fai_path = self.path + '.fai'
+        if _is_current(fai_path, self.path):
+            self.entries = read_fai(fai_path)
+        elif build:
+            if self.bgzf:
+                with BgzfReader(self.path) as fileobj:
+                    self.entries = build_fai(fileobj)
+            else:
+                with io.open(self.path, 'rb') as fileobj:
+                    self.entries = build_fai(fileobj)
+            _try_write(write_fai, self.entries, fai_path)
+        else:
+            raise IOError("Missing index {}".format(fai_path))
+
+    @property
+    def names(self):
+        return list(self.entries.keys())
+
+    def get_length(self, name: str) -> int:
+        return self.entries[name].length
+
+    def get_byte_range(self, name: str, start: int = 0, end: int = None):
+        """Returns the (uncompressed) byte range [start, end) that contains a
+        region, including any newlines.
+
+        Args:
+            name: The sequence name.
+            start, end: The 0-based, half-open region. `end` defaults to (and
+                is clipped to) the sequence length.
+        """
+        entry = self.entries[name]
+        if end is None or end > entry.length:
+            end = entry.length
+        if start < 0 or start > end:
+            raise ValueError("Invalid region {0}:{1}-{2}".format(
+                name, start, end))
+        if start == end:
+            return (entry.offset, entry.offset)
+        def position(pos):
+            line, col = divmod(pos, entry.line_bases)
+            return entry.offset + line * entry.line_width + col
+        return (position(start), position(end - 1) + 1)
+
+    def _get_block(self, i: int) -> bytes:
+        block = self._blocks.get(i)
+        if block is None:
+            self._fileobj.seek(self._compressed_offsets[i])
+            data = read_bgzf_block(self._fileobj)
+            block = b'' if data is None else inflate_bgzf_block(data)
+            if len(self._blocks) >= self.cache_size:
+                self._blocks.popitem(last=False)
+            self._blocks[i] = block
+        else:
+            self._blocks.move_to_end(i)
+        return block
+
+    def _read(self, start: int, end: int) -> bytes:
+        if not self.bgzf:
+            return self._data[start:end] if self._data else b''
+        parts = []
+        i = bisect_right(self._uncompressed_offsets, start) - 1
+        while start < end and i < len(self._uncompressed_offsets):
+            within = start - self._uncompressed_offsets[i]
+            part = self._get_block(i)[within:within + end - start]
+            parts.append(part)
+            start += len(part)
+            i += 1
+        return b''.join(parts)
+
+    def fetch(self, name: str, start: int = 0, end: int = None) -> bytes:
+        """Returns the bases in a region of a sequence.
+
+        Args:
+            name: The sequence name.
+            start, end: The 0-based, half-open region. `end` defaults to the
+                sequence length.
+        """
+        return self._read(
+            *self.get_byte_range(name, start, end)).translate(None, NEWLINES)
+
+    def fetch_many(self, regions) -> list:
+        """Returns the bases in many regions. Regions are read in file order,
+        so each page or block is read (and decompressed) once however the
+        regions are ordered.
+
+        Args:
+            regions: An iterable of (name, start, end) tuples; `start` and
+                `end` may be omitted.
+
+        Returns:
+            A list of bytes, in the same order as `regions`.
+        """
+        ranges = [self.get_byte_range(*region) for region in regions]
+        results = [None] * len(ranges)
+        for i in sorted(range(len(ranges)), key=ranges.__getitem__):
+            results[i] = self._read(*ranges[i]).translate(None, NEWLINES)
+        return results
+
+    def close(self):
+        if self._data is not None:
+            self._data.close()
+            self._data = None
+        self._fileobj.close()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
@@ -1,5 +1,20 @@
+import numpy as np
+from seqio.batch import RecordBatch
+from seqio.faidx import FastaIndex
+from seqio.formatters import format_fasta_batch
+from seqio.format import TextSequenceFormat, EMPTY, HASH, NEWLINE
+from seqio.io import (
+    FormatError, FileSeqIO, SeqIO, SingleReader, SingleWriter,
+    SingleFileReader, SequenceWriter)
+from seqio.sequences import Sequence
+from seqio.types import FileListArg
+
 ARROW = b'>'
 
+MIN_QUAL_VALUE = -5
+MAX_QUAL_VALUE = 255 - 33
+"""The range of values in a .QUAL file, which are encoded as phred+33."""
+
 class Fasta(TextSequenceFormat):
     name = 'fasta'
     aliases = ('fa',)
@@ -12,10 +27,10 @@ class Fasta(TextSequenceFormat):
     def read_record(self, fileobj):
         while True:
             header = next(fileobj).rstrip()
-            if header[0] != ARROW:
-                raise FormatError("Expected '>' at beginning of FASTA record")
-            elif header[0] == HASH:
+            if header[:1] == HASH:
                 continue
+            elif header[:1] != ARROW:
+                raise FormatError("Expected '>' at beginning of FASTA record")
             break
         
         seq = []
@@ -29,6 +44,28 @@ class Fasta(TextSequenceFormat):
         return self.sequence_class(
             name=header[1:], sequence=self.linesep.join(seq))
     
+    def iter_records(self, fileinput):
+        """Iterate over all records in a sequence of files. Unlike
+        `read_record`, this does not need to peek at the next line.
+        """
+        name = None
+        seq = []
+        for line in fileinput:
+            line = line.rstrip()
+            if line[:1] == ARROW:
+                if name is not None:
+                    yield self.sequence_class(name, self.linesep.join(seq))
+                name = line[1:]
+                seq = []
+            elif not line or line[:1] == HASH:
+                continue
+            elif name is None:
+                raise FormatError("Expected '>' at beginning of FASTA record")
+            else:
+                seq.append(line)
+        if name is not None:
+            yield self.sequence_class(name, self.linesep.join(seq))
+    
     def format_record(self, record):
         if self.text_wrapper:
             sequence = self.text_wrapper.fill(
@@ -36,6 +73,53 @@ class Fasta(TextSequenceFormat):
         else:
             sequence = record.sequence
         return EMPTY.join((ARROW, record.name, NEWLINE, sequence, NEWLINE))
+    
+    def format_batch(self, records):
+        if not isinstance(records, RecordBatch):
+            records = RecordBatch.from_records(
+                list(records), self.sequence_class)
+        line_length = self.text_wrapper.width if self.text_wrapper else 0
+        return format_fasta_batch(records, line_length)
+
+class FastaReader(SingleFileReader):
+    """Reader for FASTA files. Regions of an uncompressed or BGZF-compressed
+    file can also be fetched directly through a samtools-compatible index
+    (see :class:`seqio.faidx.FastaIndex`), which is loaded or built on first
+    use.
+    
+    Args:
+        path: The FASTA file.
+        file_format: An instance of :class:`Fasta`.
+        kwargs: Additional arguments passed to the file open method
+    """
+    def __init__(self, path, file_format=None, **kwargs):
+        super(FastaReader, self).__init__(
+            path, file_format=file_format or Fasta(), **kwargs)
+        self.path = path
+        self._index = None
+    
+    @property
+    def index(self) -> FastaIndex:
+        if self._index is None:
+            self._index = FastaIndex(self.path)
+        return self._index
+    
+    def fetch(self, name: str, start: int = 0, end: int = None) -> bytes:
+        """Returns the bases in the 0-based, half-open region [start, end) of
+        sequence `name`.
+        """
+        return self.index.fetch(name, start, end)
+    
+    def fetch_many(self, regions) -> list:
+        """Returns the bases in each of an iterable of (name, start, end)
+        regions, reading the file in offset order.
+        """
+        return self.index.fetch_many(regions)
+    
+    def close(self):
+        if self._index is not None:
+            self._index.close()
+        super(FastaReader, self).close()
 
 class FastaQualReader(SeqIO, SingleReader):
     """Reader for reads that are stored in .(CS)FASTA and .QUAL files.
@@ -43,18 +127,24 @@ class FastaQualReader(SeqIO, SingleReader):
     Args:
         fastafile: path or file-like object of sequences in FASTA format
         qualfile: path or file-like object of qualities in FASTA format
-        fasta_format: An instance of ``seqio.formats.Fasta``
+        sequence_class: The class of the records
         kwargs: Additional arguments passed to the file open method
     """
     delivers_qualities = True
     
     def __init__(self, fastafile, qualfile, sequence_class=Sequence, **kwargs):
-        self.fasta_reader = SingleFileReader(fastafile, Fasta(), **kwargs)
-        self.qual_reader = SingleFileReader(qualfile, Fasta(linesep=b' '), **kwargs)
+        self.fasta_reader = SingleFileReader(
+            fastafile, file_format=Fasta(), **kwargs)
+        self.qual_reader = SingleFileReader(
+            qualfile, file_format=Fasta(linesep=b' '), **kwargs)
         self.sequence_class = sequence_class
-        self.qual_conversion = {}
-        for i in range(-5, 256 - 33):
-            self.qual_conversion[str(i).encode()] = chr(i + 33).encode()
+    
+    @property
+    def name(self):
+        return self.fasta_reader.name
+    
+    def __iter__(self):
+        return self
     
     def __next__(self):
         fasta_record = next(self.fasta_reader)
@@ -66,10 +156,18 @@ class FastaQualReader(SeqIO, SingleReader):
                               "not match ({0!r} != {1!r})".format(
                               fasta_record.name, qual_record.name))
         try:
-            qualities = convert_qualities(qualread.sequence.split(b' '))
-        except KeyError as e:
+            values = np.array(qual_record.sequence.split(), dtype=np.int16)
+        except ValueError as e:
             raise FormatError("Within read named {0!r}: Found invalid quality "
-                              "value {1}".format(fasta_record.name, e))
+                              "value ({1})".format(fasta_record.name, e))
+        if values.size and not (
+                MIN_QUAL_VALUE <= values.min() and
+                values.max() <= MAX_QUAL_VALUE):
+            raise FormatError("Within read named {0!r}: Found quality value "
+                              "outside {1}..{2}".format(
+                              fasta_record.name, MIN_QUAL_VALUE,
+                              MAX_QUAL_VALUE))
+        qualities = (values + 33).astype(np.uint8).tobytes()
         
         return self.sequence_class(
             name,
@@ -81,46 +179,61 @@ class FastaQualReader(SeqIO, SingleReader):
         self.qual_reader.close()
 
 class FastaQualWriter(SeqIO, SingleWriter):
-    """Writer for reads that are stored in .(CS)FASTA and .QUAL files.
+    """Writer for reads that are stored in .(CS)FASTA and .QUAL files. The
+    qualities of each record are written as space-separated phred scores.
     
     Args:
-        fastafile: path or file-like object of sequences in FASTA format
-        qualfile: path or file-like object of qualities in FASTA format
-        kwargs: Additional arguments passed to the file open method
+        fastafile: path or file-like object for the sequences
+        qualfile: path or file-like object for the qualities
+        kwargs: Additional arguments passed to
+            :class:`seqio.io.SequenceWriter`
     """
     delivers_qualities = True
     
     def __init__(self, fastafile, qualfile, **kwargs):
-        fasta = Fasta()
-        self.fasta_reader = SingleFileReader(fastafile, fasta, **kwargs)
-        self.qual_reader = FastaReader(qualfile, fasta, **kwargs)
+        self.fasta_writer = SequenceWriter(fastafile, Fasta(), **kwargs)
+        self.qual_writer = SequenceWriter(qualfile, Fasta(), **kwargs)
     
-    def __next__(self):
-        fasta_record = next(self.fasta_reader)
-        qual_record = next(self.qual_reader)
-        
-        name = fasta_record.name
-        if name != qual_record.name:
-            raise FormatError("The read names in the FASTA and QUAL file do "
-                              "not match ({0!r} != {1!r})".format(
-                              fasta_record.name, qual_record.name))
-        try:
-            qualities = Qualities(list(
-                int(q) for q in qualread.sequence.split(b' ')), 'int')
-        except KeyError as e:
-            raise FormatError("Within read named {0!r}: Found invalid quality "
-                              "value {1}".format(fasta_record.name, e))
+    @property
+    def name(self):
+        return self.fasta_writer.name
+    
+    def _qual_record(self, record):
+        if record.qualities is None:
+            raise ValueError("Record {0!r} has no qualities".format(
+                record.name))
+        values = np.frombuffer(record.qualities, dtype=np.uint8).astype(
+            np.int16) - 33
+        return Sequence(record.name, b' '.join(
+            str(value).encode() for value in values))
+    
+    def write(self, record):
+        qual_record = self._qual_record(record)
+        self.fasta_writer.write(record)
+        self.qual_writer.write(qual_record)
+    
+    def write_batch(self, records):
+        """Write many records.
         
-        return self.sequence_class(
-            name,
-            fasta_record.sequence,
-            qualities)
+        Args:
+            records: A :class:`seqio.batch.RecordBatch` or an iterable of
+                records.
+        """
+        if not isinstance(records, RecordBatch):
+            records = list(records)
+        qual_records = [self._qual_record(record) for record in records]
+        self.fasta_writer.write_batch(records)
+        self.qual_writer.write_batch(qual_records)
+    
+    def flush(self):
+        self.fasta_writer.flush()
+        self.qual_writer.flush()
     
     def close(self):
-        self.fasta_reader.close()
-        self.qual_reader.close()
+        self.fasta_writer.close()
+        self.qual_writer.close()
 
-def open(self, *files: FileListArg, mode: str = 'rb', qualities: bool = None,
+def open(*files: FileListArg, mode: str = 'rb', qualities: bool = None,
          format_args: dict = None, io_args: dict = None) -> FileSeqIO:
     if len(files) > 1:
         if qualities is False:
@@ -130,8 +243,8 @@ def open(self, *files: FileListArg, mode: str = 'rb', qualities: bool = None,
         raise ValueError("Two files required for FASTQUAL")
     if qualities:
         klass = FastaQualReader if 'r' in mode else FastaQualWriter
-        return klass(*files, mode=mode, format_args=format_args, io_args=io_args)
+        return klass(*files, **(io_args or {}))
     else:
-        klass = FastaQualReader if 'r' in mode else FastaQualWriter
-        file_format = Fastq(**(format_args or {}))
-        return klass(files[0], file_format, mode=mode, **(io_args or {}))
+        klass = FastaReader if 'r' in mode else SequenceWriter
+        file_format = Fasta(**(format_args or {}))
+        return klass(files[0], file_format, **(io_args or {}))
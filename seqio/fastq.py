@@ -1,8 +1,15 @@
 # https://support.illumina.com/help/SequencingAnalysisWorkflow/Content/Vault/Informatics/Sequencing_Analysis/CASAVA/swSEQ_mCA_FASTQFiles.htm
+from seqio.batch import RecordBatch, rebatch
 from seqio.format import TextSequenceFormat, EMPTY, NEWLINE
+from seqio.formatters import format_fastq_batch, format_fastq_records
+from seqio.fqidx import FastqIndex, DEFAULT_STRIDE
 from seqio.io import (
-    SingleFileReader, PairedFileReader, InterleavedFileReader,
-    SingleFileWriter, PairedFileWriter, InterleavedFileWriter)
+    FormatError, FileSeqIO, SingleFileReader, PairedFileReader,
+    InterleavedFileReader, SequenceWriter, PairedFileWriter,
+    InterleavedFileWriter)
+from seqio.parallel import ParallelFastqParser, DEFAULT_CHUNK_SIZE
+from seqio.parsers import FastqParser, DEFAULT_BUFFER_SIZE
+from seqio.stats import Stats
 from seqio.types import FileListArg
 
 AT = b'@'
@@ -13,9 +20,103 @@ class Fastq(TextSequenceFormat):
     aliases = ('fq',)
     delivers_qualities = True
     
-    def __init__(self, write_name2: bool = False, **kwargs):
-        super(Fastq, self).__init__(self, **kwargs)
+    def __init__(self, write_name2: bool = False,
+                 buffer_size: int = DEFAULT_BUFFER_SIZE, workers: int = None,
+                 queue_size: int = None, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 **kwargs):
+        super(Fastq, self).__init__(**kwargs)
         self.write_name2 = write_name2
+        self.buffer_size = buffer_size
+        self.parallel = None
+        if workers:
+            self.parallel = ParallelFastqParser(
+                workers, queue_size, chunk_size, self.sequence_class)
+    
+    def iter_records(self, fileinput):
+        """Iterate over all records in a sequence of files using the compiled
+        block parser. Each file is parsed independently, so a file that lacks a
+        final newline does not corrupt the first record of the next file.
+        """
+        if self.parallel:
+            for batch in self.parallel.iter_batches(fileinput):
+                yield from batch
+            return
+        for _, fileobj in fileinput.iter_files():
+            yield from FastqParser(
+                fileobj, self.sequence_class, self.buffer_size)
+    
+    def iter_batches(self, fileinput, size):
+        """Iterate over all records in a sequence of files in columnar batches
+        created by the compiled parser. Batches span file boundaries, so all
+        but the last batch have exactly `size` records.
+        """
+        if self.parallel:
+            yield from rebatch(self.parallel.iter_batches(fileinput), size)
+            return
+        pending = []
+        pending_size = 0
+        for _, fileobj in fileinput.iter_files():
+            parser = FastqParser(fileobj, self.sequence_class, self.buffer_size)
+            while True:
+                batch = parser.next_batch(size - pending_size)
+                if batch is None:
+                    break
+                pending.append(batch)
+                pending_size += len(batch)
+                if pending_size == size:
+                    yield RecordBatch.concat(pending)
+                    pending = []
+                    pending_size = 0
+        if pending:
+            yield RecordBatch.concat(pending)
+    
+    def iter_pairs(self, fileinput):
+        if self.parallel:
+            for batch1, batch2 in self.parallel.iter_batch_pairs(fileinput):
+                yield from zip(batch1, batch2)
+        else:
+            yield from super(Fastq, self).iter_pairs(fileinput)
+    
+    def iter_paired_records(self, fileinput1, fileinput2):
+        if self.parallel:
+            batches = self.parallel.iter_paired_batches(fileinput1, fileinput2)
+            for batch1, batch2 in batches:
+                yield from zip(batch1, batch2)
+        else:
+            yield from super(Fastq, self).iter_paired_records(
+                fileinput1, fileinput2)
+    
+    def iter_paired_batches(self, fileinput1, fileinput2, size):
+        if self.parallel:
+            yield from rebatch(
+                self.parallel.iter_paired_batches(fileinput1, fileinput2), size)
+        else:
+            yield from super(Fastq, self).iter_paired_batches(
+                fileinput1, fileinput2, size)
+    
+    def iter_batch_pairs(self, fileinput, size):
+        """Iterate over interleaved pairs of records in a sequence of files in
+        aligned columnar batches created by the compiled parser.
+        """
+        if self.parallel:
+            yield from rebatch(self.parallel.iter_batch_pairs(fileinput), size)
+            return
+        pending = []
+        pending_size = 0
+        for _, fileobj in fileinput.iter_files():
+            parser = FastqParser(fileobj, self.sequence_class, self.buffer_size)
+            while True:
+                batches = parser.next_batch_pair(size - pending_size)
+                if batches is None:
+                    break
+                pending.append(batches)
+                pending_size += len(batches[0])
+                if pending_size == size:
+                    yield tuple(map(RecordBatch.concat, zip(*pending)))
+                    pending = []
+                    pending_size = 0
+        if pending:
+            yield tuple(map(RecordBatch.concat, zip(*pending)))
     
     def read_record(self, fileobj):
         lines = [next(fileobj).rstrip() for i in range(4)]
@@ -44,16 +145,119 @@ class Fastq(TextSequenceFormat):
             PLUS, record.name if self.write_name2 else EMPTY, NEWLINE,
             record.qualities, NEWLINE
         ))
+    
+    def format_into(self, buf, record):
+        buf += AT
+        buf += record.name
+        buf += NEWLINE
+        buf += record.sequence
+        buf += NEWLINE
+        buf += PLUS
+        if self.write_name2:
+            buf += record.name
+        buf += NEWLINE
+        buf += record.qualities
+        buf += NEWLINE
+    
+    def format_batch(self, records):
+        if isinstance(records, RecordBatch):
+            return format_fastq_batch(records, self.write_name2)
+        return format_fastq_records(records, self.write_name2)
+
+class FastqReader(SingleFileReader):
+    """Reader for a FASTQ file. Records can also be accessed by number
+    (`reader[i]`) or by read name (`get`, `get_many`) through a sidecar index
+    (see :class:`seqio.fqidx.FastqIndex`), which is loaded, built or updated
+    on first use. Random access requires a single file.
+    
+    Args:
+        files: The FASTQ file(s).
+        file_format: An instance of :class:`Fastq`.
+        index_stride: The number of records between offsets stored in the
+            index.
+        kwargs: Additional arguments passed to the file open method
+    """
+    def __init__(self, *files, file_format, index_stride: int = DEFAULT_STRIDE,
+                 **kwargs):
+        super(FastqReader, self).__init__(
+            *files, file_format=file_format, **kwargs)
+        self.files = files
+        self.index_stride = index_stride
+        self._index = None
+    
+    def get_index(self, names: bool = False) -> FastqIndex:
+        """Returns the index, (re)building it with read names if `names` is
+        True and the current index has none.
+        """
+        if self._index is None or (names and not self._index.names):
+            if len(self.files) != 1:
+                raise ValueError("Random access requires a single input file")
+            if self._index is not None:
+                self._index.close()
+            self._index = FastqIndex(
+                self.files[0], self.index_stride, names,
+                sequence_class=self.file_format.sequence_class)
+        return self._index
+    
+    @property
+    def index(self) -> FastqIndex:
+        return self.get_index()
+    
+    def __getitem__(self, i: int):
+        """Returns the i'th (0-based) record in the file.
+        """
+        return self.index.get_record(i)
+    
+    def get(self, name):
+        """Returns the first record whose ID (the name up to the first
+        whitespace) matches `name`.
+        
+        Raises:
+            KeyError if there is no such record.
+        """
+        return self.get_index(names=True).get(name)
+    
+    def get_many(self, names) -> list:
+        """Returns the first record matching each name, with None for names
+        that are not found. Records are read in file order.
+        """
+        return self.get_index(names=True).get_many(names)
+    
+    def close(self):
+        if self._index is not None:
+            self._index.close()
+        super(FastqReader, self).close()
 
 FASTQ_CLASSES = {
-    (False, False) : (SingleEndFileReader, SingleEndFileWriter),
+    (False, False) : (FastqReader, SequenceWriter),
     (True, False) : (PairedFileReader, PairedFileWriter),
     (True, True) : (InterleavedFileReader, InterleavedFileWriter)
 }
 
-def open(self, *files: FileListArg, mode: str = 'rb', interleaved: bool = False,
-         paired: bool = None, format_args: dict = None, io_args: dict = None
-        ) -> FileSeqIO:
+def open(*files: FileListArg, mode: str = 'rb', interleaved: bool = False,
+         paired: bool = None, workers: int = None, queue_size: int = None,
+         decompressor: str = None, format_args: dict = None,
+         io_args: dict = None) -> FileSeqIO:
+    """Open FASTQ file(s) for reading or writing.
+    
+    Args:
+        files: One file (or tuple of files) for single-end or interleaved
+            data, or two for paired-end data.
+        mode: The file mode.
+        interleaved: Whether paired-end reads are interleaved in one file.
+        paired: Whether the data are paired-end; inferred from the number of
+            files if None.
+        workers: The number of processes to use for parsing. If None, files
+            are parsed in the calling process.
+        queue_size: The maximum number of chunks in flight when `workers` is
+            set. Defaults to twice the number of workers.
+        decompressor: The name of the gzip decompression backend when
+            reading; the fastest available one is used if None.
+        format_args: Additional arguments to the :class:`Fastq` constructor.
+        io_args: Additional arguments to the reader/writer constructor(s),
+            e.g. `stats=True` to count records and time each stage (see
+            :mod:`seqio.stats`).
+    """
     if len(files) > 1:
         if paired is False:
             raise ValueError("More than one file given for single-end FASTQ")
@@ -62,6 +266,26 @@ def open(self, *files: FileListArg, mode: str = 'rb', interleaved: bool = False,
         paired = True
     elif paired and not interleaved:
         raise ValueError("Two files required for paired-end FASTQ")
-    klass = FASTQ_CLASSES[(paired, interleaved)][0 if 'r' in mode else 1]
-    file_format = Fastq(**(format_args or {}))
-    return klass(*files, file_format, mode=mode, **(io_args or {}))
+    paired = bool(paired or interleaved)
+    format_args = dict(format_args or {})
+    if workers:
+        format_args.update(workers=workers, queue_size=queue_size)
+    file_format = Fastq(**format_args)
+    io_args = dict(io_args or {})
+    if decompressor:
+        io_args.update(decompressor=decompressor)
+    if io_args.get('stats') is True:
+        # the mates of paired files share their statistics
+        io_args.update(stats=Stats())
+    index = 0 if 'r' in mode else 1
+    klass = FASTQ_CLASSES[(paired, interleaved)][index]
+    if paired and not interleaved:
+        single = FASTQ_CLASSES[(False, False)][index]
+        mates = (
+            single(*_as_tuple(f), file_format=file_format, **io_args)
+            for f in files)
+        return klass(str(files), *mates, file_format)
+    return klass(*_as_tuple(files[0]), file_format=file_format, **io_args)
+
+def _as_tuple(files):
+    return tuple(files) if isinstance(files, (tuple, list)) else (files,)
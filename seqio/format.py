@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
 """
 """
+from itertools import islice, zip_longest
 import textwrap
 from xphyle import open_
+from seqio.batch import RecordBatch
+from seqio.io import FormatError
+from seqio.sequences import Sequence
 
 # some commonly used byte sequences
 EMPTY = b''
@@ -22,6 +26,110 @@ class SequenceFormat(object):
     def read_pair(self, fileobj):
         return (self.read_record(fileobj), self.read_record(fileobj))
     
+    def iter_records(self, fileinput):
+        """Iterate over all records in a sequence of files.
+        
+        Args:
+            fileinput: A :class:`xphyle.utils.FileInput`.
+        
+        Yields:
+            Records of type `self.sequence_class`.
+        """
+        while True:
+            try:
+                record = self.read_record(fileinput)
+            except StopIteration:
+                return
+            yield record
+    
+    def iter_pairs(self, fileinput):
+        """Iterate over all pairs of consecutive records in a sequence of files.
+        
+        Args:
+            fileinput: A :class:`xphyle.utils.FileInput`.
+        
+        Yields:
+            Tuples (read1, read2).
+        """
+        records = self.iter_records(fileinput)
+        for read1 in records:
+            read2 = next(records, None)
+            if read2 is None:
+                raise FormatError(
+                    "Odd number of records; the last record ({!r}) has no "
+                    "mate".format(read1.name))
+            yield (read1, read2)
+    
+    def iter_paired_records(self, fileinput1, fileinput2):
+        """Iterate over pairs of records from two sequences of files.
+        
+        Args:
+            fileinput1, fileinput2: :class:`xphyle.utils.FileInput`s.
+        
+        Yields:
+            Tuples (read1, read2).
+        """
+        pairs = zip_longest(
+            self.iter_records(fileinput1), self.iter_records(fileinput2))
+        for read1, read2 in pairs:
+            if read1 is None or read2 is None:
+                raise FormatError(
+                    "Paired files have different numbers of records")
+            yield (read1, read2)
+    
+    def iter_batches(self, fileinput, size):
+        """Iterate over all records in a sequence of files in columnar batches.
+        Formats with a compiled parser should override this to avoid creating
+        per-record objects.
+        
+        Args:
+            fileinput: A :class:`xphyle.utils.FileInput`.
+            size: The number of records per batch.
+        
+        Yields:
+            :class:`seqio.batch.RecordBatch` objects with `size` records (the
+            last batch may be smaller).
+        """
+        records = self.iter_records(fileinput)
+        while True:
+            batch = list(islice(records, size))
+            if not batch:
+                return
+            yield RecordBatch.from_records(batch, self.sequence_class)
+    
+    def iter_batch_pairs(self, fileinput, size):
+        """Iterate over all pairs of consecutive records in a sequence of files
+        in aligned columnar batches.
+        
+        Yields:
+            Tuples (batch1, batch2) of :class:`seqio.batch.RecordBatch`.
+        """
+        pairs = self.iter_pairs(fileinput)
+        while True:
+            batch = list(islice(pairs, size))
+            if not batch:
+                return
+            reads1, reads2 = zip(*batch)
+            yield (
+                RecordBatch.from_records(reads1, self.sequence_class),
+                RecordBatch.from_records(reads2, self.sequence_class))
+    
+    def iter_paired_batches(self, fileinput1, fileinput2, size):
+        """Iterate over pairs of records from two sequences of files in aligned
+        columnar batches.
+        
+        Yields:
+            Tuples (batch1, batch2) of :class:`seqio.batch.RecordBatch`.
+        """
+        batches = zip_longest(
+            self.iter_batches(fileinput1, size),
+            self.iter_batches(fileinput2, size))
+        for batch1, batch2 in batches:
+            if batch1 is None or batch2 is None:
+                raise FormatError(
+                    "Paired files have different numbers of records")
+            yield (batch1, batch2)
+    
     def _create_record(self, *args, **kwargs):
         return self.sequence_class(*args, **kwargs)
 
@@ -30,6 +138,22 @@ class SequenceFormat(object):
     
     def format_pair(self, read1, read2):
         return (self.format_record(read1), self.format_record(read2))
+    
+    def format_into(self, buf: bytearray, record):
+        """Appends a formatted record to `buf`. Formats should override this
+        to avoid creating an intermediate bytes object per record.
+        """
+        buf += self.format_record(record)
+    
+    def format_batch(self, records) -> bytes:
+        """Formats many records at once. Formats with a compiled formatter
+        should override this.
+        
+        Args:
+            records: A :class:`seqio.batch.RecordBatch` or an iterable of
+                records.
+        """
+        return EMPTY.join(self.format_record(record) for record in records)
 
 class TextSequenceFormat(SequenceFormat):
     def __init__(self, sequence_class=Sequence, line_length=None):
@@ -0,0 +1,360 @@
+# kate: syntax Python;
+# cython: profile=False, emit_code_comments=False
+# cython: language_level=3
+# cython: boundscheck=False
+# cython: wraparound=False
+"""Cython implementations of batch record formatters. Each function formats
+a whole batch into a single pre-sized (or geometrically grown) bytearray.
+"""
+from cpython.bytearray cimport (
+    PyByteArray_AS_STRING, PyByteArray_FromStringAndSize, PyByteArray_GET_SIZE,
+    PyByteArray_Resize)
+from libc.stdint cimport int32_t, uint16_t, uint64_t
+from libc.string cimport memcpy, memset
+
+import numpy as np
+from seqio.sequences cimport Sequence
+
+cdef inline bytearray uninitialized_bytearray(Py_ssize_t size):
+    """Allocates a bytearray without zeroing it.
+    """
+    return PyByteArray_FromStringAndSize(NULL, size)
+
+cdef inline char* copy(
+        char* dest, const unsigned char[::1] src, uint64_t start,
+        uint64_t end) nogil:
+    """Copies src[start:end] to dest and returns the end of the copy.
+    """
+    if end > start:
+        memcpy(dest, &src[start], end - start)
+    return dest + (end - start)
+
+cdef inline char* append(
+        bytearray buf, Py_ssize_t* used, const char* data,
+        Py_ssize_t size) except NULL:
+    """Appends `size` bytes to the first `used[0]` bytes of `buf`, growing it
+    (at least doubling it) if necessary.
+    """
+    cdef Py_ssize_t capacity = PyByteArray_GET_SIZE(buf)
+    if used[0] + size > capacity:
+        PyByteArray_Resize(buf, max(2 * capacity, used[0] + size))
+    cdef char* dest = PyByteArray_AS_STRING(buf) + used[0]
+    if size > 0:
+        memcpy(dest, data, size)
+    used[0] += size
+    return dest
+
+def format_fastq_batch(batch, bint write_name2=False):
+    """Formats a :class:`seqio.batch.RecordBatch` as FASTQ.
+
+    Args:
+        batch: The batch; must have qualities.
+        write_name2: Whether to repeat the name on the '+' line.
+
+    Returns:
+        A bytearray.
+    """
+    if batch.qualities is None:
+        raise ValueError("FASTQ output requires qualities")
+    cdef:
+        const unsigned char[::1] names = batch.names
+        const unsigned char[::1] sequences = batch.sequences
+        const unsigned char[::1] qualities = batch.qualities
+        const uint64_t[::1] name_offsets = batch.name_offsets.astype(
+            np.uint64, copy=False)
+        const uint64_t[::1] offsets = batch.offsets.astype(
+            np.uint64, copy=False)
+        Py_ssize_t count = len(batch)
+        Py_ssize_t i
+        Py_ssize_t size
+        bytearray out
+        char* p
+    if count == 0:
+        return bytearray()
+    size = (
+        (name_offsets[count] - name_offsets[0]) * (2 if write_name2 else 1) +
+        2 * (offsets[count] - offsets[0]) + 6 * count)
+    out = uninitialized_bytearray(size)
+    p = PyByteArray_AS_STRING(out)
+    with nogil:
+        for i in range(count):
+            p[0] = b'@'
+            p = copy(p + 1, names, name_offsets[i], name_offsets[i + 1])
+            p[0] = b'\n'
+            p = copy(p + 1, sequences, offsets[i], offsets[i + 1])
+            p[0] = b'\n'
+            p[1] = b'+'
+            p += 2
+            if write_name2:
+                p = copy(p, names, name_offsets[i], name_offsets[i + 1])
+            p[0] = b'\n'
+            p = copy(p + 1, qualities, offsets[i], offsets[i + 1])
+            p[0] = b'\n'
+            p += 1
+    return out
+
+def format_fasta_batch(batch, Py_ssize_t line_length=0):
+    """Formats a :class:`seqio.batch.RecordBatch` as FASTA.
+
+    Args:
+        batch: The batch.
+        line_length: The maximum number of bases per line; 0 to write each
+            sequence on a single line.
+
+    Returns:
+        A bytearray.
+    """
+    cdef:
+        const unsigned char[::1] names = batch.names
+        const unsigned char[::1] sequences = batch.sequences
+        const uint64_t[::1] name_offsets = batch.name_offsets.astype(
+            np.uint64, copy=False)
+        const uint64_t[::1] offsets = batch.offsets.astype(
+            np.uint64, copy=False)
+        Py_ssize_t count = len(batch)
+        Py_ssize_t i, length, lines
+        uint64_t start, end
+        Py_ssize_t size = 0
+        bytearray out
+        char* p
+    if count == 0:
+        return bytearray()
+    for i in range(count):
+        length = offsets[i + 1] - offsets[i]
+        lines = 1
+        if line_length > 0 and length > line_length:
+            lines = (length + line_length - 1) // line_length
+        size += 2 + (name_offsets[i + 1] - name_offsets[i]) + length + lines
+    out = uninitialized_bytearray(size)
+    p = PyByteArray_AS_STRING(out)
+    with nogil:
+        for i in range(count):
+            p[0] = b'>'
+            p = copy(p + 1, names, name_offsets[i], name_offsets[i + 1])
+            p[0] = b'\n'
+            p += 1
+            start = offsets[i]
+            end = offsets[i + 1]
+            if line_length > 0:
+                while end - start > <uint64_t>line_length:
+                    p = copy(p, sequences, start, start + line_length)
+                    p[0] = b'\n'
+                    p += 1
+                    start += line_length
+            p = copy(p, sequences, start, end)
+            p[0] = b'\n'
+            p += 1
+    return out
+
+def format_fastq_records(records, bint write_name2=False):
+    """Formats an iterable of records as FASTQ.
+
+    Args:
+        records: Records with `name`, `sequence` and `qualities` attributes.
+        write_name2: Whether to repeat the name on the '+' line.
+
+    Returns:
+        A bytearray.
+    """
+    cdef:
+        bytearray out = uninitialized_bytearray(65536)
+        Py_ssize_t used = 0
+        bytes name, sequence, qualities
+        Sequence seq_record
+    for record in records:
+        if type(record) is Sequence:
+            seq_record = <Sequence>record
+            name = seq_record.name
+            sequence = seq_record.sequence
+            qualities = seq_record.qualities
+        else:
+            name = record.name
+            sequence = record.sequence
+            qualities = record.qualities
+        if qualities is None:
+            raise ValueError("FASTQ output requires qualities")
+        append(out, &used, b'@', 1)
+        append(out, &used, name, len(name))
+        append(out, &used, b'\n', 1)
+        append(out, &used, sequence, len(sequence))
+        append(out, &used, b'\n+', 2)
+        if write_name2:
+            append(out, &used, name, len(name))
+        append(out, &used, b'\n', 1)
+        append(out, &used, qualities, len(qualities))
+        append(out, &used, b'\n', 1)
+    PyByteArray_Resize(out, used)
+    return out
+
+# BAM
+
+cdef unsigned char[256] NT16
+for _i in range(256):
+    NT16[_i] = 15
+for _code, _base in enumerate(bytearray(b'=ACMGRSVTWYHKDBN')):
+    NT16[_base] = _code
+    NT16[_base | 0x20] = _code
+
+cdef enum:
+    # the size of the fixed-length fields, including block_size
+    BAM_FIXED_SIZE = 36
+    # the bin of a read with no position
+    BAM_UNMAPPED_BIN = 4680
+
+cdef inline char* put_int32(char* p, int32_t value) noexcept nogil:
+    cdef unsigned int bits = <unsigned int>value
+    p[0] = bits & 0xff
+    p[1] = (bits >> 8) & 0xff
+    p[2] = (bits >> 16) & 0xff
+    p[3] = (bits >> 24) & 0xff
+    return p + 4
+
+cdef inline char* put_uint16(char* p, uint16_t value) noexcept nogil:
+    p[0] = value & 0xff
+    p[1] = value >> 8
+    return p + 2
+
+cdef inline Py_ssize_t id_length(
+        const unsigned char* name, Py_ssize_t size) noexcept nogil:
+    """Returns the length of the read ID (the name up to the first space or
+    tab), which is all that BAM stores.
+    """
+    cdef Py_ssize_t i
+    for i in range(size):
+        if name[i] == b' ' or name[i] == b'\t':
+            return i
+    return size
+
+cdef inline Py_ssize_t bam_record_size(
+        Py_ssize_t name_length, Py_ssize_t length) noexcept nogil:
+    return BAM_FIXED_SIZE + name_length + 1 + (length + 1) // 2 + length
+
+cdef char* put_bam_record(
+        char* p, const unsigned char* name, Py_ssize_t name_length,
+        const unsigned char* sequence, const unsigned char* qualities,
+        Py_ssize_t length, uint16_t flag) noexcept nogil:
+    """Writes an unmapped BAM record; `qualities` are phred+33, or NULL if
+    the read has none.
+    """
+    cdef Py_ssize_t j
+    p = put_int32(p, bam_record_size(name_length, length) - 4)
+    p = put_int32(p, -1)  # refID
+    p = put_int32(p, -1)  # pos
+    p[0] = name_length + 1
+    p[1] = 0  # mapq
+    p = put_uint16(p + 2, BAM_UNMAPPED_BIN)
+    p = put_uint16(p, 0)  # n_cigar_op
+    p = put_uint16(p, flag)
+    p = put_int32(p, length)
+    p = put_int32(p, -1)  # next refID
+    p = put_int32(p, -1)  # next pos
+    p = put_int32(p, 0)  # tlen
+    if name_length:
+        memcpy(p, name, name_length)
+    p[name_length] = 0
+    p += name_length + 1
+    for j in range(0, length - 1, 2):
+        p[0] = (NT16[sequence[j]] << 4) | NT16[sequence[j + 1]]
+        p += 1
+    if length & 1:
+        p[0] = NT16[sequence[length - 1]] << 4
+        p += 1
+    if qualities == NULL:
+        memset(p, 0xff, length)
+    else:
+        for j in range(length):
+            p[j] = qualities[j] - 33
+    return p + length
+
+def format_bam_record(
+        bytes name, bytes sequence, bytes qualities=None, int flag=4):
+    """Formats a read as an unmapped BAM record.
+
+    Args:
+        name: The read name; only the ID (up to the first whitespace) is
+            kept.
+        sequence: The bases.
+        qualities: phred+33 qualities, or None.
+        flag: The SAM flag.
+
+    Returns:
+        The (uncompressed) record.
+    """
+    cdef:
+        Py_ssize_t name_length = id_length(name, len(name))
+        Py_ssize_t length = len(sequence)
+        bytearray out
+    if name_length > 254:
+        raise ValueError("Read name is longer than 254 characters")
+    if qualities is not None and len(qualities) != length:
+        raise ValueError("Sequence and qualities have different lengths")
+    out = uninitialized_bytearray(bam_record_size(name_length, length))
+    put_bam_record(
+        PyByteArray_AS_STRING(out), name, name_length, sequence,
+        NULL if qualities is None else <const unsigned char*>qualities,
+        length, flag)
+    return bytes(out)
+
+def format_bam_batch(batch, flags=4):
+    """Formats a :class:`seqio.batch.RecordBatch` as unmapped BAM records.
+
+    Args:
+        batch: The batch.
+        flags: The SAM flag of every record, or an array of one flag per
+            record.
+
+    Returns:
+        A bytearray of (uncompressed) records.
+    """
+    cdef:
+        const unsigned char[::1] names = batch.names
+        const unsigned char[::1] sequences = batch.sequences
+        const unsigned char[::1] qualities
+        const uint64_t[::1] name_offsets = batch.name_offsets.astype(
+            np.uint64, copy=False)
+        const uint64_t[::1] offsets = batch.offsets.astype(
+            np.uint64, copy=False)
+        const uint16_t[::1] record_flags
+        Py_ssize_t count = len(batch)
+        bint has_qualities = batch.qualities is not None
+        Py_ssize_t i, name_length
+        Py_ssize_t size = 0
+        Py_ssize_t max_name_length = 0
+        const unsigned char* quals = NULL
+        bytearray out
+        char* p
+    if count == 0:
+        return bytearray()
+    if np.ndim(flags) == 0:
+        record_flags = np.full(count, flags, dtype=np.uint16)
+    else:
+        record_flags = np.ascontiguousarray(flags, dtype=np.uint16)
+        if record_flags.shape[0] != count:
+            raise ValueError("Expected one flag per record")
+    if has_qualities:
+        qualities = batch.qualities
+    with nogil:
+        for i in range(count):
+            name_length = id_length(
+                &names[0] + name_offsets[i],
+                name_offsets[i + 1] - name_offsets[i])
+            if name_length > max_name_length:
+                max_name_length = name_length
+            size += bam_record_size(
+                name_length, offsets[i + 1] - offsets[i])
+    if max_name_length > 254:
+        raise ValueError("Read name is longer than 254 characters")
+    out = uninitialized_bytearray(size)
+    p = PyByteArray_AS_STRING(out)
+    with nogil:
+        for i in range(count):
+            if has_qualities:
+                quals = &qualities[0] + offsets[i]
+            p = put_bam_record(
+                p, &names[0] + name_offsets[i],
+                id_length(
+                    &names[0] + name_offsets[i],
+                    name_offsets[i + 1] - name_offsets[i]),
+                &sequences[0] + offsets[i], quals,
+                offsets[i + 1] - offsets[i], record_flags[i])
+    return out
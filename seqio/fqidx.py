@@ -0,0 +1,441 @@
+# -*- coding: utf-8 -*-
+"""Sidecar index for random access to the records of a FASTQ file.
+
+The index is saved next to the file as `<path>.fqi` (a NumPy .npz archive).
+It stores the uncompressed byte offset of every `stride`'th record; a record
+is read by seeking to the nearest preceding stored offset and parsing forward.
+BGZF files are seeked through their block offsets (as in a .gzi index), and
+other gzip files through zran-style decompressor checkpoints created by the
+optional `indexed_gzip` package. The index can also store a table of hashed
+read IDs (the name up to the first whitespace), sorted by hash, for lookup by
+name.
+
+When a file has only been appended to since it was indexed, the index is
+extended from the last indexed record rather than rebuilt.
+"""
+import hashlib
+from io import BytesIO
+import io
+import os
+import numpy as np
+from seqio.compression import (
+    BgzfReader, is_bgzf, is_gzip, make_virtual_offset)
+from seqio.faidx import build_gzi
+from seqio.io import FormatError
+from seqio.parsers import FastqParser, count_records
+from seqio.sequences import Sequence
+
+try:
+    import indexed_gzip
+except ImportError:
+    indexed_gzip = None
+
+INDEX_VERSION = 1
+
+DEFAULT_STRIDE = 1024
+"""Default number of records between stored offsets."""
+
+DEFAULT_SPACING = 16 * 1024 * 1024
+"""Default number of uncompressed bytes between gzip checkpoints. Each
+checkpoint stores a 32 KB window."""
+
+SCAN_CHUNK_SIZE = 4 * 1024 * 1024
+READ_BUFFER_SIZE = 64 * 1024
+TAIL_SIZE = 64 * 1024
+"""Number of bytes at the end of the indexed file that are checksummed, to
+tell an append from any other change."""
+
+# constants of the name hash (a polynomial hash followed by the splitmix64
+# finalizer)
+_HASH_BASE = np.uint64(0x100000001b3)
+_MIX1 = np.uint64(0xbf58476d1ce4e5b9)
+_MIX2 = np.uint64(0x94d049bb133111eb)
+
+def hash_names(names, name_offsets) -> np.ndarray:
+    """Hashes the IDs (the names up to the first whitespace) of a buffer of
+    concatenated names, as stored in a :class:`seqio.batch.RecordBatch`. The
+    hash is vectorized over all names.
+
+    Returns:
+        A uint64 array with one hash per name.
+    """
+    name_offsets = np.asarray(name_offsets, dtype=np.int64)
+    starts = name_offsets[:-1] - name_offsets[0]
+    lengths = np.diff(name_offsets)
+    count = len(lengths)
+    data = np.asarray(names, dtype=np.uint8)[
+        name_offsets[0]:name_offsets[-1]]
+    record = np.repeat(np.arange(count), lengths)
+    pos = np.arange(len(data)) - np.repeat(starts, lengths)
+    id_lengths = lengths.copy()
+    whitespace = (data == 32) | (data == 9)
+    np.minimum.at(id_lengths, record[whitespace], pos[whitespace])
+    keep = pos < id_lengths[record]
+    pos = pos[keep]
+    with np.errstate(over='ignore'):
+        powers = np.cumprod(
+            np.full(int(id_lengths.max(initial=0)) + 1, _HASH_BASE,
+                    dtype=np.uint64))
+        terms = data[keep].astype(np.uint64) * powers[pos]
+        hashes = id_lengths.astype(np.uint64)
+        nonempty = id_lengths > 0
+        segments = np.concatenate(([0], np.cumsum(id_lengths)[:-1]))
+        if terms.size:
+            hashes[nonempty] += np.add.reduceat(terms, segments[nonempty])
+        hashes ^= hashes >> np.uint64(30)
+        hashes *= _MIX1
+        hashes ^= hashes >> np.uint64(27)
+        hashes *= _MIX2
+        hashes ^= hashes >> np.uint64(31)
+    return hashes
+
+def _read_id(name) -> bytes:
+    if isinstance(name, str):
+        name = name.encode()
+    return name.split(None, 1)[0] if name.strip() else b''
+
+def _hash_ids(ids) -> np.ndarray:
+    return hash_names(
+        np.frombuffer(b''.join(ids), dtype=np.uint8),
+        np.concatenate(([0], np.cumsum([len(i) for i in ids]))))
+
+def _tail_digest(path, size: int) -> bytes:
+    with io.open(path, 'rb') as fileobj:
+        fileobj.seek(max(0, size - TAIL_SIZE))
+        return hashlib.blake2b(
+            fileobj.read(min(size, TAIL_SIZE)), digest_size=16).digest()
+
+class FastqIndex(object):
+    """Random access to the records of an uncompressed, BGZF- or
+    gzip-compressed FASTQ file through a sidecar index. An existing index is
+    reused if the file is unchanged, extended if the file has been appended
+    to, and otherwise (re)built and saved.
+
+    Args:
+        path: The FASTQ file.
+        stride: The number of records between stored offsets. Reading a
+            record parses at most `stride - 1` preceding records.
+        names: Whether the index includes hashed read IDs, for `get` and
+            `get_many`.
+        spacing: The number of uncompressed bytes between checkpoints in
+            gzip (but not BGZF) files.
+        build: Whether to build or update the index; if False, a missing or
+            outdated index raises an IOError.
+        sequence_class: The class of the records that are returned.
+    """
+    def __init__(self, path, stride: int = DEFAULT_STRIDE, names: bool = False,
+                 spacing: int = DEFAULT_SPACING, build: bool = True,
+                 sequence_class=Sequence):
+        if stride < 1:
+            raise ValueError("'stride' must be >= 1")
+        self.path = os.fspath(path)
+        self.index_path = self.path + '.fqi'
+        self.stride = stride
+        self.names = names
+        self.spacing = spacing
+        self.sequence_class = sequence_class
+        if is_bgzf(self.path):
+            self.compression = 'bgzf'
+        elif is_gzip(self.path):
+            if indexed_gzip is None:
+                raise ValueError(
+                    "Random access to gzip files requires the indexed_gzip "
+                    "package (or BGZF compression): {}".format(self.path))
+            self.compression = 'gzip'
+        else:
+            self.compression = 'none'
+        self._fileobj = None
+        self._reset()
+        file_size = os.path.getsize(self.path)
+        loaded = self._load()
+        if not loaded or self.file_size != file_size:
+            if not build:
+                raise IOError("Missing or outdated index {}".format(
+                    self.index_path))
+            if not loaded:
+                self._reset()
+            self._update(file_size)
+            self._save()
+
+    def _reset(self):
+        self.count = 0
+        self.size = 0
+        self.file_size = 0
+        self.offsets = np.zeros(0, dtype=np.uint64)
+        self.name_hashes = np.zeros(0, dtype=np.uint64)
+        self.name_records = np.zeros(0, dtype=np.uint64)
+        self.block_offsets = np.zeros((0, 2), dtype=np.uint64)
+        self.gzip_index = b''
+
+    def _load(self) -> bool:
+        """Loads a saved index that is compatible with the arguments and
+        whose file has at most been appended to since.
+        """
+        if not os.path.exists(self.index_path):
+            return False
+        with np.load(self.index_path) as saved:
+            if (int(saved['version']) != INDEX_VERSION or
+                    int(saved['stride']) != self.stride or
+                    str(saved['compression']) != self.compression or
+                    (self.names and not bool(saved['names']))):
+                return False
+            file_size = int(saved['file_size'])
+            if (os.path.getsize(self.path) < file_size or
+                    _tail_digest(self.path, file_size) !=
+                    saved['digest'].tobytes()):
+                return False
+            self.names = bool(saved['names'])
+            self.count = int(saved['count'])
+            self.size = int(saved['size'])
+            self.file_size = file_size
+            self.offsets = saved['offsets']
+            self.name_hashes = saved['name_hashes']
+            self.name_records = saved['name_records']
+            self.block_offsets = saved['block_offsets']
+            self.gzip_index = saved['gzip_index'].tobytes()
+        return True
+
+    def _save(self):
+        temp_path = self.index_path + '.tmp'
+        try:
+            with io.open(temp_path, 'wb') as out:
+                np.savez(
+                    out, version=INDEX_VERSION, stride=self.stride,
+                    compression=self.compression, names=self.names,
+                    count=self.count, size=self.size,
+                    file_size=self.file_size,
+                    digest=np.frombuffer(
+                        _tail_digest(self.path, self.file_size),
+                        dtype=np.uint8),
+                    offsets=self.offsets, name_hashes=self.name_hashes,
+                    name_records=self.name_records,
+                    block_offsets=self.block_offsets,
+                    gzip_index=np.frombuffer(self.gzip_index, dtype=np.uint8))
+            os.replace(temp_path, self.index_path)
+        except OSError:
+            # e.g. a read-only directory; the index is only kept in memory
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _open(self):
+        """Opens the file with uncompressed seeking.
+        """
+        if self.compression == 'bgzf':
+            return BgzfReader(self.path, threads=0)
+        if self.compression == 'gzip':
+            fileobj = indexed_gzip.IndexedGzipFile(
+                self.path, spacing=self.spacing)
+            if (self.gzip_index and
+                    os.path.getsize(self.path) == self.file_size):
+                # index_file only accepts a path, so the saved checkpoints are
+                # imported from memory; zran rejects them once members have
+                # been appended, in which case they are rebuilt while seeking
+                fileobj.import_index(fileobj=BytesIO(self.gzip_index))
+            return fileobj
+        return io.open(self.path, 'rb')
+
+    def _seek(self, offset: int):
+        """Moves to an uncompressed offset and returns the file object.
+        """
+        if self._fileobj is None:
+            self._fileobj = self._open()
+        if self.compression == 'bgzf':
+            i = int(np.searchsorted(
+                self.block_offsets[:, 1], offset, side='right')) - 1
+            block_offset, block_start = (int(x) for x in self.block_offsets[i])
+            self._fileobj.seek_virtual(
+                make_virtual_offset(block_offset, offset - block_start))
+        else:
+            self._fileobj.seek(offset)
+        return self._fileobj
+
+    def _update(self, file_size: int):
+        """Indexes the records after the last indexed one.
+        """
+        if self.compression == 'bgzf':
+            # extend the block offsets from the last indexed block, which may
+            # have been the end-of-file block
+            start = (0, 0)
+            if len(self.block_offsets):
+                start = tuple(int(x) for x in self.block_offsets[-1])
+            with io.open(self.path, 'rb') as raw:
+                raw.seek(start[0])
+                blocks = build_gzi(raw, *start)
+            if blocks:
+                self.block_offsets = np.concatenate((
+                    self.block_offsets[:-1] if len(self.block_offsets)
+                    else self.block_offsets,
+                    np.array(blocks, dtype=np.uint64).reshape(-1, 2)))
+        fileobj = self._seek(self.size)
+        offsets = [self.offsets]
+        name_hashes = [self.name_hashes]
+        name_records = [self.name_records]
+        leftover = b''
+        while True:
+            block = fileobj.read(SCAN_CHUNK_SIZE)
+            buf = leftover + block
+            padded = False
+            if not block:
+                if not buf.strip():
+                    break
+                if not buf.endswith(b'\n'):
+                    # the last record has no final newline
+                    buf += b'\n'
+                    padded = True
+            view = memoryview(buf)
+            count, end = count_records(view)
+            if count == 0:
+                if not block:
+                    raise FormatError(
+                        "Incomplete record at the end of {}".format(self.path))
+                leftover = buf
+                continue
+            # offsets of the records in this chunk that are multiples of stride
+            anchors = []
+            record = (-self.count) % self.stride
+            pos = 0
+            if record < count:
+                pos = count_records(view[:end], record)[1]
+                anchors.append(pos)
+                while record + self.stride < count:
+                    pos += count_records(view[pos:end], self.stride)[1]
+                    anchors.append(pos)
+                    record += self.stride
+            offsets.append(self.size + np.array(anchors, dtype=np.uint64))
+            if self.names:
+                parser = FastqParser(BytesIO(buf[:end]), Sequence, end + 1)
+                batch = parser.next_batch(count)
+                name_hashes.append(
+                    hash_names(batch.names, batch.name_offsets))
+                name_records.append(np.arange(
+                    self.count, self.count + count, dtype=np.uint64))
+            self.count += count
+            self.size += end - 1 if padded and end == len(buf) else end
+            leftover = buf[end:]
+            if not block:
+                if leftover.strip():
+                    raise FormatError(
+                        "Incomplete record at the end of {}".format(
+                            self.path))
+                break
+        self.offsets = np.concatenate(offsets).astype(np.uint64)
+        if self.names:
+            hashes = np.concatenate(name_hashes).astype(np.uint64)
+            records = np.concatenate(name_records).astype(np.uint64)
+            order = np.argsort(hashes, kind='stable')
+            self.name_hashes = hashes[order]
+            self.name_records = records[order]
+        if self.compression == 'gzip':
+            exported = BytesIO()
+            fileobj.export_index(fileobj=exported)
+            self.gzip_index = exported.getvalue()
+        self.file_size = file_size
+
+    def _parser_at(self, record: int):
+        """Returns a parser positioned at the stored offset at or before
+        `record`, and the number of that record.
+        """
+        anchor = record // self.stride
+        fileobj = self._seek(int(self.offsets[anchor]))
+        return (
+            FastqParser(fileobj, self.sequence_class, READ_BUFFER_SIZE),
+            anchor * self.stride)
+
+    def _iter_sorted(self, records):
+        """Reads records with sorted numbers, parsing forward from the
+        previous record instead of seeking where that is shorter.
+
+        Yields:
+            Tuples (record_number, record).
+        """
+        parser = None
+        current = None
+        for record in records:
+            if not 0 <= record < self.count:
+                raise IndexError(record)
+            anchor = (record // self.stride) * self.stride
+            if parser is None or record < current or anchor > current:
+                parser, current = self._parser_at(record)
+            while current < record:
+                next(parser)
+                current += 1
+            current += 1
+            yield (record, next(parser))
+
+    def get_record(self, record: int):
+        """Returns the record with the given (0-based) number.
+        """
+        if record < 0:
+            record += self.count
+        return next(self._iter_sorted((record,)))[1]
+
+    def get_records(self, records) -> list:
+        """Returns the records with the given numbers, in the given order.
+        Records are read in file order.
+        """
+        records = [r + self.count if r < 0 else r for r in records]
+        found = dict(self._iter_sorted(sorted(set(records))))
+        return [found[r] for r in records]
+
+    def _find(self, ids):
+        """Returns the numbers of the records whose ID hashes match each ID.
+        """
+        if not self.names:
+            raise ValueError("Index was built without read names")
+        hashes = _hash_ids(ids)
+        starts = np.searchsorted(self.name_hashes, hashes, side='left')
+        ends = np.searchsorted(self.name_hashes, hashes, side='right')
+        return [
+            sorted(int(r) for r in self.name_records[start:end])
+            for start, end in zip(starts, ends)]
+
+    def get(self, name):
+        """Returns the first record whose ID (the name up to the first
+        whitespace) is the same as that of `name`.
+
+        Raises:
+            KeyError if there is no such record.
+        """
+        read_id = _read_id(name)
+        for _, record in self._iter_sorted(self._find([read_id])[0]):
+            if _read_id(record.name) == read_id:
+                return record
+        raise KeyError(name)
+
+    def get_many(self, names) -> list:
+        """Returns the first record with the ID of each name. Records are read
+        in file order.
+
+        Returns:
+            A list of records in the order of `names`, with None for names
+            that are not found.
+        """
+        ids = [_read_id(name) for name in names]
+        candidates = self._find(ids)
+        wanted = sorted(set(r for records in candidates for r in records))
+        found = {}
+        for number, record in self._iter_sorted(wanted):
+            found[number] = record
+        result = []
+        for read_id, records in zip(ids, candidates):
+            match = None
+            for number in records:
+                if _read_id(found[number].name) == read_id:
+                    match = found[number]
+                    break
+            result.append(match)
+        return result
+
+    def close(self):
+        if self._fileobj is not None:
+            self._fileobj.close()
+            self._fileobj = None
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
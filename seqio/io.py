@@ -1,8 +1,24 @@
 # -*- coding: utf-8 -*-
 """
 """
-from types import FileArg, BinMode
-from xphyle.utils import fileinput
+from itertools import chain, zip_longest
+from pathlib import PurePath
+from seqio.compression import open_compressed, open_decompressed
+from seqio.stats import TimedFile, get_stats, instrument_writer, timed_iter
+from seqio.types import FileArg, BinMode
+from seqio.utils import BackgroundIterator
+from xphyle.utils import FileInput, fileinput
+
+DEFAULT_BATCH_SIZE = 65536
+"""Default number of records per batch in `iter_batches`."""
+
+DEFAULT_THREAD_BATCH_SIZE = 1024
+"""Default number of records per batch passed from a background reader thread
+when iterating over records."""
+
+DEFAULT_WRITE_BUFFER_SIZE = 1 << 20
+"""Default number of bytes of formatted records that writers accumulate
+between writes."""
 
 # Exceptions
 
@@ -20,6 +36,27 @@ class SeqIO(object):
     * A member 'name'
     * A function 'close(self)'
     """
+    _stats = None
+    _read_timers = ()
+    
+    def stats(self) -> dict:
+        """Returns the record and batch counts and the per-stage timings (see
+        :mod:`seqio.stats`), or None if this reader/writer was not opened with
+        `stats`.
+        """
+        return None if self._stats is None else self._stats.as_dict()
+    
+    def _timed(self, items, count: bool = True, records_per_item: int = 1,
+               batches: bool = False):
+        """Times the parsing of (and counts) the records or batches of an
+        iterable if statistics are on; otherwise returns it unchanged.
+        """
+        if self._stats is None:
+            return items
+        return timed_iter(
+            items, self._stats.timer('parse'), self._read_timers,
+            self._stats if count else None, records_per_item, batches)
+    
     def __enter__(self):
         return self
     
@@ -27,7 +64,7 @@ class SeqIO(object):
         self.close()
     
     def __repr__(self):
-        return "<{0!r}(name={1!r})>".format(self.class, self.name)
+        return "<{0!r}(name={1!r})>".format(self.__class__, self.name)
 
 class FormatSeqIO(SeqIO):
     """Base class for SeqIO classes with a specific file format.
@@ -50,77 +87,345 @@ class FileSeqIO(FormatSeqIO):
             (.gz, .bz2, .xz)
         mode: The file open mode. Must be binary.
         file_format: A file format name, or an instance of SeqFileFormat
+        decompressor: The name of the gzip decompression backend (see
+            :data:`seqio.compression.DECOMPRESSORS`), or None to select the
+            fastest available one.
+        threads: Whether to decompress each file in a background thread.
+        stats: True (or a :class:`seqio.stats.Stats` object) to count records
+            and time each stage of reading.
         kwargs: Additional arguments to pass to open_
     """
     def __init__(self, *files: FileArg, mode: str = 'b',
-                 file_format: SequenceFormat, **kwargs):
+                 file_format: 'SequenceFormat', decompressor: str = None,
+                 threads: bool = True, stats=None, **kwargs):
         if 'b' not in mode:
             raise ValueError("'mode' must be binary")
         super(FileSeqIO, self).__init__(file_format)
-        self.reader = self._open_reader(*files, mode=mode, **kwargs)
+        self.decompressor = None
+        self._stats = get_stats(stats)
+        self._read_timers = []
+        self._names = tuple(_file_name(path) for path in files)
+        self.reader = self._open_reader(
+            *files, mode=mode, decompressor=decompressor, threads=threads,
+            **kwargs)
     
-    def _open_reader(self, *files: FileArg, mode: str = 'b', **kwargs):
-        return fileinput(files, BinMode)
+    def _open_reader(self, *files: FileArg, mode: str = 'b',
+                     decompressor: str = None, threads: bool = True,
+                     **kwargs):
+        if 'r' not in mode:
+            return fileinput(files, BinMode)
+        opened = []
+        for path in files:
+            if isinstance(path, (str, PurePath)):
+                fileobj, backend = open_decompressed(
+                    path, decompressor, threads)
+                if backend is not None:
+                    # the name of the gzip backend used, e.g. 'igzip'
+                    self.decompressor = backend.name
+            else:
+                fileobj = path
+            opened.append((_file_name(path), fileobj))
+        if self._stats is not None:
+            for i, (name, fileobj) in enumerate(opened):
+                timer = self._stats.timer('decompress')
+                self._read_timers.append(timer)
+                opened[i] = (name, TimedFile(fileobj, timer))
+        return FileInput(opened, BinMode)
     
     @property
     def name(self):
-        return self.fileobj.name
+        """The path of the file, or a tuple of paths if there are several.
+        """
+        if len(self._names) == 1:
+            return self._names[0]
+        return self._names
     
     def close(self):
-        self.fileobj.close()
+        self.reader.close()
+
+def _file_name(path):
+    if isinstance(path, (str, PurePath)):
+        return str(path)
+    return getattr(path, 'name', path)
+
+class BatchReader(object):
+    """Base class for readers that can apply functions to their batches in
+    worker processes. Subclasses must provide `iter_batches(size)`.
+    """
+    def map(self, fn, processes: int = None, ordered: bool = True,
+            in_flight: int = None, size: int = DEFAULT_BATCH_SIZE,
+            writer=None):
+        """Apply a function to each batch of records in worker processes
+        (see :class:`seqio.pipeline.Pipeline`). Batches are passed to and from
+        the workers through shared memory rather than pickled.
+        
+        Args:
+            fn: A picklable function that is called with a
+                :class:`seqio.batch.RecordBatch` (one per mate if the reader
+                is paired).
+            processes: The number of worker processes.
+            ordered: Whether results are in input order.
+            in_flight: The maximum number of batches being processed at once.
+            size: The number of records per batch.
+            writer: A writer to which the results, which must be batches (or
+                tuples of aligned batches), are written.
+        
+        Returns:
+            An iterator over the results, or the number of records written
+            if `writer` is given.
+        """
+        from seqio.pipeline import Pipeline
+        pipeline = Pipeline(fn, processes, ordered, in_flight)
+        return self._run_pipeline(pipeline.map(self.iter_batches(size)), writer)
+    
+    def filter(self, fn, processes: int = None, ordered: bool = True,
+               in_flight: int = None, size: int = DEFAULT_BATCH_SIZE,
+               writer=None):
+        """Filter batches of records with boolean masks computed by a function
+        in worker processes. Arguments are as for :meth:`map`; `fn` returns a
+        mask with one element per record (for paired readers, either one mask
+        for both mates or a tuple of masks that must both be True).
+        
+        Returns:
+            An iterator over the filtered batches, or the number of records
+            written if `writer` is given.
+        """
+        from seqio.pipeline import Pipeline
+        pipeline = Pipeline(fn, processes, ordered, in_flight)
+        return self._run_pipeline(
+            pipeline.filter(self.iter_batches(size)), writer)
+    
+    def _run_pipeline(self, results, writer):
+        if writer is None:
+            return results
+        from seqio.pipeline import write_results
+        return write_results(results, writer)
 
-class SingleReader(object):
+class SingleReader(BatchReader):
     paired = False
+    
+    def iter_views(self, size: int = DEFAULT_BATCH_SIZE):
+        """Iterate over zero-copy record views. Records are parsed in batches
+        of `size`, and each :class:`seqio.views.SequenceView` references its
+        batch's buffers rather than owning copies of its fields.
+        """
+        for batch in self.iter_batches(size):
+            yield from batch.iter_views()
 
 class SingleFileReader(FileSeqIO, SingleReader):
     def __init__(self, *files, file_format, **kwargs):
         super(SingleFileReader, self).__init__(
-            *files, 'rb', file_format, **kwargs)
+            *files, mode='rb', file_format=file_format, **kwargs)
+        self.records = self._timed(self.file_format.iter_records(self.reader))
+    
+    def __iter__(self):
+        return self
     
     def __next__(self):
-        return self.file_format.read_record(self.reader)
+        return next(self.records)
+    
+    def seek_virtual(self, offset: int):
+        """Moves a reader of a single BGZF file to a virtual offset (see
+        :mod:`seqio.compression`), which must be the start of a record.
+        Iteration restarts at that record.
+        """
+        if len(self.reader) != 1:
+            raise ValueError("Seeking requires a single input file")
+        fileobj = self.reader.get(0)
+        if not hasattr(fileobj, 'seek_virtual'):
+            raise ValueError("{} is not BGZF-compressed".format(fileobj.name))
+        fileobj.seek_virtual(offset)
+        self.records = self._timed(self.file_format.iter_records(self.reader))
+    
+    def iter_batches(self, size: int = DEFAULT_BATCH_SIZE):
+        """Iterate over records in columnar batches. Must not be mixed with
+        record-by-record iteration of the same reader.
+        
+        Args:
+            size: The number of records per batch.
+        
+        Yields:
+            :class:`seqio.batch.RecordBatch` objects.
+        """
+        return self._timed(
+            self.file_format.iter_batches(self.reader, size), batches=True)
 
-class PairedReader(object):
+class PairedReader(BatchReader):
     paired = True
     
+    def iter_views(self, size: int = DEFAULT_BATCH_SIZE):
+        """Iterate over pairs of zero-copy record views.
+        """
+        for batch1, batch2 in self.iter_batches(size):
+            yield from zip(batch1.iter_views(), batch2.iter_views())
+    
     def create_record(self, reads):
         if reads[0].name != reads[1].name:
             raise FormatError(
                 "Reads in pair do not have same name: ({0!r} != {1!r})".format(
                 reads[0].name, reads[1].name))
         return reads
+    
+    def create_batch_pair(self, batches):
+        """Batch equivalent of `create_record`: checks that the two batches
+        have the same number of records and the same names.
+        """
+        batch1, batch2 = batches
+        if len(batch1) != len(batch2):
+            raise FormatError(
+                "Paired batches have different numbers of records: "
+                "{0} != {1}".format(len(batch1), len(batch2)))
+        if not batch1.names_equal(batch2):
+            for i in range(len(batch1)):
+                self.create_record((batch1[i], batch2[i]))
+        return batches
 
 class PairedFileReader(FormatSeqIO, PairedReader):
     """Read from a pair of (possibly compressed) files containing sequences.
+    Unless the file format parses with worker processes, each mate file is
+    decompressed and parsed in its own background thread, and the two streams
+    are paired and validated in the calling thread.
 
     Args:
         name: A name for this sequence reader
         read1, read2: SeqIO instances
         file_format: A file format name, or an instance of SeqFileFormat
+        threads: Whether to read the mate files in background threads.
+        queue_size: The maximum number of batches each thread reads ahead.
+        thread_batch_size: The number of records per batch passed from each
+            thread when iterating over records.
     """
-    def __init__(self, name, read1, read2, file_format):
+    def __init__(self, name, read1, read2, file_format, threads: bool = True,
+                 queue_size: int = 4,
+                 thread_batch_size: int = DEFAULT_THREAD_BATCH_SIZE):
         super(PairedFileReader, self).__init__(file_format)
         self.name = name
         self.read1 = read1
         self.read2 = read2
+        self.threads = (
+            threads and getattr(file_format, 'parallel', None) is None)
+        self.queue_size = queue_size
+        self.thread_batch_size = thread_batch_size
+        self._mates = ()
+        self.pairs = None
+        # the mates count towards the statistics of read1, which are shared
+        # with read2 if the mates were opened with the same Stats object
+        self._stats = read1._stats
+        self._read_timers = tuple(read1._read_timers) + tuple(
+            read2._read_timers)
+    
+    @property
+    def decompressor(self):
+        """The name of the gzip decompression backend of the read1 file.
+        """
+        return self.read1.decompressor
+    
+    def __iter__(self):
+        return self
     
     def __next__(self):
-        reads = tuple(next(self.read1), next(self.read2))
-        if not all(reads):
-            raise FormatError("At least one read is 'None'")
-        return self.create_record(reads)
+        if self.pairs is None:
+            if self.threads:
+                self.pairs = self._iter_thread_pairs()
+            else:
+                self.pairs = self._timed(
+                    self.file_format.iter_paired_records(
+                        self.read1.reader, self.read2.reader),
+                    records_per_item=2)
+        return self.create_record(next(self.pairs))
+    
+    def _iter_thread_pairs(self):
+        for batch1, batch2 in self._iter_thread_batches(
+                self.thread_batch_size):
+            yield from zip(batch1, batch2)
+    
+    def _iter_thread_batches(self, size):
+        """Reads batches of `size` records from each mate file in a
+        background thread, and yields pairs of batches.
+        """
+        # each mate is timed in its own thread, and counted in this one
+        self._mates = tuple(
+            BackgroundIterator(
+                mate._timed(
+                    self.file_format.iter_batches(mate.reader, size),
+                    count=False),
+                self.queue_size, name='{} read{}'.format(self.name, i))
+            for i, mate in enumerate((self.read1, self.read2), 1))
+        for batch1, batch2 in self._match_counts(zip_longest(*self._mates)):
+            if self._stats is not None:
+                self._stats.count(2 * len(batch1), 2)
+            yield (batch1, batch2)
+    
+    def _match_counts(self, batches):
+        """Checks that pairs of batches have the same numbers of records. If
+        one file has fewer records, the pairs before the first unmatched
+        record are yielded before a FormatError is raised, as when iterating
+        over records.
+        """
+        for batch1, batch2 in batches:
+            if batch1 is None or batch2 is None:
+                raise FormatError(
+                    "Paired files have different numbers of records")
+            count = min(len(batch1), len(batch2))
+            if count != len(batch1) or count != len(batch2):
+                if count:
+                    yield (batch1.slice(0, count), batch2.slice(0, count))
+                raise FormatError(
+                    "Paired files have different numbers of records")
+            yield (batch1, batch2)
+    
+    def iter_batches(self, size: int = DEFAULT_BATCH_SIZE):
+        """Iterate over pairs of aligned columnar batches.
+        
+        Args:
+            size: The number of pairs per batch.
+        
+        Yields:
+            Tuples (batch1, batch2) of :class:`seqio.batch.RecordBatch`.
+        """
+        if self.threads:
+            batches = self._iter_thread_batches(size)
+        else:
+            batches = self._match_counts(self._timed(
+                self.file_format.iter_paired_batches(
+                    self.read1.reader, self.read2.reader, size),
+                records_per_item=2, batches=True))
+        for batch_pair in batches:
+            yield self.create_batch_pair(batch_pair)
     
     def close(self):
+        for mate in self._mates:
+            mate.close()
         self.read1.close()
         self.read2.close()
 
 class InterleavedFileReader(FileSeqIO, PairedReader):
-    def __init__(self, files: FileArg, file_format, **kwargs):
+    def __init__(self, *files: FileArg, file_format, **kwargs):
         super(InterleavedFileReader, self).__init__(
-            path, 'rb', file_format, **kwargs)
+            *files, mode='rb', file_format=file_format, **kwargs)
+        self.pairs = self._timed(
+            self.file_format.iter_pairs(self.reader), records_per_item=2)
+    
+    def __iter__(self):
+        return self
     
     def __next__(self):
-        return self.create_record(self.file_format.read_pair(self.fileobj))
+        return self.create_record(next(self.pairs))
+    
+    def iter_batches(self, size: int = DEFAULT_BATCH_SIZE):
+        """Iterate over pairs of aligned columnar batches.
+        
+        Args:
+            size: The number of pairs per batch.
+        
+        Yields:
+            Tuples (batch1, batch2) of :class:`seqio.batch.RecordBatch`.
+        """
+        batches = self._timed(
+            self.file_format.iter_batch_pairs(self.reader, size),
+            records_per_item=2, batches=True)
+        for batch_pair in batches:
+            yield self.create_batch_pair(batch_pair)
     
     def iter_single_end(self, end):
         end -= 1
@@ -130,13 +435,75 @@ class InterleavedFileReader(FileSeqIO, PairedReader):
 class SingleWriter(object):
     paired = False
 
-class SequenceWriter(FileSeqIO):
-    def __init__(self, path, file_format, **kwargs):
-        super(SequenceWriter, self).__init__(
-            path, 'wb', file_format, **kwargs)
+class SequenceWriter(FormatSeqIO, SingleWriter):
+    """Write sequences to a (possibly compressed) file. Formatted records are
+    accumulated in a buffer, which is written to the file once it holds at
+    least `buffer_size` bytes.
+    
+    Args:
+        path: Path or file-like object. Unless `compression` is given, the
+            file is compressed according to its extension (.gz, .bz2, .xz).
+        file_format: An instance of SequenceFormat
+        buffer_size: The number of bytes to buffer between writes; 0 to write
+            every record immediately.
+        compression: 'gzip' or 'bgzf' to compress blocks of output in
+            parallel (see :class:`seqio.compression.BlockCompressedWriter`),
+            or any compression format supported by xphyle.
+        threads: The number of compression threads for 'gzip' or 'bgzf'
+            compression. Defaults to the number of CPUs.
+        stats: True (or a :class:`seqio.stats.Stats` object) to count records
+            and time each stage of writing.
+        kwargs: Additional arguments to pass to
+            :func:`seqio.compression.open_compressed` (e.g. `block_size` and
+            `level`)
+    """
+    def __init__(self, path, file_format,
+                 buffer_size: int = DEFAULT_WRITE_BUFFER_SIZE,
+                 compression: str = None, threads: int = None, stats=None,
+                 **kwargs):
+        super(SequenceWriter, self).__init__(file_format)
+        self.fileobj = open_compressed(path, compression, threads, **kwargs)
+        self.name = getattr(self.fileobj, 'name', str(path))
+        self.buffer_size = buffer_size
+        self.buffer = bytearray()
+        self._stats = get_stats(stats)
+        if self._stats is not None:
+            instrument_writer(self, self._stats)
     
     def write(self, record):
-        self.fileobj.write(self.file_format.format_record(record))
+        self.file_format.format_into(self.buffer, record)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+    
+    def write_batch(self, records):
+        """Write many records, formatted in a single call.
+        
+        Args:
+            records: A :class:`seqio.batch.RecordBatch` or an iterable of
+                records.
+        """
+        self._write_formatted(self.file_format.format_batch(records))
+    
+    def _write_formatted(self, data):
+        if len(self.buffer) + len(data) < self.buffer_size:
+            self.buffer += data
+        else:
+            self.flush()
+            self.fileobj.write(data)
+    
+    def flush(self):
+        """Write any buffered records to the file.
+        """
+        if self.buffer:
+            # the file may hold on to the data (e.g. to compress it in
+            # another thread), so start a new buffer rather than clearing it
+            data = self.buffer
+            self.buffer = bytearray()
+            self.fileobj.write(data)
+    
+    def close(self):
+        self.flush()
+        self.fileobj.close()
 
 class PairedFileWriter(FormatSeqIO):
     """Write sequences to a pair of (possibly compressed) files.
@@ -153,22 +520,48 @@ class PairedFileWriter(FormatSeqIO):
         self.name = name
         self.read1 = read1
         self.read2 = read2
+        self._stats = read1._stats
     
     def write(self, read1, read2):
         self.read1.write(read1)
         self.read2.write(read2)
     
+    def write_batch(self, batch1, batch2):
+        """Write aligned batches of mates (:class:`seqio.batch.RecordBatch`
+        objects or sequences of records).
+        """
+        if len(batch1) != len(batch2):
+            raise ValueError("Batches have different numbers of records")
+        self.read1.write_batch(batch1)
+        self.read2.write_batch(batch2)
+    
+    def flush(self):
+        self.read1.flush()
+        self.read2.flush()
+    
     def close(self):
         self.read1.close()
         self.read2.close()
 
-class InterleavedFileWriter(FileSeqIO):
+class InterleavedFileWriter(SequenceWriter):
     paired = True
     
-    def __init__(self, path, file_format, **kwargs):
-        super(InterleavedFileWriter, self).__init__(
-            path, 'wb', file_format, **kwargs)
-    
     def write(self, read1, read2):
-        self.fileobj.write(self.file_format.format_record(read1))
-        self.fileobj.write(self.file_format.format_record(read2))
+        self.file_format.format_into(self.buffer, read1)
+        self.file_format.format_into(self.buffer, read2)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+    
+    def write_batch(self, batch1, batch2):
+        """Write aligned batches of mates (:class:`seqio.batch.RecordBatch`
+        objects or sequences of records), interleaved.
+        """
+        # seqio.batch imports this module (through seqio.sequences)
+        from seqio.batch import RecordBatch
+        if isinstance(batch1, RecordBatch) and isinstance(batch2, RecordBatch):
+            records = RecordBatch.interleave(batch1, batch2)
+        elif len(batch1) != len(batch2):
+            raise ValueError("Batches have different numbers of records")
+        else:
+            records = chain.from_iterable(zip(batch1, batch2))
+        super(InterleavedFileWriter, self).write_batch(records)
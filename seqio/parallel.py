@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""Parallel parsing of FASTQ files in a process pool.
+
+The main process reads (and decompresses) each file in large chunks that are
+cut at record boundaries, worker processes parse the chunks into
+:class:`seqio.batch.RecordBatch` objects, and the batches are yielded in the
+original order. At most `queue_size` chunks are in flight at any time, so
+memory use is bounded by roughly `queue_size * chunk_size` regardless of the
+file size.
+"""
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from itertools import zip_longest
+from seqio.io import FormatError
+from seqio.parsers import FastqParser, rfind_record_start, count_records
+from seqio.sequences import Sequence
+
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+"""Default number of (decompressed) bytes per chunk."""
+
+# Chunking (main process)
+
+def iter_chunks(fileobj, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """Splits a FASTQ file into chunks of whole records. Each chunk edge is
+    moved back to the last verified record start (see
+    :func:`seqio.parsers.rfind_record_start`), so only the tail of each chunk
+    is scanned.
+
+    Yields:
+        Chunks of bytes.
+    """
+    leftover = b''
+    while True:
+        block = fileobj.read(chunk_size)
+        if not block:
+            if leftover:
+                yield leftover
+            return
+        buf = leftover + block
+        cut = rfind_record_start(buf)
+        if cut <= 0:
+            # a single record is larger than the chunk
+            leftover = buf
+            continue
+        yield buf[:cut]
+        leftover = buf[cut:]
+
+def iter_interleaved_chunks(fileobj, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """Splits an interleaved FASTQ file into chunks that each contain an even
+    number of records, so that no pair spans two chunks.
+
+    Yields:
+        Chunks of bytes.
+    """
+    leftover = b''
+    while True:
+        block = fileobj.read(chunk_size)
+        if not block:
+            if leftover:
+                yield leftover
+            return
+        buf = leftover + block
+        count, cut = count_records(buf)
+        if count % 2:
+            count, cut = count_records(buf, count - 1)
+        if count == 0:
+            leftover = buf
+            continue
+        yield buf[:cut]
+        leftover = buf[cut:]
+
+def iter_paired_chunks(fileobj1, fileobj2, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """Splits a pair of FASTQ files into pairs of chunks with the same number
+    of records. Each step reads from the file with fewer complete records
+    buffered, so a file with longer reads does not leave a growing backlog in
+    the other one, and only newly read bytes are scanned for records.
+
+    Yields:
+        Tuples (chunk1, chunk2).
+    """
+    fileobjs = (fileobj1, fileobj2)
+    bufs = [b'', b'']
+    # the number of complete records at the start of each buffer, and the
+    # offset of the end of the last one
+    counts = [0, 0]
+    ends = [0, 0]
+    eofs = [False, False]
+    while not all(eofs):
+        if any(eofs) and max(counts) > min(counts) + 1:
+            # more records than the ended file can possibly hold; the
+            # difference is reported by the parser
+            break
+        lowest = min(counts[i] for i in (0, 1) if not eofs[i])
+        for i in (0, 1):
+            if eofs[i] or counts[i] != lowest:
+                continue
+            block = fileobjs[i].read(chunk_size)
+            if not block:
+                eofs[i] = True
+                continue
+            bufs[i] += block
+            count, offset = count_records(memoryview(bufs[i])[ends[i]:])
+            counts[i] += count
+            ends[i] += offset
+        count = min(counts)
+        if count == 0:
+            continue
+        chunks = []
+        for i in (0, 1):
+            if counts[i] == count:
+                cut = ends[i]
+            else:
+                cut = count_records(bufs[i], count)[1]
+            chunks.append(bufs[i][:cut])
+            bufs[i] = bufs[i][cut:]
+            counts[i] -= count
+            ends[i] -= cut
+        yield tuple(chunks)
+    if bufs[0] or bufs[1]:
+        # any difference in record counts is reported by the parser
+        yield tuple(bufs)
+
+# Parsing (worker processes)
+
+def parse_chunk(chunk: bytes, sequence_class=Sequence):
+    """Parses a chunk of whole FASTQ records into a batch.
+    """
+    # every record has four newlines, except possibly the last
+    max_records = chunk.count(b'\n') // 4 + 1
+    parser = FastqParser(BytesIO(chunk), sequence_class, len(chunk) + 1)
+    return parser.next_batch(max_records)
+
+def parse_interleaved_chunk(chunk: bytes, sequence_class=Sequence):
+    """Parses a chunk of interleaved FASTQ records into a pair of batches.
+    """
+    max_pairs = chunk.count(b'\n') // 8 + 1
+    parser = FastqParser(BytesIO(chunk), sequence_class, len(chunk) + 1)
+    return parser.next_batch_pair(max_pairs)
+
+def parse_chunk_pair(chunk1: bytes, chunk2: bytes, sequence_class=Sequence):
+    """Parses a pair of chunks into a pair of batches.
+    """
+    batch1 = parse_chunk(chunk1, sequence_class)
+    batch2 = parse_chunk(chunk2, sequence_class)
+    if batch1 is None or batch2 is None or len(batch1) != len(batch2):
+        raise FormatError("Paired files have different numbers of records")
+    return (batch1, batch2)
+
+# Process pool
+
+class ParallelFastqParser(object):
+    """Parses FASTQ files with a pool of worker processes.
+
+    Args:
+        workers: The number of worker processes.
+        queue_size: The maximum number of chunks that are read but not yet
+            yielded. Defaults to twice the number of workers.
+        chunk_size: The approximate number of bytes per chunk.
+        sequence_class: The record class of the batches.
+    """
+    def __init__(self, workers: int, queue_size: int = None,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 sequence_class=Sequence):
+        if workers < 1:
+            raise ValueError("'workers' must be >= 1")
+        self.workers = workers
+        self.queue_size = queue_size or 2 * workers
+        if self.queue_size < 1:
+            raise ValueError("'queue_size' must be >= 1")
+        self.chunk_size = chunk_size
+        self.sequence_class = sequence_class
+
+    def _map(self, fn, chunks):
+        """Applies `fn` to each chunk in the process pool, yielding results in
+        order and keeping at most `queue_size` chunks in flight.
+        """
+        pending = deque()
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            try:
+                for chunk in chunks:
+                    if len(pending) >= self.queue_size:
+                        yield pending.popleft().result()
+                    if not isinstance(chunk, tuple):
+                        chunk = (chunk,)
+                    pending.append(
+                        executor.submit(fn, *chunk, self.sequence_class))
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def iter_batches(self, fileinput):
+        """Iterate over the records in a sequence of files.
+
+        Args:
+            fileinput: A :class:`xphyle.utils.FileInput`.
+
+        Yields:
+            :class:`seqio.batch.RecordBatch` objects, one per chunk.
+        """
+        def chunks():
+            for _, fileobj in fileinput.iter_files():
+                yield from iter_chunks(fileobj, self.chunk_size)
+        for batch in self._map(parse_chunk, chunks()):
+            if batch is not None:
+                yield batch
+
+    def iter_batch_pairs(self, fileinput):
+        """Iterate over the pairs of records in a sequence of interleaved
+        files.
+
+        Yields:
+            Tuples (batch1, batch2), one per chunk.
+        """
+        def chunks():
+            for _, fileobj in fileinput.iter_files():
+                yield from iter_interleaved_chunks(fileobj, self.chunk_size)
+        for batches in self._map(parse_interleaved_chunk, chunks()):
+            if batches is not None:
+                yield batches
+
+    def iter_paired_batches(self, fileinput1, fileinput2):
+        """Iterate over the pairs of records in two sequences of files.
+
+        Yields:
+            Tuples (batch1, batch2), one per pair of chunks.
+        """
+        def chunks():
+            files = zip_longest(
+                fileinput1.iter_files(), fileinput2.iter_files())
+            for file1, file2 in files:
+                if file1 is None or file2 is None:
+                    raise FormatError(
+                        "Different numbers of read1 and read2 files")
+                yield from iter_paired_chunks(
+                    file1[1], file2[1], self.chunk_size)
+        return self._map(parse_chunk_pair, chunks())
@@ -0,0 +1,509 @@
+# kate: syntax Python;
+# cython: profile=False, emit_code_comments=False
+# cython: language_level=3
+# cython: boundscheck=False
+# cython: wraparound=False
+"""Cython implementations of block-based record parsers.
+"""
+from cpython.bytearray cimport (
+    PyByteArray_AS_STRING, PyByteArray_FromStringAndSize, PyByteArray_GET_SIZE,
+    PyByteArray_Resize)
+from cpython.bytes cimport PyBytes_FromStringAndSize
+from libc.stdint cimport uint64_t
+from libc.string cimport memchr, memcmp, memcpy, memmove
+
+import numpy as np
+from seqio.batch import RecordBatch, offsets_dtype
+from seqio.sequences cimport Sequence
+from seqio.io import FormatError
+
+DEFAULT_BUFFER_SIZE = 4 * 1024 * 1024
+"""Default size of the blocks read from the underlying file."""
+
+cdef inline Py_ssize_t find_newline(
+        const char* data, Py_ssize_t start, Py_ssize_t end) nogil:
+    """Returns the index of the first newline in data[start:end], or -1.
+    """
+    cdef const char* p = <const char*>memchr(data + start, b'\n', end - start)
+    if p == NULL:
+        return -1
+    return p - data
+
+cdef inline Py_ssize_t strip_cr(
+        const char* data, Py_ssize_t start, Py_ssize_t end) nogil:
+    """Returns `end`, moved back by one if the line ends in a carriage return.
+    """
+    if end > start and data[end - 1] == b'\r':
+        return end - 1
+    return end
+
+cdef inline char* reserve(
+        bytearray buf, Py_ssize_t used, Py_ssize_t extra) except NULL:
+    """Grows `buf` (at least doubling it) if necessary so that `extra` bytes
+    can be written after the first `used` bytes.
+
+    Returns:
+        A pointer to the first free byte.
+    """
+    cdef Py_ssize_t size = PyByteArray_GET_SIZE(buf)
+    if used + extra > size:
+        PyByteArray_Resize(buf, max(2 * size, used + extra))
+    return PyByteArray_AS_STRING(buf) + used
+
+cdef inline bytearray uninitialized_bytearray(Py_ssize_t size):
+    """Allocates a bytearray without zeroing it.
+    """
+    return PyByteArray_FromStringAndSize(NULL, size)
+
+ctypedef struct RecordLocation:
+    Py_ssize_t name_start
+    Py_ssize_t name_len
+    Py_ssize_t seq_start
+    Py_ssize_t qual_start
+    Py_ssize_t length
+
+cdef class BatchBuilder(object):
+    """Accumulates records into the concatenated buffers and offset arrays of a
+    :class:`seqio.batch.RecordBatch`.
+
+    Args:
+        capacity: The maximum number of records in the batch.
+        qualities: Whether the records have qualities.
+        size_hint: The expected total size of the sequences in the batch; the
+            buffers grow as needed, so this only needs to be approximate.
+    """
+    cdef:
+        bytearray names
+        bytearray sequences
+        bytearray qualities
+        object name_offsets_array
+        object offsets_array
+        uint64_t[::1] name_offsets
+        uint64_t[::1] offsets
+        Py_ssize_t capacity
+        readonly Py_ssize_t count
+
+    def __init__(self, Py_ssize_t capacity, bint qualities=True,
+                 Py_ssize_t size_hint=65536):
+        self.capacity = capacity
+        self.count = 0
+        self.names = uninitialized_bytearray(max(size_hint // 4, 16))
+        self.sequences = uninitialized_bytearray(max(size_hint, 16))
+        self.qualities = None
+        if qualities:
+            self.qualities = uninitialized_bytearray(max(size_hint, 16))
+        self.name_offsets_array = np.zeros(capacity + 1, dtype=np.uint64)
+        self.offsets_array = np.zeros(capacity + 1, dtype=np.uint64)
+        self.name_offsets = self.name_offsets_array
+        self.offsets = self.offsets_array
+
+    @property
+    def full(self):
+        return self.count >= self.capacity
+
+    cdef int append(self, const char* data, RecordLocation* loc) except -1:
+        """Copies the fields of the record at `loc` into the batch buffers.
+        """
+        cdef:
+            Py_ssize_t i = self.count
+            Py_ssize_t names_used = self.name_offsets[i]
+            Py_ssize_t used = self.offsets[i]
+        memcpy(
+            reserve(self.names, names_used, loc.name_len),
+            data + loc.name_start, loc.name_len)
+        memcpy(
+            reserve(self.sequences, used, loc.length),
+            data + loc.seq_start, loc.length)
+        if self.qualities is not None:
+            memcpy(
+                reserve(self.qualities, used, loc.length),
+                data + loc.qual_start, loc.length)
+        self.name_offsets[i + 1] = names_used + loc.name_len
+        self.offsets[i + 1] = used + loc.length
+        self.count += 1
+        return 0
+
+    cpdef object finish(self, sequence_class=Sequence):
+        """Trims the buffers and wraps them (without copying) in a
+        :class:`seqio.batch.RecordBatch`.
+        """
+        cdef:
+            Py_ssize_t n = self.count
+            Py_ssize_t names_used = self.name_offsets[n]
+            Py_ssize_t used = self.offsets[n]
+            object qualities = None
+        PyByteArray_Resize(self.names, names_used)
+        PyByteArray_Resize(self.sequences, used)
+        if self.qualities is not None:
+            PyByteArray_Resize(self.qualities, used)
+            qualities = np.frombuffer(self.qualities, dtype=np.uint8)
+        return RecordBatch(
+            np.frombuffer(self.names, dtype=np.uint8),
+            self.name_offsets_array[:n + 1].astype(offsets_dtype(names_used)),
+            np.frombuffer(self.sequences, dtype=np.uint8),
+            self.offsets_array[:n + 1].astype(offsets_dtype(used)),
+            qualities, sequence_class)
+
+cdef class BlockBuffer(object):
+    """A growable buffer that is filled with large blocks read from a binary
+    file-like object. Unparsed bytes at the end of the buffer are moved to the
+    front before the next block is read, so records can span block edges.
+
+    Args:
+        fileobj: A binary file-like object with a `read` method.
+        buffer_size: The initial size of the buffer. The buffer grows as
+            necessary to hold records that are larger than it.
+    """
+    cdef:
+        object fileobj
+        bytearray buf
+        Py_ssize_t bufsize
+        Py_ssize_t pos
+        Py_ssize_t end
+        bint eof
+
+    def __init__(self, fileobj, Py_ssize_t buffer_size=DEFAULT_BUFFER_SIZE):
+        if buffer_size < 1:
+            raise ValueError("'buffer_size' must be >= 1")
+        self.fileobj = fileobj
+        self.bufsize = buffer_size
+        self.buf = bytearray(buffer_size)
+        self.pos = 0
+        self.end = 0
+        self.eof = False
+
+    cdef Py_ssize_t fill(self) except -1:
+        """Moves unparsed bytes to the front of the buffer and appends the next
+        block from the file. At end of file, a missing final newline is added.
+
+        Returns:
+            The number of bytes added to the buffer.
+        """
+        cdef:
+            Py_ssize_t remaining = self.end - self.pos
+            Py_ssize_t size
+            char* data
+            bytes block
+
+        if self.eof:
+            return 0
+
+        data = PyByteArray_AS_STRING(self.buf)
+        if self.pos > 0:
+            if remaining > 0:
+                memmove(data, data + self.pos, remaining)
+            self.pos = 0
+            self.end = remaining
+        elif remaining == self.bufsize:
+            # a single record does not fit in the buffer
+            self.bufsize *= 2
+            PyByteArray_Resize(self.buf, self.bufsize)
+            data = PyByteArray_AS_STRING(self.buf)
+
+        block = self.fileobj.read(self.bufsize - self.end)
+        size = len(block)
+        if size > 0:
+            memcpy(data + self.end, <const char*>block, size)
+            self.end += size
+            return size
+
+        self.eof = True
+        if self.end > 0 and data[self.end - 1] != b'\n':
+            if self.end == self.bufsize:
+                self.bufsize += 1
+                PyByteArray_Resize(self.buf, self.bufsize)
+                data = PyByteArray_AS_STRING(self.buf)
+            data[self.end] = b'\n'
+            self.end += 1
+            return 1
+        return 0
+
+    cdef bint at_end(self):
+        """Whether the file is exhausted and only whitespace remains.
+        """
+        cdef:
+            const char* data = PyByteArray_AS_STRING(self.buf)
+            Py_ssize_t i
+        if not self.eof:
+            return False
+        for i in range(self.pos, self.end):
+            if data[i] not in b' \t\r\n':
+                return False
+        return True
+
+cdef class FastqParser(BlockBuffer):
+    """Iterates over the records in a FASTQ file. The file is read in large
+    blocks and record boundaries are found with `memchr`, which is much faster
+    than reading the file line-by-line.
+
+    Args:
+        fileobj: A binary file-like object with a `read` method.
+        sequence_class: The class of the records to create. Must accept
+            (name, sequence, qualities) as arguments.
+        buffer_size: The initial size of the read buffer.
+    """
+    cdef:
+        object sequence_class
+        bint create_sequence
+        Py_ssize_t size_hint
+        readonly Py_ssize_t record_count
+
+    def __init__(self, fileobj, sequence_class=Sequence,
+                 Py_ssize_t buffer_size=DEFAULT_BUFFER_SIZE):
+        super(FastqParser, self).__init__(fileobj, buffer_size)
+        self.sequence_class = sequence_class
+        self.create_sequence = sequence_class is Sequence
+        self.size_hint = 65536
+        self.record_count = 0
+
+    cdef int locate(self, RecordLocation* loc) except -1:
+        """Finds and validates the next record in the buffer, reading more
+        data as necessary, and consumes it.
+
+        Returns:
+            1 if a record was found, 0 at end of file.
+        """
+        cdef:
+            const char* data
+            Py_ssize_t name_end, seq_end, name2_end, qual_end
+            Py_ssize_t name2_len
+            Py_ssize_t start
+
+        while True:
+            data = PyByteArray_AS_STRING(self.buf)
+            start = self.pos
+            if start < self.end:
+                name_end = find_newline(data, start, self.end)
+                if name_end >= 0:
+                    seq_end = find_newline(data, name_end + 1, self.end)
+                    if seq_end >= 0:
+                        name2_end = find_newline(data, seq_end + 1, self.end)
+                        if name2_end >= 0:
+                            qual_end = find_newline(
+                                data, name2_end + 1, self.end)
+                            if qual_end >= 0:
+                                break
+            if self.fill() == 0:
+                if self.at_end():
+                    return 0
+                raise FormatError(
+                    "Premature end of file: incomplete FASTQ record at "
+                    "record {}".format(self.record_count + 1))
+
+        if data[start] != b'@':
+            raise FormatError(
+                "Line expected to start with '@', but found {!r}".format(
+                    data[start:strip_cr(data, start, name_end)]))
+        if data[seq_end + 1] != b'+':
+            raise FormatError(
+                "Line expected to start with '+', but found {!r}".format(
+                    data[seq_end + 1:strip_cr(data, seq_end + 1, name2_end)]))
+
+        loc.name_start = start + 1
+        loc.name_len = strip_cr(data, start, name_end) - start - 1
+        loc.seq_start = name_end + 1
+        loc.length = strip_cr(data, name_end + 1, seq_end) - name_end - 1
+        loc.qual_start = name2_end + 1
+        name2_len = strip_cr(data, seq_end + 1, name2_end) - seq_end - 2
+        if name2_len > 0 and (
+                name2_len != loc.name_len or
+                memcmp(data + start + 1, data + seq_end + 2, name2_len) != 0):
+            raise FormatError(
+                "Sequence descriptions in the FASTQ file don't match "
+                "({0!r} != {1!r}).\n"
+                "The second sequence description must be either empty "
+                "or equal to the first description.".format(
+                data[start + 1:start + 1 + loc.name_len],
+                data[seq_end + 2:seq_end + 2 + name2_len]))
+        if strip_cr(data, name2_end + 1, qual_end) - name2_end - 1 != loc.length:
+            raise FormatError(
+                "In read named {0!r}: length of quality sequence and length "
+                "of read do not match".format(
+                data[start + 1:start + 1 + loc.name_len]))
+
+        self.pos = qual_end + 1
+        self.record_count += 1
+        return 1
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        cdef:
+            RecordLocation loc
+            const char* data
+            bytes name, sequence, qualities
+            Sequence record
+
+        if self.locate(&loc) == 0:
+            raise StopIteration()
+        data = PyByteArray_AS_STRING(self.buf)
+        name = PyBytes_FromStringAndSize(data + loc.name_start, loc.name_len)
+        sequence = PyBytes_FromStringAndSize(data + loc.seq_start, loc.length)
+        qualities = PyBytes_FromStringAndSize(data + loc.qual_start, loc.length)
+
+        if self.create_sequence:
+            record = Sequence.__new__(Sequence)
+            record.name = name
+            record.sequence = sequence
+            record.qualities = qualities
+            record.length = loc.length
+            return record
+        return self.sequence_class(name, sequence, qualities)
+
+    def next_batch(self, Py_ssize_t size):
+        """Parses up to `size` records into a columnar batch without creating
+        any per-record objects.
+
+        Returns:
+            A :class:`seqio.batch.RecordBatch`, or None at end of file. The
+            batch has fewer than `size` records only at end of file.
+        """
+        cdef:
+            RecordLocation loc
+            BatchBuilder builder = BatchBuilder(
+                size, True, self.size_hint)
+        while not builder.full and self.locate(&loc):
+            builder.append(PyByteArray_AS_STRING(self.buf), &loc)
+        if builder.count == 0:
+            return None
+        self.size_hint = builder.offsets[builder.count]
+        return builder.finish(self.sequence_class)
+
+    def next_batch_pair(self, Py_ssize_t size):
+        """Parses up to `size` pairs of consecutive records (i.e. interleaved
+        paired-end reads) into two aligned columnar batches.
+
+        Returns:
+            A tuple of :class:`seqio.batch.RecordBatch`, or None at end of file.
+        """
+        cdef:
+            RecordLocation loc
+            BatchBuilder builder1 = BatchBuilder(size, True, self.size_hint)
+            BatchBuilder builder2 = BatchBuilder(size, True, self.size_hint)
+        while not builder2.full and self.locate(&loc):
+            builder1.append(PyByteArray_AS_STRING(self.buf), &loc)
+            if self.locate(&loc) == 0:
+                raise FormatError(
+                    "Odd number of records in interleaved file")
+            builder2.append(PyByteArray_AS_STRING(self.buf), &loc)
+        if builder1.count == 0:
+            return None
+        self.size_hint = builder1.offsets[builder1.count]
+        return (
+            builder1.finish(self.sequence_class),
+            builder2.finish(self.sequence_class))
+
+# Chunking helpers for parallel parsing
+
+cdef bint is_record_start(
+        const unsigned char* data, Py_ssize_t start, Py_ssize_t end) nogil:
+    """Whether a valid FASTQ record starts at `start`. '@' is also a valid
+    quality character, so a line starting with '@' is only accepted if the
+    third line starts with '+' (which rules out a quality line followed by the
+    next record's header and sequence), the sequence and quality lines have the
+    same length, and the following line, if any, also starts with '@'.
+    Returns False if the four lines are not all in data[start:end].
+    """
+    cdef:
+        Py_ssize_t ends[4]
+        Py_ssize_t pos = start
+        Py_ssize_t i
+        const unsigned char* p
+    if data[start] != b'@':
+        return False
+    for i in range(4):
+        p = <const unsigned char*>memchr(data + pos, b'\n', end - pos)
+        if p == NULL:
+            return False
+        ends[i] = p - data
+        pos = ends[i] + 1
+    if data[ends[1] + 1] != b'+':
+        return False
+    if ends[1] - ends[0] != ends[3] - ends[2]:
+        return False
+    if pos < end and data[pos] != b'@':
+        return False
+    return True
+
+def find_record_start(const unsigned char[::1] data, Py_ssize_t pos=0):
+    """Finds the first FASTQ record that starts at or after `pos`, which may
+    be an arbitrary offset (e.g. a chunk edge).
+
+    Returns:
+        The offset of the record start, or -1 if none could be verified.
+    """
+    cdef:
+        Py_ssize_t end = data.shape[0]
+        Py_ssize_t found = -1
+        const unsigned char* p
+    if end == 0:
+        return -1
+    with nogil:
+        while pos < end:
+            if (pos == 0 or data[pos - 1] == b'\n') and is_record_start(
+                    &data[0], pos, end):
+                found = pos
+                break
+            p = <const unsigned char*>memchr(&data[pos], b'\n', end - pos)
+            if p == NULL:
+                break
+            pos = p - &data[0] + 1
+    return found
+
+def rfind_record_start(const unsigned char[::1] data):
+    """Finds the last verifiable FASTQ record start in `data` that is not at
+    offset 0. Candidates near the end of the buffer whose four lines are not
+    yet complete are skipped.
+
+    Returns:
+        The offset of the record start, or -1 if none could be verified.
+    """
+    cdef:
+        Py_ssize_t end = data.shape[0]
+        Py_ssize_t pos = end - 1
+        Py_ssize_t found = -1
+    with nogil:
+        while pos > 0:
+            if data[pos] == b'@' and data[pos - 1] == b'\n' and \
+                    is_record_start(&data[0], pos, end):
+                found = pos
+                break
+            pos -= 1
+    return found
+
+def count_records(const unsigned char[::1] data, Py_ssize_t max_records=-1):
+    """Counts the complete four-line records at the start of `data`, which
+    must begin at a record boundary.
+
+    Args:
+        data: The buffer.
+        max_records: Stop after this many records; -1 for no limit.
+
+    Returns:
+        A tuple (count, offset), where `offset` is the end of the last counted
+        record.
+    """
+    cdef:
+        Py_ssize_t end = data.shape[0]
+        Py_ssize_t pos = 0
+        Py_ssize_t record_end = 0
+        Py_ssize_t count = 0
+        Py_ssize_t lines = 0
+        const unsigned char* p
+    if end == 0:
+        return (0, 0)
+    with nogil:
+        while count != max_records:
+            p = <const unsigned char*>memchr(&data[pos], b'\n', end - pos)
+            if p == NULL:
+                break
+            pos = p - &data[0] + 1
+            lines += 1
+            if lines == 4:
+                lines = 0
+                count += 1
+                record_end = pos
+            if pos >= end:
+                break
+    return (count, record_end)
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+"""Parallel processing of record batches in a process pool.
+
+A function is applied to whole :class:`seqio.batch.RecordBatch` objects in
+worker processes. Batches are not pickled: each one is copied into a single
+:class:`multiprocessing.shared_memory.SharedMemory` block, and only the name of
+the block and the layout of its arrays are sent to the worker, which reads the
+batch in place. Batches returned by the function come back the same way; NumPy
+arrays and other values are pickled.
+
+Results are yielded in input order (or as they complete), and at most
+`in_flight` batches are submitted but not yet yielded at any time, so memory
+use does not grow with the size of the input.
+"""
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+import os
+import numpy as np
+from seqio.batch import RecordBatch
+from seqio.qc import filter_pairs
+
+FIELDS = ('names', 'name_offsets', 'sequences', 'offsets', 'qualities')
+"""The arrays of a batch, in the order they are laid out in shared memory."""
+
+ALIGNMENT = 8
+
+# Shared memory transport
+
+class SharedBatch(object):
+    """A :class:`seqio.batch.RecordBatch` copied into a shared memory block.
+    Pickling a SharedBatch only pickles the block name and array layout.
+
+    The process that creates the block owns it until the block is handed to
+    another process with :meth:`close`; whoever receives it last calls
+    :meth:`load` or :meth:`unlink` to free it.
+
+    Args:
+        name: The name of the shared memory block.
+        layout: One tuple (dtype, count, offset) per field in `FIELDS`, or None
+            for a missing field.
+        sequence_class: The record class of the batch.
+    """
+    def __init__(self, name: str, layout, sequence_class):
+        self.name = name
+        self.layout = layout
+        self.sequence_class = sequence_class
+        self._shm = None
+
+    @classmethod
+    def create(cls, batch: RecordBatch) -> 'SharedBatch':
+        """Copy a batch into a new shared memory block.
+        """
+        arrays = [getattr(batch, field) for field in FIELDS]
+        layout = []
+        size = 0
+        for arr in arrays:
+            if arr is None:
+                layout.append(None)
+                continue
+            layout.append((arr.dtype.str, len(arr), size))
+            size += -(-arr.nbytes // ALIGNMENT) * ALIGNMENT
+        shm = SharedMemory(create=True, size=max(size, 1))
+        for arr, spec in zip(arrays, layout):
+            if spec is not None:
+                np.frombuffer(shm.buf, spec[0], spec[1], spec[2])[:] = arr
+        shared = cls(shm.name, layout, batch.sequence_class)
+        shared._shm = shm
+        return shared
+
+    def __getstate__(self):
+        return (self.name, self.layout, self.sequence_class)
+
+    def __setstate__(self, state):
+        self.name, self.layout, self.sequence_class = state
+        self._shm = None
+
+    def attach(self) -> RecordBatch:
+        """Returns a batch whose arrays are views of the shared memory block.
+        The batch (and any arrays derived from it without copying) must be
+        released before :meth:`close` is called.
+        """
+        if self._shm is None:
+            self._shm = SharedMemory(self.name)
+        arrays = [
+            None if spec is None
+            else np.frombuffer(self._shm.buf, spec[0], spec[1], spec[2])
+            for spec in self.layout]
+        return RecordBatch(*arrays, self.sequence_class)
+
+    def load(self) -> RecordBatch:
+        """Returns a copy of the batch, and frees the shared memory block.
+        """
+        try:
+            batch = self.attach()
+            arrays = [
+                None if arr is None else arr.copy()
+                for arr in (getattr(batch, field) for field in FIELDS)]
+            del batch
+            return RecordBatch(*arrays, self.sequence_class)
+        finally:
+            self.unlink()
+
+    def close(self):
+        """Unmaps the block in this process, without freeing it.
+        """
+        if self._shm is not None:
+            shm = self._shm
+            self._shm = None
+            shm.close()
+
+    def unlink(self):
+        """Frees the shared memory block.
+        """
+        if self._shm is None:
+            self._shm = SharedMemory(self.name)
+        shm = self._shm
+        self.close()
+        shm.unlink()
+
+def share(value):
+    """Replaces the batches in a value (a batch or a tuple of values) with
+    :class:`SharedBatch` objects. NumPy arrays are copied, so that they do not
+    refer to shared memory.
+    """
+    if isinstance(value, RecordBatch):
+        shared = SharedBatch.create(value)
+        shared.close()
+        return shared
+    if isinstance(value, np.ndarray):
+        return value.copy()
+    if isinstance(value, tuple):
+        return tuple(share(item) for item in value)
+    return value
+
+def unshare(value):
+    """Inverse of :func:`share`: loads (and frees) the shared batches in a
+    value.
+    """
+    if isinstance(value, SharedBatch):
+        return value.load()
+    if isinstance(value, tuple):
+        return tuple(unshare(item) for item in value)
+    return value
+
+def free(value):
+    """Frees the shared batches in a value without loading them.
+    """
+    if isinstance(value, SharedBatch):
+        value.unlink()
+    elif isinstance(value, tuple):
+        for item in value:
+            free(item)
+
+# Worker processes
+
+def apply_shared(fn, shared):
+    """Applies `fn` to the batches in shared memory (one batch, or a tuple of
+    aligned batches), and shares the result.
+    """
+    batches = tuple(item.attach() for item in shared)
+    try:
+        result = share(fn(*batches))
+    finally:
+        del batches
+    try:
+        for item in shared:
+            item.close()
+    except BufferError:
+        free(result)
+        raise ValueError(
+            "The result of {!r} refers to the memory of its input batch; "
+            "return batches or arrays rather than views".format(fn))
+    return result
+
+# Process pool
+
+class Pipeline(object):
+    """Applies a function to batches in a pool of worker processes.
+
+    Args:
+        fn: The function, which must be picklable (e.g. defined at module
+            level). It is called with a batch, or with two aligned batches
+            for paired input, and may return batches, NumPy arrays or any
+            other picklable value. It must not modify its input.
+        processes: The number of worker processes. Defaults to the number of
+            CPUs.
+        ordered: Whether results are yielded in the order of the input
+            batches. Otherwise, they are yielded as they complete.
+        in_flight: The maximum number of batches that are submitted but not
+            yet yielded. Defaults to twice the number of processes.
+    """
+    def __init__(self, fn, processes: int = None, ordered: bool = True,
+                 in_flight: int = None):
+        self.fn = fn
+        self.processes = processes or os.cpu_count() or 1
+        if self.processes < 1:
+            raise ValueError("'processes' must be >= 1")
+        self.in_flight = in_flight or 2 * self.processes
+        if self.in_flight < 1:
+            raise ValueError("'in_flight' must be >= 1")
+        self.ordered = ordered
+
+    def _submit(self, executor, batches):
+        shared = []
+        try:
+            for batch in batches:
+                shared.append(SharedBatch.create(batch))
+                shared[-1].close()
+        except BaseException:
+            free(tuple(shared))
+            raise
+        shared = tuple(shared)
+        future = executor.submit(apply_shared, self.fn, shared)
+        return future, shared
+
+    def _iter_results(self, items):
+        """Yields tuples (item, result) for each item (a batch or a tuple of
+        aligned batches).
+        """
+        # workers must share this process' resource tracker, which would
+        # otherwise report the blocks they create as leaked
+        resource_tracker.ensure_running()
+        pending = deque()
+        with ProcessPoolExecutor(max_workers=self.processes) as executor:
+            def finish(task):
+                future, shared, item = task
+                try:
+                    return item, unshare(future.result())
+                finally:
+                    free(shared)
+            try:
+                for item in items:
+                    while len(pending) >= self.in_flight:
+                        yield finish(self._next_done(pending))
+                    batches = item if isinstance(item, tuple) else (item,)
+                    pending.append(
+                        self._submit(executor, batches) + (item,))
+                while pending:
+                    yield finish(self._next_done(pending))
+            finally:
+                for future, shared, _ in pending:
+                    future.cancel()
+                for future, shared, _ in pending:
+                    try:
+                        free(future.result())
+                    except Exception:
+                        pass
+                    free(shared)
+
+    def _next_done(self, pending):
+        if not self.ordered:
+            done, _ = wait(
+                [task[0] for task in pending], return_when=FIRST_COMPLETED)
+            for task in pending:
+                if task[0] in done:
+                    pending.remove(task)
+                    return task
+        return pending.popleft()
+
+    def map(self, batches):
+        """Applies the function to each batch (or tuple of aligned batches).
+
+        Yields:
+            The results.
+        """
+        for _, result in self._iter_results(batches):
+            yield result
+
+    def filter(self, batches):
+        """Filters each batch with a boolean mask returned by the function.
+        For tuples of aligned batches, the mask (or a tuple of masks, one per
+        batch, which must all be True) selects the records of every batch.
+
+        Yields:
+            Filtered batches, or tuples of aligned batches.
+        """
+        for item, mask in self._iter_results(batches):
+            if not isinstance(item, tuple):
+                yield item.filter(mask)
+            elif isinstance(mask, tuple):
+                yield filter_pairs(*item, *mask)
+            else:
+                yield filter_pairs(*item, mask)
+
+def write_results(results, writer) -> int:
+    """Writes the batches (or tuples of aligned batches) yielded by a
+    pipeline with `writer.write_batch`.
+
+    Returns:
+        The number of records (or pairs) written.
+    """
+    count = 0
+    for result in results:
+        if isinstance(result, tuple):
+            writer.write_batch(*result)
+            count += len(result[0])
+        else:
+            writer.write_batch(result)
+            count += len(result)
+    return count
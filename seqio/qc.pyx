@@ -0,0 +1,270 @@
+# kate: syntax Python;
+# cython: profile=False, emit_code_comments=False
+# cython: language_level=3
+# cython: boundscheck=False
+# cython: wraparound=False
+"""Quality control kernels over whole :class:`seqio.batch.RecordBatch`es.
+
+Each kernel makes one compiled pass over a batch's buffers and returns NumPy
+arrays aligned with its records: per-record statistics, boolean masks (for
+:meth:`seqio.batch.RecordBatch.filter`), or trimming windows as a tuple
+(starts, stops) of positions within each record (for
+:meth:`seqio.batch.RecordBatch.trim`). Windows from several kernels are
+combined with `np.maximum` of the starts and `np.minimum` of the stops.
+Paired-end batches are kept in sync by filtering both mates with one mask;
+see :func:`filter_pairs`.
+"""
+from libc.math cimport NAN
+from libc.stdint cimport int64_t, uint64_t
+
+import numpy as np
+
+cdef const uint64_t[::1] as_bounds(offsets):
+    return np.asarray(offsets).astype(np.uint64, copy=False)
+
+# Kernels over a concatenated buffer and its offsets
+
+def mean_qualities(qualities, offsets, int base=33) -> np.ndarray:
+    """Returns the mean phred score of each record as a float32 array (NaN
+    for empty records).
+    """
+    cdef:
+        const unsigned char[::1] data = qualities
+        const uint64_t[::1] bounds = as_bounds(offsets)
+        Py_ssize_t n = bounds.shape[0] - 1
+        float[::1] dest
+        uint64_t i, j, total
+    result = np.empty(n, dtype=np.float32)
+    dest = result
+    with nogil:
+        for i in range(<uint64_t>n):
+            total = 0
+            for j in range(bounds[i], bounds[i + 1]):
+                total += data[j]
+            if bounds[i + 1] > bounds[i]:
+                dest[i] = (
+                    <double>total / (bounds[i + 1] - bounds[i])) - base
+            else:
+                dest[i] = NAN
+    return result
+
+def min_qualities(qualities, offsets, int base=33) -> np.ndarray:
+    """Returns the minimum phred score of each record as an int16 array (0
+    for empty records).
+    """
+    cdef:
+        const unsigned char[::1] data = qualities
+        const uint64_t[::1] bounds = as_bounds(offsets)
+        Py_ssize_t n = bounds.shape[0] - 1
+        short[::1] dest
+        uint64_t i, j
+        unsigned char low
+    result = np.zeros(n, dtype=np.int16)
+    dest = result
+    with nogil:
+        for i in range(<uint64_t>n):
+            if bounds[i + 1] == bounds[i]:
+                continue
+            low = 255
+            for j in range(bounds[i], bounds[i + 1]):
+                if data[j] < low:
+                    low = data[j]
+            dest[i] = low - base
+    return result
+
+def quality_trim_windows(qualities, offsets, int cutoff_back,
+                         int cutoff_front=0, int base=33):
+    """Finds the part of each record to keep after BWA-style quality trimming:
+    from each end, the prefix/suffix that maximizes the sum of (cutoff -
+    phred score) is removed.
+
+    Args:
+        qualities: The concatenated qualities.
+        offsets: The record boundaries.
+        cutoff_back: The quality cutoff for the 3' end.
+        cutoff_front: The quality cutoff for the 5' end (0 to not trim it).
+        base: The ascii offset of the phred scores.
+
+    Returns:
+        A tuple (starts, stops) of int64 arrays.
+    """
+    cdef:
+        const unsigned char[::1] data = qualities
+        const uint64_t[::1] bounds = as_bounds(offsets)
+        Py_ssize_t n = bounds.shape[0] - 1
+        int64_t[::1] start_view, stop_view
+        int64_t i, j, length, start, stop, score, best
+        const unsigned char* q
+    starts = np.zeros(n, dtype=np.int64)
+    stops = np.empty(n, dtype=np.int64)
+    start_view = starts
+    stop_view = stops
+    with nogil:
+        for i in range(n):
+            length = bounds[i + 1] - bounds[i]
+            if length == 0:
+                stop_view[i] = 0
+                continue
+            q = &data[bounds[i]]
+            start = 0
+            stop = length
+            if cutoff_front > 0:
+                score = best = 0
+                for j in range(length):
+                    score += cutoff_front - (q[j] - base)
+                    if score < 0:
+                        break
+                    if score > best:
+                        best = score
+                        start = j + 1
+            if cutoff_back > 0:
+                score = best = 0
+                for j in range(length - 1, -1, -1):
+                    score += cutoff_back - (q[j] - base)
+                    if score < 0:
+                        break
+                    if score > best:
+                        best = score
+                        stop = j
+            if start >= stop:
+                start = stop = 0
+            start_view[i] = start
+            stop_view[i] = stop
+    return starts, stops
+
+cdef void make_table(bytes chars, unsigned char* table):
+    cdef:
+        int i
+        unsigned char c
+    for i in range(256):
+        table[i] = 0
+    for c in chars:
+        table[c] = 1
+
+def count_bases(sequences, offsets, bytes bases=b'Nn') -> np.ndarray:
+    """Returns the number of bases of each record that are in `bases` as a
+    uint32 array.
+    """
+    cdef:
+        const unsigned char[::1] data = sequences
+        const uint64_t[::1] bounds = as_bounds(offsets)
+        Py_ssize_t n = bounds.shape[0] - 1
+        unsigned int[::1] dest
+        unsigned char[256] table
+        uint64_t i, j
+        unsigned int count
+    make_table(bases, table)
+    result = np.empty(n, dtype=np.uint32)
+    dest = result
+    with nogil:
+        for i in range(<uint64_t>n):
+            count = 0
+            for j in range(bounds[i], bounds[i + 1]):
+                count += table[data[j]]
+            dest[i] = count
+    return result
+
+def end_trim_windows(sequences, offsets, bytes bases=b'Nn',
+                     bint front=True, bint back=True):
+    """Finds the part of each record that remains after removing the leading
+    and/or trailing runs of bases in `bases`.
+
+    Returns:
+        A tuple (starts, stops) of int64 arrays.
+    """
+    cdef:
+        const unsigned char[::1] data = sequences
+        const uint64_t[::1] bounds = as_bounds(offsets)
+        Py_ssize_t n = bounds.shape[0] - 1
+        int64_t[::1] start_view, stop_view
+        unsigned char[256] table
+        int64_t i, start, stop
+        const unsigned char* s
+    make_table(bases, table)
+    starts = np.zeros(n, dtype=np.int64)
+    stops = np.empty(n, dtype=np.int64)
+    start_view = starts
+    stop_view = stops
+    with nogil:
+        for i in range(n):
+            s = &data[bounds[i]] if bounds[i + 1] > bounds[i] else NULL
+            start = 0
+            stop = bounds[i + 1] - bounds[i]
+            if back:
+                while stop > 0 and table[s[stop - 1]]:
+                    stop -= 1
+            if front:
+                while start < stop and table[s[start]]:
+                    start += 1
+            start_view[i] = start
+            stop_view[i] = stop
+    return starts, stops
+
+# Batch-level helpers
+
+def _check_qualities(batch):
+    if batch.qualities is None:
+        raise ValueError("Batch has no qualities")
+
+def mean_quality(batch, int base=33) -> np.ndarray:
+    """The mean phred score of each record of a batch.
+    """
+    _check_qualities(batch)
+    return mean_qualities(batch.qualities, batch.offsets, base)
+
+def min_quality(batch, int base=33) -> np.ndarray:
+    """The minimum phred score of each record of a batch.
+    """
+    _check_qualities(batch)
+    return min_qualities(batch.qualities, batch.offsets, base)
+
+def quality_trim(batch, int cutoff_back, int cutoff_front=0, int base=33):
+    """BWA-style quality trimming windows (see :func:`quality_trim_windows`)
+    of the records of a batch.
+    """
+    _check_qualities(batch)
+    return quality_trim_windows(
+        batch.qualities, batch.offsets, cutoff_back, cutoff_front, base)
+
+def n_content(batch) -> np.ndarray:
+    """The fraction of N bases in each record of a batch (0 for empty
+    records).
+    """
+    counts = count_bases(batch.sequences, batch.offsets)
+    lengths = batch.lengths
+    return np.divide(
+        counts, lengths, out=np.zeros(len(counts), dtype=np.float32),
+        where=lengths > 0)
+
+def end_trim(batch, bytes bases=b'Nn', bint front=True, bint back=True):
+    """Windows that remove leading/trailing runs of `bases` (see
+    :func:`end_trim_windows`) from the records of a batch.
+    """
+    return end_trim_windows(batch.sequences, batch.offsets, bases, front, back)
+
+def length_mask(batch, int min_length=0, max_length=None) -> np.ndarray:
+    """A mask of the records whose length is in [min_length, max_length].
+    """
+    lengths = batch.lengths
+    mask = lengths >= min_length
+    if max_length is not None:
+        mask &= lengths <= max_length
+    return mask
+
+def filter_pairs(batch1, batch2, mask1, mask2=None, bint both=True):
+    """Filters aligned paired-end batches with per-mate masks, keeping the
+    mates in sync.
+
+    Args:
+        batch1, batch2: The aligned batches.
+        mask1, mask2: Boolean masks for each batch. If `mask2` is None,
+            `mask1` applies to both.
+        both: Whether a pair is kept only if both mates pass (otherwise, if
+            either passes).
+
+    Returns:
+        A tuple of the filtered batches.
+    """
+    if mask2 is not None:
+        mask1 = (mask1 & mask2) if both else (mask1 | mask2)
+    return batch1.filter(mask1), batch2.filter(mask1)
@@ -1,3 +1,45 @@
+# -*- coding: utf-8 -*-
+"""Reading unaligned reads from SAM/BAM/CRAM files (requires pysam), and
+writing unmapped BAM files.
+
+BAM output does not go through pysam: records are encoded directly, in
+whole batches, and compressed by a
+:class:`seqio.compression.BlockCompressedWriter`.
+"""
+from itertools import compress
+import struct
+import numpy as np
+from seqio._utils import reverse_complement
+from seqio.batch import RecordBatch, lengths_to_offsets
+from seqio.format import SequenceFormat
+from seqio.formatters import format_bam_batch, format_bam_record
+from seqio.io import (
+    DEFAULT_BATCH_SIZE, FormatError, FormatSeqIO, SingleReader, PairedReader,
+    SequenceWriter)
+from seqio.utils import OptionalDependency
+
+# SAM flags
+PAIRED = 0x1
+UNMAPPED = 0x4
+MATE_UNMAPPED = 0x8
+REVERSE = 0x10
+READ1 = 0x40
+READ2 = 0x80
+SECONDARY = 0x100
+SUPPLEMENTARY = 0x800
+
+SKIP_FLAGS = SECONDARY | SUPPLEMENTARY
+"""Records with any of these flags are not reads in their own right."""
+
+PAIRED_READ1 = PAIRED | UNMAPPED | MATE_UNMAPPED | READ1
+PAIRED_READ2 = PAIRED | UNMAPPED | MATE_UNMAPPED | READ2
+
+DEFAULT_HEADER = '@HD\tVN:1.6\tSO:unsorted\tGO:query\n'
+"""Header of unmapped BAM files, whose records are grouped by name."""
+
+PHRED_TO_ASCII = bytes(min(i + 33, 255) for i in range(256))
+"""Translation table from phred scores to phred+33 ascii."""
+
 class Sam(SequenceFormat):
     """SAM/BAM/CRAM format files. Paired-end files must be name-sorted. Does not
     support secondary/supplementary reads.
@@ -5,25 +47,37 @@ class Sam(SequenceFormat):
     name = 'sam'
     aliases = ('bam', 'cram')
     delivers_qualities = True
-    lib = OptionalDependency('pysam')
-    
-    def open(path, mode, **kwargs):
-        return self.lib.AlignmentFile(path, mode, **kwargs)
-    
+    lib = OptionalDependency('pysam', 'sam')
+
+    def open(self, path, mode, threads: int = 1, **kwargs):
+        """Opens a file with `pysam.AlignmentFile`.
+
+        Args:
+            path: The file.
+            mode: The pysam mode; 'r' detects SAM/BAM/CRAM when reading.
+            threads: The number of htslib (de)compression threads.
+            kwargs: Additional arguments to `pysam.AlignmentFile`.
+        """
+        if 'r' in mode:
+            # unaligned files have no @SQ lines
+            kwargs.setdefault('check_sq', False)
+        return self.lib.AlignmentFile(path, mode, threads=threads, **kwargs)
+
     def read_record(self, fileobj):
         for record in fileobj:
-            if record.is_secondary or record.is_supplementary:
-                continue
-            return self._create_record(record)
-    
+            if not record.flag & SKIP_FLAGS:
+                return self._create_record(record)
+        raise StopIteration()
+
     def read_pair(self, fileobj):
         read1 = read2 = None
         for record in fileobj:
-            if record.is_secondary or record.is_supplementary:
+            flag = record.flag
+            if flag & SKIP_FLAGS:
                 continue
-            elif record.is_read1 and not read1:
+            elif flag & READ1 and not read1:
                 read1 = self._create_record(record)
-            elif record.is_read2 and not read2:
+            elif flag & READ2 and not read2:
                 read2 = self._create_record(record)
             else:
                 raise FormatError(
@@ -31,31 +85,288 @@ class Sam(SequenceFormat):
                     "{}".format((read1 or read2).name))
             if read1 and read2:
                 break
+        else:
+            if read1 is None and read2 is None:
+                raise StopIteration()
+            raise FormatError("Read {} has no mate".format(
+                (read1 or read2).name))
         if read1.name != read2.name:
             raise FormatError(
                 "Consecutive reads {}, {} in paired-end SAM/BAM file do "
-                "not have the same name; make sure your file is name-sorted.",
-                reads[0].name, reads[1].name)
+                "not have the same name; make sure your file is "
+                "name-sorted.".format(read1.name, read2.name))
         return (read1, read2)
-    
+
+    def iter_records(self, fileobj):
+        for record in fileobj:
+            if not record.flag & SKIP_FLAGS:
+                yield self._create_record(record)
+
+    def iter_pairs(self, fileobj):
+        while True:
+            try:
+                pair = self.read_pair(fileobj)
+            except StopIteration:
+                return
+            yield pair
+
     def _create_record(self, record):
+        sequence = (record.query_sequence or '').encode()
+        qualities = record.query_qualities
+        if qualities is not None:
+            qualities = bytes(qualities).translate(PHRED_TO_ASCII)
+        if record.flag & REVERSE:
+            # restore the orientation in which the read was sequenced
+            sequence = reverse_complement(sequence)
+            if qualities is not None:
+                qualities = qualities[::-1]
         return self.sequence_class(
-            name=record.query_name,
-            sequence=record.query_sequence,
-            qualities=''.join(chr(33 + q) for q in record.query_qualities))
-    
-    def format_record(self, record):
-        record = self.lib.AlignedSegment()
-        record.query_name = record.name
-        record.query_sequence = record.get_full_sequence_str()
-        record.flag = 4 # unmapped
-        record.query_qualities = pysam.qualitystring_to_array(
-            record.get_quality_str())
-        return record
-    
+            name=record.query_name.encode(),
+            sequence=sequence,
+            qualities=qualities)
+
+    def _read_batch(self, fileobj, size):
+        """Reads up to `size` primary records into parallel lists of names,
+        sequences, qualities and flags. Fields are kept as str (and arrays of
+        phred scores) until the whole batch is encoded at once.
+        """
+        names = []
+        sequences = []
+        qualities = []
+        flags = []
+        for record in fileobj:
+            flag = record.flag
+            if flag & SKIP_FLAGS:
+                continue
+            sequence = record.query_sequence or ''
+            quals = record.query_qualities
+            if flag & REVERSE:
+                sequence = reverse_complement(sequence.encode()).decode()
+                if quals is not None:
+                    quals = quals[::-1]
+            names.append(record.query_name)
+            sequences.append(sequence)
+            qualities.append(quals)
+            flags.append(flag)
+            if len(names) == size:
+                break
+        return names, sequences, qualities, flags
+
+    def _create_batch(self, names, sequences, qualities) -> RecordBatch:
+        # SAM names, sequences and qualities are ASCII, so str lengths are
+        # byte lengths
+        if qualities.count(None) == len(qualities):
+            quals = None
+        elif None in qualities:
+            raise FormatError(
+                "Batch contains records both with and without qualities")
+        else:
+            quals = np.frombuffer(
+                b''.join(qualities).translate(PHRED_TO_ASCII), dtype=np.uint8)
+        return RecordBatch(
+            np.frombuffer(''.join(names).encode(), dtype=np.uint8),
+            lengths_to_offsets([len(name) for name in names]),
+            np.frombuffer(''.join(sequences).encode(), dtype=np.uint8),
+            lengths_to_offsets([len(seq) for seq in sequences]),
+            quals, self.sequence_class)
+
+    def iter_batches(self, fileobj, size):
+        """Iterate over primary records in columnar batches, without creating
+        per-record objects.
+
+        Args:
+            fileobj: A `pysam.AlignmentFile`.
+            size: The number of records per batch.
+        """
+        while True:
+            names, sequences, qualities, _ = self._read_batch(fileobj, size)
+            if not names:
+                return
+            yield self._create_batch(names, sequences, qualities)
+
+    def iter_batch_pairs(self, fileobj, size):
+        """Iterate over pairs of consecutive primary records in aligned
+        columnar batches. Within a pair, the record flagged as read1 goes to
+        the first batch.
+
+        Yields:
+            Tuples (batch1, batch2) of :class:`seqio.batch.RecordBatch`.
+        """
+        while True:
+            names, sequences, qualities, flags = self._read_batch(
+                fileobj, 2 * size)
+            if not names:
+                return
+            is_read1 = [bool(flag & READ1) for flag in flags]
+            is_read2 = [not value for value in is_read1]
+            batch1, batch2 = (
+                self._create_batch(*(
+                    list(compress(column, mask))
+                    for column in (names, sequences, qualities)))
+                for mask in (is_read1, is_read2))
+            if len(batch1) != len(batch2) or not batch1.names_equal(batch2):
+                raise FormatError(
+                    "Paired-end SAM/BAM records are not in read1/read2 "
+                    "pairs; make sure your file is name-sorted.")
+            yield (batch1, batch2)
+
+    def format_record(self, record, flag: int = UNMAPPED) -> bytes:
+        """Formats a record as an (uncompressed) unmapped BAM record.
+        """
+        return format_bam_record(
+            record.name, record.sequence, record.qualities, flag)
+
     def format_pair(self, read1, read2):
-        record1 = self.format_record(read1)
-        record1.flag = 77 # paired, unmapped, mate unmapped, first
-        record2 = self.format_record(read2)
-        record2.flag = 141 # paired, unmapped, mate unmapped, second
-        return (record1, record2)
+        return (
+            self.format_record(read1, PAIRED_READ1),
+            self.format_record(read2, PAIRED_READ2))
+
+    def format_batch(self, records, flags=UNMAPPED) -> bytes:
+        """Formats many records as unmapped BAM records.
+
+        Args:
+            records: A :class:`seqio.batch.RecordBatch` or an iterable of
+                records.
+            flags: The SAM flag of every record, or one flag per record.
+        """
+        if not isinstance(records, RecordBatch):
+            records = RecordBatch.from_records(
+                list(records), self.sequence_class)
+        return format_bam_batch(records, flags)
+
+class SamReader(FormatSeqIO, SingleReader):
+    """Reader for the primary records of a SAM/BAM/CRAM file. Reads on the
+    reverse strand are reverse-complemented, as by `samtools fastq`.
+
+    Args:
+        path: The file.
+        file_format: An instance of :class:`Sam`.
+        mode: The pysam open mode.
+        threads: The number of htslib decompression threads.
+        kwargs: Additional arguments to `pysam.AlignmentFile`.
+    """
+    def __init__(self, path, file_format: Sam = None, mode: str = 'r',
+                 threads: int = 1, **kwargs):
+        super(SamReader, self).__init__(file_format or Sam())
+        self.name = str(path)
+        self.reader = self.file_format.open(path, mode, threads, **kwargs)
+        # pysam will not iterate directly over a SAM file without @SQ lines
+        self.alignments = self.reader.fetch(until_eof=True)
+        self.records = self._iter_records()
+
+    def _iter_records(self):
+        return self.file_format.iter_records(self.alignments)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.records)
+
+    def iter_batches(self, size: int = DEFAULT_BATCH_SIZE):
+        """Iterate over records in columnar batches.
+
+        Yields:
+            :class:`seqio.batch.RecordBatch` objects.
+        """
+        return self.file_format.iter_batches(self.alignments, size)
+
+    def close(self):
+        self.reader.close()
+
+class PairedSamReader(SamReader, PairedReader):
+    """Reader for paired-end reads in a name-sorted SAM/BAM/CRAM file, such as
+    an unmapped BAM. Iteration yields (read1, read2) tuples.
+    """
+    paired = True
+
+    def _iter_records(self):
+        return self.file_format.iter_pairs(self.alignments)
+
+    def iter_batches(self, size: int = DEFAULT_BATCH_SIZE):
+        """Iterate over pairs in aligned columnar batches.
+
+        Yields:
+            Tuples (batch1, batch2) of :class:`seqio.batch.RecordBatch`.
+        """
+        return self.file_format.iter_batch_pairs(self.alignments, size)
+
+def bam_header(text: str = DEFAULT_HEADER) -> bytes:
+    """Encodes the header of a BAM file with no reference sequences.
+    """
+    data = text.encode()
+    return b'BAM\x01' + struct.pack('<i', len(data)) + data + struct.pack(
+        '<i', 0)
+
+class BamWriter(SequenceWriter):
+    """Writes reads to an unmapped BAM file. Records are encoded directly
+    (a whole batch at a time by `write_batch`) and BGZF-compressed across a
+    pool of threads.
+
+    Args:
+        path: The file.
+        file_format: An instance of :class:`Sam`.
+        header: The SAM header text.
+        threads: The number of compression threads. Defaults to the number of
+            CPUs.
+        kwargs: Additional arguments to :class:`seqio.io.SequenceWriter`
+            (e.g. `buffer_size` and `level`).
+    """
+    def __init__(self, path, file_format: Sam = None,
+                 header: str = DEFAULT_HEADER, threads: int = None,
+                 **kwargs):
+        super(BamWriter, self).__init__(
+            path, file_format or Sam(), compression='bgzf', threads=threads,
+            **kwargs)
+        self.buffer += bam_header(header)
+
+class PairedBamWriter(BamWriter):
+    """Writes paired-end reads to an unmapped BAM file, each read1 followed
+    by its read2.
+    """
+    paired = True
+
+    def write(self, read1, read2):
+        self.buffer += self.file_format.format_record(read1, PAIRED_READ1)
+        self.buffer += self.file_format.format_record(read2, PAIRED_READ2)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def write_batch(self, batch1, batch2):
+        """Write aligned batches of mates (:class:`seqio.batch.RecordBatch`
+        objects or sequences of records).
+        """
+        batch1, batch2 = (
+            batch if isinstance(batch, RecordBatch)
+            else RecordBatch.from_records(
+                list(batch), self.file_format.sequence_class)
+            for batch in (batch1, batch2))
+        flags = np.tile(
+            np.array((PAIRED_READ1, PAIRED_READ2), dtype=np.uint16),
+            len(batch1))
+        self._write_formatted(self.file_format.format_batch(
+            RecordBatch.interleave(batch1, batch2), flags))
+
+def open(path, mode: str = 'r', paired: bool = False, threads: int = 1,
+         format_args: dict = None, io_args: dict = None) -> FormatSeqIO:
+    """Open a SAM/BAM/CRAM file for reading, or an unmapped BAM file for
+    writing.
+
+    Args:
+        path: The file.
+        mode: The pysam open mode when reading; 'wb' to write BAM.
+        paired: Whether the file holds name-sorted paired-end reads.
+        threads: The number of htslib decompression threads when reading, or
+            BGZF compression threads when writing.
+        format_args: Additional arguments to the :class:`Sam` constructor.
+        io_args: Additional arguments to `pysam.AlignmentFile` when reading,
+            or to :class:`BamWriter` when writing.
+    """
+    file_format = Sam(**(format_args or {}))
+    if 'w' in mode:
+        if mode != 'wb':
+            raise ValueError("Only BAM output (mode 'wb') is supported")
+        klass = PairedBamWriter if paired else BamWriter
+        return klass(path, file_format, threads=threads, **(io_args or {}))
+    klass = PairedSamReader if paired else SamReader
+    return klass(path, file_format, mode, threads, **(io_args or {}))
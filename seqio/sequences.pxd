@@ -0,0 +1,24 @@
+# cython: language_level=3
+"""Declarations of sequence classes, for use by other Cython modules.
+"""
+
+cdef class DecodeCache(object):
+    cdef:
+        str name_str
+        str sequence_str
+        str qualities_str
+        object qualities_int
+        int qualities_base
+
+cdef class Sequence(object):
+    cdef:
+        public bytes name
+        public bytes sequence
+        public bytes qualities
+        public int length
+        DecodeCache _cache
+    
+    cdef DecodeCache _get_cache(self)
+
+cdef class ColorspaceSequence(Sequence):
+    cdef public bytes primer
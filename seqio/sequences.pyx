@@ -12,7 +12,12 @@
 # TODO: add sequence classes that inherit from scikit-bio and biopython
 # sequence classes
 
-from libcpp.vector cimport vector
+from libc.stdint cimport int32_t, uint16_t
+from libc.stdlib cimport free, realloc
+
+import sys
+from seqio._utils import get_quality_conversion, reverse_complement
+from seqio.io import FormatError
 
 # Misc
 
@@ -29,21 +34,27 @@ def decode_bytes(bytes b, **kwargs):
     return b.decode(**kwargs)
 
 def bytes_to_qualities(bytes qualities, base=33):
-    return list(q - base for q in qualities)
+    return get_quality_conversion(base).to_phred(qualities)
 
 # Sequence classes
 
+cdef class DecodeCache(object):
+    """Decoded values of a record. Allocated on first use, so that records
+    that are never decoded only pay for one (empty) reference.
+    """
+    def __sizeof__(self):
+        size = object.__sizeof__(self)
+        for value in (
+                self.name_str, self.sequence_str, self.qualities_str,
+                self.qualities_int):
+            if value is not None:
+                size += sys.getsizeof(value)
+        return size
+
 cdef class Sequence(object):
     """A sequence record has a name and sequence, and optionally base qualities
     and an alternate name. Qualities are encoded as ascii(qual+33) by default.
     """
-    cdef:
-        public bytes name
-        public bytes sequence
-        public bytes qualities
-        public int length
-        dict _cached_values
-    
     def __init__(self, bytes name, bytes sequence, bytes qualities=None):
         self.name = name
         self._update_sequence(sequence, qualities)
@@ -56,16 +67,28 @@ cdef class Sequence(object):
                     truncate(self.name), len(self.qualities), self.length))
         self.sequence = sequence
         self.qualities = qualities
+        self._cache = None
+    
+    cdef DecodeCache _get_cache(self):
+        if self._cache is None:
+            self._cache = DecodeCache.__new__(DecodeCache)
+        return self._cache
     
     def get_name_str(self, **kwargs):
         """Returns the name as a string.
         """
-        return self._get_cached('_name_str', 'name', **kwargs)
+        cdef DecodeCache cache = self._get_cache()
+        if cache.name_str is None:
+            cache.name_str = self.name.decode(**kwargs)
+        return cache.name_str
     
     def get_sequence_str(self, **kwargs):
         """Returns the sequence as a string.
         """
-        return self._get_cached('_sequence_str', 'sequence', **kwargs)
+        cdef DecodeCache cache = self._get_cache()
+        if cache.sequence_str is None:
+            cache.sequence_str = self.sequence.decode(**kwargs)
+        return cache.sequence_str
     
     @property
     def full_sequence(self):
@@ -78,7 +101,7 @@ cdef class Sequence(object):
         """Returns the full sequence for output (e.g. including colorspace
         primer).
         """
-        return self.sequence_str(**kwargs)
+        return self.get_sequence_str(**kwargs)
     
     @property
     def has_qualities(self):
@@ -89,23 +112,28 @@ cdef class Sequence(object):
     def get_qualities_str(self, **kwargs):
         """Returns qualities as a phred-encoded string.
         """
-        return self._get_cached('_qualities_str', 'qualities', **kwargs)
+        cdef DecodeCache cache = self._get_cache()
+        if cache.qualities_str is None:
+            cache.qualities_str = self.qualities.decode(**kwargs)
+        return cache.qualities_str
     
     def get_qualities_int(self, int base=33):
-        """Returns qualities as a list of integers."""
-        return self._get_cached(
-            '_qualities_int', 'qualities', fn=bytes_to_qualities, base=base)
+        """Returns qualities as a NumPy uint8 array of phred scores."""
+        cdef DecodeCache cache = self._get_cache()
+        if cache.qualities_int is None or cache.qualities_base != base:
+            cache.qualities_int = bytes_to_qualities(self.qualities, base)
+            cache.qualities_base = base
+        return cache.qualities_int
     
-    def _get_cached(self, name, var, fn=decode_bytes, **kwargs):
-        if name not in _cached_values:
-            if callable(var):
-                val = var(self)
-            else:
-                val = getattr(self, var)
-            if fn:
-                val = fn(val, **kwargs)
-            _cached_values[name] = val
-        return _cached_values[name]
+    def __sizeof__(self):
+        """The memory used by the record, including its fields and any
+        decoded values.
+        """
+        size = object.__sizeof__(self)
+        for field in (self.name, self.sequence, self.qualities, self._cache):
+            if field is not None:
+                size += sys.getsizeof(field)
+        return size
     
     def __getitem__(self, key):
         """Returns a new Sequence instance with the same name(s) but with the
@@ -116,11 +144,20 @@ cdef class Sequence(object):
             self.sequence[key],
             self.qualities[key] if self.has_qualities else None)
 
+    def reverse_complement(self):
+        """Returns a new Sequence instance with the same name, the reverse
+        complement of the sequence, and the reversed qualities.
+        """
+        return self.__class__(
+            self.name,
+            reverse_complement(self.sequence),
+            self.qualities[::-1] if self.has_qualities else None)
+
     def __repr__(self):
-        rep = b'<Sequence(name={name!r}, sequence={seq!r}'
+        rep = '<Sequence(name={name!r}, sequence={seq!r}'
         if self.has_qualities:
-            rep += b', qualities={qual!r}'
-        return (rep + b')>').format(
+            rep += ', qualities={qual!r}'
+        return (rep + ')>').format(
             name=self.name, seq=self.sequence, qual=self.qualities)
 
     def __len__(self):
@@ -144,166 +181,405 @@ cdef class Sequence(object):
         return (Sequence, (
             self.name, self.sequence, self.qualities))
 
+def split_primer(bytes name, bytes sequence, bytes primer=None):
+    """Splits the primer base from a colorspace sequence, unless it is given.
+
+    Returns:
+        A tuple (primer, sequence).
+    """
+    if primer is None:
+        if len(sequence) == 0:
+            raise FormatError(
+                "Primer must be specified or sequence cannot be empty")
+        primer = sequence[:1]
+        sequence = sequence[1:]
+    
+    if not primer in (b'A', b'C', b'G', b'T'):
+        raise FormatError("Primer base is {0!r} in read {1!r}, but it "
+            "should be one of A, C, G, T.".format(
+            primer, truncate(name)))
+    return (primer, sequence)
+
 cdef class ColorspaceSequence(Sequence):
     """In colorspace, the first character is the last nucleotide of the primer
     base and the second character encodes the transition from the primer base to
     the first real base of the read.
     """
-    cdef public bytes primer
-    
     def __init__(self, bytes name, bytes sequence, bytes qualities=None,
                  bytes primer=None):
-        if primer is None:
-            if len(sequence) == 0:
-                raise FormatError(
-                    "Primer must be specified or sequence cannot be empty")
-            primer = sequence[0]
-            sequence = sequence[1:]
-        
-        if not primer in (b'A', b'C', b'G', b'T'):
-            raise FormatError("Primer base is {0!r} in read {1!r}, but it "
-                "should be one of A, C, G, T.".format(
-                primer, truncate(name)))
-        
-        super(Colorspace, self).__init__(name, sequence, qualities)
+        primer, sequence = split_primer(name, sequence, primer)
+        super(ColorspaceSequence, self).__init__(name, sequence, qualities)
         self.primer = primer
     
     @property
     def full_sequence(self):
-        return self._get_cached(
-            '_full_sequence',
-            lambda record: record.primer + record.sequence,
-            fn=None, **kwargs)
+        return self.primer + self.sequence
     
     def get_full_sequence_str(self, **kwargs):
-        return self._get_cached(
-            '_full_sequence_str',
-            lambda record: record.primer + record.sequence,
-            **kwargs)
+        return self.full_sequence.decode(**kwargs)
     
     def __repr__(self):
-        rep = b'<ColorspaceSequence('
-            'name={name!r}, primer={primer!r}, sequence={seq!r}'
+        rep = ('<ColorspaceSequence('
+            'name={name!r}, primer={primer!r}, sequence={seq!r}')
         if self.has_qualities:
-            rep += b', qualities={qual!r}'
-        return (rep + b')>').format(
+            rep += ', qualities={qual!r}'
+        return (rep + ')>').format(
             name=self.name, primer=self.primer, seq=self.sequence,
             qual=self.qualities)
 
 cdef bytes EMPTY = b''
 
-ctypedef struct Edit:
-    int start
-    int stop
-    bytes bases
-    bytes quals
-    int size_change
-    str description
-
-cdef class Mutable(object):
-    """Sequence mixin that adds edit operations and replaces the __getitem__
-    method, such that the sequence and qualities are updated in-place. Edits are
-    logged in the 'edits' list, which enables the original sequence to be
-    reconstructed.
+# Mutable sequences
+
+ctypedef struct EditRecord:
+    # the replaced region, relative to the sequence before the edit
+    int32_t start
+    int32_t stop
+    int32_t size_change
+    # the offset of the replaced bases in the buffer that held them
+    int32_t offset
+    # the index of that buffer in the record's history
+    uint16_t buffer
+    # the index of the description in DESCRIPTIONS
+    uint16_t description
+
+DESCRIPTIONS = ['']
+"""Edit descriptions, stored once and referred to by index."""
+
+cdef dict DESCRIPTION_INDEX = {'': 0}
+
+cdef uint16_t description_index(str description) except? 0:
+    index = DESCRIPTION_INDEX.get(description)
+    if index is None:
+        if len(DESCRIPTIONS) > 65535:
+            raise ValueError("Too many distinct edit descriptions")
+        index = DESCRIPTION_INDEX[description] = len(DESCRIPTIONS)
+        DESCRIPTIONS.append(description)
+    return index
+
+cdef class Edit(object):
+    """An edit of a :class:`MutableSequence`: the bases (and qualities)
+    between `start` (inclusive) and `stop` (exclusive) of the sequence as it
+    was before the edit were replaced, changing its length by `size_change`.
+    `bases` and `quals` are the replaced bases and qualities.
     """
-    cdef public vector[Edit] edits
-    
+    cdef readonly:
+        int start
+        int stop
+        int size_change
+        bytes bases
+        bytes quals
+        str description
+
+    def __repr__(self):
+        return "<Edit(start={0}, stop={1}, size_change={2}, {3!r})>".format(
+            self.start, self.stop, self.size_change, self.description)
+
+cdef class MutableSequence(object):
+    """A sequence record whose sequence and qualities are edited in place.
+
+    The record keeps the buffers it was created with plus start and stop
+    offsets into them, so trimming either end only moves an offset. Edits
+    inside the sequence (and the first access to `sequence` or `qualities`
+    after trimming) build new buffers. Each edit is logged as a compact C
+    struct that refers to the buffer holding the replaced bases; replaced
+    buffers are kept, so the edits and the original record can always be
+    recovered.
+    """
+    cdef:
+        public bytes name
+        bytes _sequence
+        bytes _qualities
+        Py_ssize_t _start
+        Py_ssize_t _stop
+        # buffers (sequence, qualities) replaced by edits, oldest first
+        list _history
+        EditRecord* _edits
+        Py_ssize_t _num_edits
+        Py_ssize_t _edits_capacity
+
+    def __init__(self, bytes name, bytes sequence, bytes qualities=None):
+        if qualities is not None and len(qualities) != len(sequence):
+            raise FormatError("In read named {0!r}: length of quality sequence "
+                "({1}) and length of read ({2}) do not match".format(
+                    truncate(name), len(qualities), len(sequence)))
+        self.name = name
+        self._sequence = sequence
+        self._qualities = qualities
+        self._start = 0
+        self._stop = len(sequence)
+
+    def __dealloc__(self):
+        free(self._edits)
+
+    cdef void _materialize(self) except *:
+        # replaces the buffers with the current (trimmed) region
+        if self._start == 0 and self._stop == len(self._sequence):
+            return
+        self._push_buffers()
+        self._sequence = self._sequence[self._start:self._stop]
+        if self._qualities is not None:
+            self._qualities = self._qualities[self._start:self._stop]
+        self._stop -= self._start
+        self._start = 0
+
+    cdef void _push_buffers(self) except *:
+        if self._history is None:
+            self._history = []
+        self._history.append((self._sequence, self._qualities))
+
+    cdef void _log(self, EditRecord edit) except *:
+        cdef EditRecord* edits
+        if self._num_edits == self._edits_capacity:
+            capacity = max(4, 2 * self._edits_capacity)
+            edits = <EditRecord*>realloc(
+                self._edits, capacity * sizeof(EditRecord))
+            if edits == NULL:
+                raise MemoryError()
+            self._edits = edits
+            self._edits_capacity = capacity
+        self._edits[self._num_edits] = edit
+        self._num_edits += 1
+
+    @property
+    def sequence(self):
+        self._materialize()
+        return self._sequence
+
+    @property
+    def qualities(self):
+        self._materialize()
+        return self._qualities
+
+    @property
+    def length(self):
+        return self._stop - self._start
+
+    @property
+    def has_qualities(self):
+        return self._qualities is not None
+
+    @property
+    def full_sequence(self):
+        return self.sequence
+
+    def get_name_str(self, **kwargs):
+        return self.name.decode(**kwargs)
+
+    def get_sequence_str(self, **kwargs):
+        return self.sequence.decode(**kwargs)
+
+    def get_full_sequence_str(self, **kwargs):
+        return self.full_sequence.decode(**kwargs)
+
+    def get_qualities_str(self, **kwargs):
+        return self.qualities.decode(**kwargs)
+
+    def get_qualities_int(self, int base=33):
+        """Returns qualities as a NumPy uint8 array of phred scores."""
+        return bytes_to_qualities(self.qualities, base)
+
     def edit(self, int start=0, int stop=-1, bytes bases=EMPTY,
              bytes qualities=EMPTY, str description=''):
         """Modify the current sequence and qualities. The current bases/
-        qualities between start (inclusive) and stop (exclusive) are replaced by
-        `bases`, and a new Edit operation is generated, added to `edits`, and
-        returned.
+        qualities between start (inclusive) and stop (exclusive) are replaced
+        by `bases`/`qualities`, and the edit is logged. Deleting from either
+        end does not copy any data.
         """
         cdef:
-            int cur_size = len(self)
-            bytes new_sequence = None
-            bytes new_qualities = None
-            Edit e
-        
+            Py_ssize_t cur_size = self._stop - self._start
+            EditRecord edit
+
         if stop < 0:
             stop = cur_size
-        elif stop > cur_size:
+        if start < 0 or start > stop or stop > cur_size:
             raise ValueError(
-                "Sequence is shorter than edit region {} < {}".format(
-                stop, cur_size))
-        
-        e = Edit()
-        e.start = start
-        e.stop = stop
-        e.size_change = len(new_bases) - (stop - start)
-        e.description = description
-        e.bases = self.sequence[start:stop]
-        new_sequence = self.sequence[:start] + bases + self.sequence[stop:]
-        if self.has_qualities:
-            e.quals = self.qualities[start:stop]
-            new_qualities = self.qualities[:start] + bases + self.qualities[stop:]
-        self._update_sequence(new_sequence, new_qualities)
-        self.edits.push_back(edit)
-        return edit
-        
-        # This code might make things slightly faster, at the cost
-        # of additional complexity:
-        # if start < 0 and stop < 0:
-        #     start = 0
-        #     stop = cur_size
-        #     e.bases = self.sequence
-        #     self.sequence = new_bases
-        #     if self.has_qualities:
-        #         e.quals = self.qualities
-        #         self.qualities = new_qualities
-        # elif start < 0:
-        #     start = 0
-        #     e.bases = self.sequence[:stop]
-        #     self.sequence = bases + self.sequence[stop:]
-        #     if self.has_qualities:
-        #         e.quals = self.qualities[:stop]
-        #         self.qualities = qualities + self.qualities[stop:]
-        # elif stop < 0:
-        #     stop = cur_size
-        #     e.bases = self.sequence[start:]
-        #     self.sequence = self.sequence[:start] + bases
-        #     if self.has_qualities:
-        #         e.quals = self.qualities[start:]
-        #         self.qualities = self.sequence[:start] + qualities
-        # else:
-    
+                "Invalid edit region {0}-{1} of sequence of length {2}".format(
+                    start, stop, cur_size))
+        if self._qualities is not None and len(qualities) != len(bases):
+            raise ValueError(
+                "Length of qualities ({0}) and bases ({1}) do not match".format(
+                    len(qualities), len(bases)))
+
+        edit.start = start
+        edit.stop = stop
+        edit.size_change = len(bases) - (stop - start)
+        edit.offset = self._start + start
+        edit.buffer = 0 if self._history is None else len(self._history)
+        edit.description = description_index(description)
+        self._log(edit)
+
+        if not bases and start == 0:
+            self._start += stop
+        elif not bases and stop == cur_size:
+            self._stop = self._start + start
+        else:
+            self._push_buffers()
+            self._sequence = (
+                self._sequence[self._start:self._start + start] + bases +
+                self._sequence[self._start + stop:self._stop])
+            if self._qualities is not None:
+                self._qualities = (
+                    self._qualities[self._start:self._start + start] +
+                    qualities +
+                    self._qualities[self._start + stop:self._stop])
+            self._start = 0
+            self._stop = len(self._sequence)
+
     def insert(self, int pos, bytes bases, bytes qualities=EMPTY,
                str description=''):
         """Convenience method to insert a sequence directly *before* `pos`.
         """
-        return self.edit(pos, pos, bases, qualities, description)
-    
+        self.edit(pos, pos, bases, qualities, description)
+
     def delete(self, int start=0, int stop=-1, str description=''):
         """Convenience method to delete the sequence between `start` (inclusive)
         and `stop` (exclusive).
         """
-        return self.edit(start, stop, description=description)
-    
+        self.edit(start, stop, description=description)
+
+    def reverse_complement_inplace(
+            self, str description='reverse complement'):
+        """Reverse-complements the sequence and reverses the qualities in
+        place, as a single edit of the whole sequence.
+        """
+        self.edit(
+            0, -1, reverse_complement(self.sequence),
+            self.qualities[::-1] if self.has_qualities else EMPTY,
+            description)
+
+    cdef tuple _get_buffers(self, Py_ssize_t index):
+        if self._history is not None and index < len(self._history):
+            return self._history[index]
+        return (self._sequence, self._qualities)
+
+    @property
+    def edits(self):
+        """The edits, oldest first, as a list of :class:`Edit` objects.
+        """
+        cdef:
+            EditRecord record
+            Edit edit
+            Py_ssize_t i
+        result = []
+        for i in range(self._num_edits):
+            record = self._edits[i]
+            sequence, qualities = self._get_buffers(record.buffer)
+            edit = Edit.__new__(Edit)
+            edit.start = record.start
+            edit.stop = record.stop
+            edit.size_change = record.size_change
+            edit.bases = sequence[
+                record.offset:record.offset + record.stop - record.start]
+            if qualities is not None:
+                edit.quals = qualities[
+                    record.offset:record.offset + record.stop - record.start]
+            edit.description = DESCRIPTIONS[record.description]
+            result.append(edit)
+        return result
+
+    @property
+    def num_edits(self):
+        return self._num_edits
+
+    def get_original(self):
+        """Returns the record as it was before any edits, as a new
+        :class:`Sequence`.
+        """
+        sequence, qualities = self._get_buffers(0)
+        return Sequence(self.name, sequence, qualities)
+
     def __getitem__(self, key):
-        """Generates up to two deletion events - one from the front of the read
-        (if `key.start` > 0) and one from the end of the read (if `key.stop` <
-        len(self)).
+        """Trims the sequence (and qualities) in place to the slice `key`,
+        logging up to two deletions: one from the end of the read (if
+        `key.stop` < len(self)) and one from the front (if `key.start` > 0).
+        Returns the record itself.
         """
-        if key.stop < len(self):
-            self.delete(start=key.stop)
-        if key.start > 0:
-            self.delete(stop=key.start)
+        start, stop, step = key.indices(len(self))
+        if step != 1:
+            raise ValueError("Mutable sequences can only be trimmed")
+        if stop < start:
+            stop = start
+        if stop < len(self):
+            self.delete(start=stop)
+        if start > 0:
+            self.delete(stop=start)
         return self
 
-cdef class MutableSequence(Sequence, Mutable):
-    """Inherits both Sequence and Mutable and adds no additional functionality.
-    """
-    pass
+    def reverse_complement(self):
+        """Returns a new record with the same name, the reverse complement of
+        the sequence, and the reversed qualities.
+        """
+        return self.__class__(
+            self.name,
+            reverse_complement(self.sequence),
+            self.qualities[::-1] if self.has_qualities else None)
+
+    def __len__(self):
+        return self._stop - self._start
 
-cdef class MutableColorspaceSequence(ColorspaceSequence, Mutable):
-    """Inherits both ColorspaceSequence and Mutable and adds no additional
-    functionality.
+    def __sizeof__(self):
+        """The memory used by the record, including its buffers, replaced
+        buffers and edit log.
+        """
+        size = (
+            object.__sizeof__(self) + sys.getsizeof(self.name) +
+            sys.getsizeof(self._sequence) +
+            self._edits_capacity * sizeof(EditRecord))
+        if self._qualities is not None:
+            size += sys.getsizeof(self._qualities)
+        if self._history is not None:
+            size += sys.getsizeof(self._history)
+            for buffers in self._history:
+                size += sum(
+                    sys.getsizeof(buf) for buf in buffers if buf is not None)
+        return size
+
+    def __richcmp__(self, other, int op):
+        """Implements == and !=.
+        """
+        if 2 <= op <= 3:
+            eq = (self.name == other.name and
+                self.sequence == other.sequence and
+                self.qualities == other.qualities)
+            if op == 2:
+                return eq
+            else:
+                return not eq
+        else:
+            raise NotImplementedError()
+
+    def __reduce__(self):
+        return (self.__class__, (
+            self.name, self.sequence, self.qualities))
+
+    def __repr__(self):
+        return "<{0}(name={1!r}, length={2}, edits={3})>".format(
+            self.__class__.__name__, self.name, len(self), self._num_edits)
+
+cdef class MutableColorspaceSequence(MutableSequence):
+    """A colorspace sequence (see :class:`ColorspaceSequence`) that is edited
+    in place.
     """
-    pass
+    cdef public bytes primer
+
+    def __init__(self, bytes name, bytes sequence, bytes qualities=None,
+                 bytes primer=None):
+        primer, sequence = split_primer(name, sequence, primer)
+        super(MutableColorspaceSequence, self).__init__(
+            name, sequence, qualities)
+        self.primer = primer
+
+    @property
+    def full_sequence(self):
+        return self.primer + self.sequence
+
+    def __reduce__(self):
+        return (MutableColorspaceSequence, (
+            self.name, self.sequence, self.qualities, self.primer))
 
-def sra_colorspace_sequence(str name, bytes sequence, bytes qualities=None,
-                            bool mutable=False):
+def sra_colorspace_sequence(bytes name, bytes sequence, bytes qualities=None,
+                            bint mutable=False):
     """
     Factory for an SRA colorspace sequence (which has one quality value too
     many).
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""Detection of the compression and record format of sequence files.
+
+A file is sniffed from a single read of its first `SNIFF_SIZE` bytes: the
+compression is identified from the magic number, and the record format (and,
+for FASTQ, whether mates are interleaved) from the first decompressed bytes.
+Results are cached per path and modification time, so a file that is opened
+repeatedly is only read once until it changes. The `CACHE_SIZE` most recently
+sniffed paths are kept.
+"""
+from collections import OrderedDict, namedtuple
+import io
+import os
+from pathlib import PurePath
+from threading import Lock
+from seqio.compression import decompress_prefix, guess_compression
+
+SNIFF_SIZE = 65536
+"""Number of bytes read from the start of a file to identify it."""
+
+CACHE_SIZE = 4096
+"""Maximum number of paths whose results are cached."""
+
+SniffResult = namedtuple(
+    'SniffResult', ('file_format', 'compression', 'interleaved'))
+"""What is known about a file: the format name ('fasta', 'fastq' or 'sam', or
+None if unknown), the compression (see
+:func:`seqio.compression.guess_compression`) and whether a FASTQ file holds
+interleaved mates."""
+
+SAM_HEADER_TAGS = (b'@HD\t', b'@SQ\t', b'@RG\t', b'@PG\t', b'@CO\t')
+
+SAM_FIELDS = 11
+
+EXTENSIONS = {
+    '.fa': 'fasta', '.fasta': 'fasta', '.fna': 'fasta', '.fas': 'fasta',
+    '.fq': 'fastq', '.fastq': 'fastq',
+    '.sam': 'sam', '.bam': 'sam', '.cram': 'sam',
+}
+"""File extensions of each format, used when a file cannot be read."""
+
+COMPRESSION_EXTENSIONS = ('.gz', '.bgz', '.bz2', '.xz', '.zst')
+
+_cache = OrderedDict()
+_cache_lock = Lock()
+
+def guess_format(data: bytes) -> str:
+    """Identifies a record format from the first (decompressed) bytes of a
+    file.
+
+    Returns:
+        'fasta', 'fastq' or 'sam', or None.
+    """
+    if data.startswith(b'BAM\x01') or data.startswith(b'CRAM'):
+        return 'sam'
+    data = data.lstrip()
+    if data.startswith(b'>'):
+        return 'fasta'
+    if data.startswith(b'@'):
+        if data.startswith(SAM_HEADER_TAGS):
+            return 'sam'
+        return 'fastq'
+    # a SAM file without a header
+    line = data.split(b'\n', 1)[0]
+    if line.count(b'\t') >= SAM_FIELDS - 1:
+        return 'sam'
+    return None
+
+def is_interleaved(data: bytes) -> bool:
+    """Whether the first two records of a FASTQ file are mates, i.e. have the
+    same header line (as required by the interleaved reader). Needs at least
+    two whole records.
+    """
+    lines = data.lstrip().split(b'\n', 8)
+    if len(lines) < 9 or not lines[0].startswith(b'@'):
+        return False
+    name1, name2 = (lines[i][1:].rstrip(b'\r') for i in (0, 4))
+    return bool(name1) and name1 == name2
+
+def sniff_bytes(prefix: bytes) -> SniffResult:
+    """Identifies a file from its first bytes.
+    """
+    compression = guess_compression(prefix)
+    data = decompress_prefix(prefix, compression) if compression else prefix
+    file_format = guess_format(data)
+    return SniffResult(
+        file_format, compression,
+        file_format == 'fastq' and is_interleaved(data))
+
+def sniff_file(path_or_file) -> SniffResult:
+    """Identifies a file, reading at most `SNIFF_SIZE` bytes.
+
+    Args:
+        path_or_file: A path, or a binary file-like object. A file object is
+            peeked rather than read if it supports `peek` (and is otherwise
+            read and rewound), and its results are not cached.
+    """
+    if not isinstance(path_or_file, (str, PurePath)):
+        fileobj = path_or_file
+        if hasattr(fileobj, 'peek'):
+            return sniff_bytes(fileobj.peek(SNIFF_SIZE)[:SNIFF_SIZE])
+        pos = fileobj.tell()
+        prefix = fileobj.read(SNIFF_SIZE)
+        fileobj.seek(pos)
+        return sniff_bytes(prefix)
+    path = os.fspath(path_or_file)
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    with _cache_lock:
+        cached = _cache.get(path)
+        if cached is not None and cached[0] == key:
+            _cache.move_to_end(path)
+            return cached[1]
+    with io.open(path, 'rb') as fileobj:
+        result = sniff_bytes(fileobj.read(SNIFF_SIZE))
+    with _cache_lock:
+        _cache[path] = (key, result)
+        _cache.move_to_end(path)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return result
+
+def clear_cache():
+    """Forgets all sniffed files.
+    """
+    with _cache_lock:
+        _cache.clear()
+
+def guess_format_from_name(path) -> str:
+    """Guesses a format from a file name, ignoring any compression extension.
+    Returns None if the extension is not known.
+    """
+    name = os.fspath(path).lower()
+    for extension in COMPRESSION_EXTENSIONS:
+        if name.endswith(extension):
+            name = name[:-len(extension)]
+            break
+    return EXTENSIONS.get(os.path.splitext(name)[1])
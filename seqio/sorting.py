@@ -0,0 +1,374 @@
+# -*- coding: utf-8 -*-
+"""External (bounded-memory) sorting of reads.
+
+:func:`sort` reads its input in batches and collects them into runs of about
+`memory / (3 * (threads + 1))` bytes, so that the run being read and the runs
+being sorted (each of which is copied once when it is reordered) fit in
+`memory`. Runs are sorted in a thread pool: computing keys, sorting them and
+gathering the records all run without the GIL. Each sorted run is spilled to
+a temporary file as zlib-compressed (by isal, if installed) blocks of columnar
+records. The runs are then merged, a block at a time, into the output writer;
+the keys of each block are recomputed when it is read back, in the same
+threads that decompress it.
+
+If the input fits in a single run, it is sorted in memory and nothing is
+spilled. If there are more runs than can be merged at once within `memory`,
+groups of runs are first merged into longer runs.
+
+Paired-end input is sorted by the key of read1, and the mates of each pair are
+moved together, so they stay aligned.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, count
+import os
+import pickle
+import re
+import struct
+from tempfile import TemporaryDirectory
+import numpy as np
+from seqio._utils import minimizers, pad_ranges
+from seqio.batch import RecordBatch
+
+try:
+    from isal import isal_zlib as _zlib
+except ImportError:
+    import zlib as _zlib
+
+KEYS = ('name', 'sequence', 'minimizer')
+"""Sort keys: the read name, the sequence, or the minimizer (see
+:func:`seqio._utils.minimizers`), which clusters overlapping reads so that
+they compress better."""
+
+DEFAULT_MEMORY = '4G'
+
+DEFAULT_MINIMIZER_K = 31
+
+MAX_PADDING = 4
+"""Name and sequence keys are compared as fixed-width NumPy byte strings
+unless padding them to the longest one in a run would take more than this
+many times their size, in which case they are compared as Python bytes."""
+
+SPILL_BLOCK_SIZE = 1 << 20
+"""Approximate number of bytes of records per block of a spilled run. Merging
+holds about two blocks per run in memory."""
+
+SPILL_LEVEL = 1
+
+SIZE_UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+def parse_memory(memory) -> int:
+    """Converts a number of bytes, or a string such as '512M' or '4G' (units
+    are powers of 1024), to a number of bytes.
+    """
+    if isinstance(memory, int):
+        size = memory
+    else:
+        match = re.fullmatch(
+            r'\s*(\d+(?:\.\d*)?)\s*([KMGT]?)B?\s*', str(memory), re.I)
+        if match is None:
+            raise ValueError("Invalid memory size {!r}".format(memory))
+        size = int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+    if size <= 0:
+        raise ValueError("'memory' must be > 0")
+    return size
+
+# Keys
+
+def bytes_keys(data, offsets) -> np.ndarray:
+    """Returns the records of a concatenated buffer as an array of byte
+    strings that sorts like the records themselves.
+    """
+    lengths = np.diff(offsets)
+    width = int(lengths.max()) if len(lengths) else 0
+    if len(lengths) * width > MAX_PADDING * max(int(lengths.sum()), 1):
+        return np.array(
+            [data[start:end].tobytes()
+             for start, end in zip(offsets[:-1], offsets[1:])],
+            dtype=object)
+    # records never contain NUL bytes, so zero padding does not change their
+    # order
+    width = max(width, 1)
+    return pad_ranges(data, offsets, width).view('S{}'.format(width)).ravel()
+
+def sort_keys(batch: RecordBatch, key: str,
+              k: int = DEFAULT_MINIMIZER_K) -> np.ndarray:
+    """Returns the sort key of each record of a batch.
+    """
+    if key == 'name':
+        return bytes_keys(batch.names, batch.name_offsets)
+    if key == 'sequence':
+        return bytes_keys(batch.sequences, batch.offsets)
+    if key == 'minimizer':
+        return minimizers(batch.sequences, batch.offsets, k)
+    raise ValueError("'key' must be one of {}".format(', '.join(KEYS)))
+
+def sort_run(items, key: str, k: int = DEFAULT_MINIMIZER_K):
+    """Sorts a list of batches (or tuples of aligned batches).
+
+    Returns:
+        A tuple (keys, batches) of the sorted keys and a tuple of one sorted
+        batch per mate.
+    """
+    batches = tuple(
+        RecordBatch.concat(mate) for mate in zip(*(
+            item if isinstance(item, tuple) else (item,) for item in items)))
+    keys = sort_keys(batches[0], key, k)
+    order = np.argsort(keys, kind='stable')
+    return keys[order], tuple(batch.take(order) for batch in batches)
+
+# Spilled runs
+
+class Run(object):
+    """A sorted run spilled to a file of compressed blocks, each holding the
+    batches of consecutive records.
+
+    Args:
+        path: The file.
+        key, k: The sort key of the run.
+    """
+    def __init__(self, path: str, key: str, k: int = DEFAULT_MINIMIZER_K):
+        self.path = path
+        self.key = key
+        self.k = k
+        self.count = 0
+
+    def write(self, chunks):
+        """Appends chunks (keys, batches) of sorted records, splitting them
+        into blocks of about `SPILL_BLOCK_SIZE` bytes.
+        """
+        with open(self.path, 'ab') as out:
+            for _, batches in chunks:
+                count = len(batches[0])
+                nbytes = sum(batch.nbytes for batch in batches)
+                step = max(1, count * SPILL_BLOCK_SIZE // max(nbytes, 1))
+                for start in range(0, count, step):
+                    block = tuple(
+                        batch.slice(start, start + step) for batch in batches)
+                    data = _zlib.compress(
+                        pickle.dumps(block, pickle.HIGHEST_PROTOCOL),
+                        SPILL_LEVEL)
+                    out.write(struct.pack('<Q', len(data)))
+                    out.write(data)
+                self.count += count
+        return self
+
+    def iter_blocks(self, executor):
+        """Yields the blocks (keys, batches) of the run. The next block is
+        read and decompressed in `executor` while the current one is used.
+        """
+        with open(self.path, 'rb') as inp:
+            def read_block():
+                size = inp.read(8)
+                if not size:
+                    return None
+                batches = pickle.loads(_zlib.decompress(
+                    inp.read(struct.unpack('<Q', size)[0])))
+                return sort_keys(batches[0], self.key, self.k), batches
+            future = executor.submit(read_block)
+            while True:
+                block = future.result()
+                if block is None:
+                    return
+                future = executor.submit(read_block)
+                yield block
+
+def spill_run(items, path: str, key: str, k: int = DEFAULT_MINIMIZER_K) -> Run:
+    """Sorts a list of batches (or tuples of aligned batches) and spills them
+    to a new run.
+    """
+    return Run(path, key, k).write((sort_run(items, key, k),))
+
+def merge_runs(runs, executor):
+    """Merges sorted runs.
+
+    Yields:
+        Chunks (keys, batches) of records in key order. Records with equal keys
+        are in no particular order.
+    """
+    blocks = [run.iter_blocks(executor) for run in runs]
+    current = [next(block_iter, None) for block_iter in blocks]
+    while True:
+        active = [i for i, block in enumerate(current) if block is not None]
+        if not active:
+            return
+        # every record not yet read is >= the last key of its run's current
+        # block, so all records up to the smallest such key can be merged
+        bound = min(current[i][0][-1] for i in active)
+        parts = []
+        for i in active:
+            keys, batches = current[i]
+            count = int(np.searchsorted(keys, bound, side='right'))
+            if count:
+                parts.append((
+                    keys[:count],
+                    tuple(batch.slice(0, count) for batch in batches)))
+            if count == len(keys):
+                current[i] = next(blocks[i], None)
+            else:
+                current[i] = (
+                    keys[count:],
+                    tuple(batch.slice(count, len(keys)) for batch in batches))
+        if len(parts) == 1:
+            yield parts[0]
+            continue
+        keys = np.concatenate([part[0] for part in parts])
+        order = np.argsort(keys, kind='stable')
+        yield keys[order], tuple(
+            RecordBatch.concat(mate).take(order)
+            for mate in zip(*(part[1] for part in parts)))
+
+# Sorting
+
+def iter_runs(batches, run_size: int):
+    """Groups batches (or tuples of aligned batches) into lists of about
+    `run_size` bytes. Batches are sliced (without copying) where they cross
+    the boundary between runs.
+    """
+    run = []
+    size = 0
+    for item in batches:
+        mates = item if isinstance(item, tuple) else (item,)
+        count = len(mates[0])
+        if not count:
+            continue
+        record_size = max(sum(batch.nbytes for batch in mates) / count, 1)
+        start = 0
+        while start < count:
+            stop = min(
+                count, start + max(1, int((run_size - size) / record_size)))
+            part = tuple(batch.slice(start, stop) for batch in mates)
+            run.append(part if isinstance(item, tuple) else part[0])
+            size += (stop - start) * record_size
+            start = stop
+            if size >= run_size:
+                yield run
+                run = []
+                size = 0
+    if run:
+        yield run
+
+def open_input(input):
+    """Opens the input of :func:`sort`: a reader, a path, or a tuple of two
+    paths for paired-end files.
+    """
+    import seqio
+    if hasattr(input, 'iter_batches'):
+        return input, False
+    if isinstance(input, (tuple, list)):
+        return seqio.open(*input), True
+    return seqio.open(input), True
+
+def open_output(output, paired: bool, output_args: dict = None):
+    """Opens the output of :func:`sort`: a writer, a path, or a tuple of two
+    paths for paired-end files.
+    """
+    import seqio
+    if hasattr(output, 'write_batch'):
+        writer, opened = output, False
+    elif isinstance(output, (tuple, list)):
+        writer, opened = seqio.open(
+            *output, mode='wb', **(output_args or {})), True
+    else:
+        writer, opened = seqio.open(
+            output, mode='wb', **(output_args or {})), True
+    if writer.paired != paired:
+        if opened:
+            writer.close()
+        raise ValueError(
+            "Paired-end reads must be written to a paired writer, e.g. with "
+            "output_args=dict(interleaved=True)" if paired
+            else "Single-end reads cannot be written to a paired writer")
+    return writer, opened
+
+def sort(input, output, key: str = 'name', memory=DEFAULT_MEMORY,
+         threads: int = None, k: int = DEFAULT_MINIMIZER_K,
+         temp_dir: str = None, batch_size: int = None,
+         output_args: dict = None) -> int:
+    """Sorts reads with bounded memory.
+
+    Args:
+        input: A reader (e.g. from :func:`seqio.open`), a path, or a tuple of
+            two paths for paired-end files.
+        output: A writer (which is not closed), a path, or a tuple of two
+            paths for paired-end files. Paired-end input must be written to a
+            paired writer, e.g. an interleaved FASTQ file
+            (`output_args=dict(interleaved=True)`).
+        key: 'name', 'sequence' or 'minimizer' (see `KEYS`). Pairs are sorted
+            by the key of read1.
+        memory: The approximate amount of memory to use for records, as a
+            number of bytes or a string such as '4G'.
+        threads: The number of threads that sort runs and decompress spilled
+            blocks. Defaults to the number of CPUs.
+        k: The k-mer length of minimizers.
+        temp_dir: The directory in which runs are spilled. Defaults to the
+            system temporary directory.
+        batch_size: The number of records per batch read from the input.
+        output_args: Additional arguments to :func:`seqio.open` when opening
+            `output`.
+
+    Returns:
+        The number of records (or pairs) written.
+    """
+    if key not in KEYS:
+        raise ValueError("'key' must be one of {}".format(', '.join(KEYS)))
+    memory = parse_memory(memory)
+    threads = threads or os.cpu_count() or 1
+    if threads < 1:
+        raise ValueError("'threads' must be >= 1")
+    run_size = max(memory // (3 * (threads + 1)), 1)
+    max_runs = max(2, memory // (2 * SPILL_BLOCK_SIZE))
+    reader, close_reader = open_input(input)
+    try:
+        writer, close_writer = open_output(output, reader.paired, output_args)
+        try:
+            batches = (
+                reader.iter_batches(batch_size) if batch_size
+                else reader.iter_batches())
+            return _sort(
+                batches, writer, key, k, run_size, max_runs, threads,
+                temp_dir)
+        finally:
+            if close_writer:
+                writer.close()
+    finally:
+        if close_reader:
+            reader.close()
+
+def _sort(batches, writer, key, k, run_size, max_runs, threads, temp_dir):
+    def write(chunks):
+        written = 0
+        for _, sorted_batches in chunks:
+            writer.write_batch(*sorted_batches)
+            written += len(sorted_batches[0])
+        return written
+    runs_iter = iter_runs(batches, run_size)
+    first = next(runs_iter, None)
+    if first is None:
+        return 0
+    second = next(runs_iter, None)
+    if second is None:
+        return write((sort_run(first, key, k),))
+    runs_iter = chain((first, second), runs_iter)
+    del first, second
+    with ThreadPoolExecutor(threads) as executor, TemporaryDirectory(
+            prefix='seqio-sort-', dir=temp_dir) as temp:
+        paths = (os.path.join(temp, 'run{}'.format(i)) for i in count())
+        pending = deque()
+        runs = []
+        for items in runs_iter:
+            while len(pending) >= threads:
+                runs.append(pending.popleft().result())
+            pending.append(executor.submit(
+                spill_run, items, next(paths), key, k))
+        del items
+        runs.extend(future.result() for future in pending)
+        while len(runs) > max_runs:
+            # merge the oldest runs into longer ones until the remaining runs
+            # can be merged at once
+            group = runs[:max_runs]
+            runs = runs[max_runs:] + [
+                Run(next(paths), key, k).write(merge_runs(group, executor))]
+            for run in group:
+                os.remove(run.path)
+        return write(merge_runs(runs, executor))
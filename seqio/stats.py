@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""Optional counters and per-stage timings for readers and writers.
+
+A reader or writer opened with `stats=True` (or with a :class:`Stats` object,
+e.g. to set a callback, or to share counters between the files of a pair)
+times its stages:
+
+* 'decompress': waiting for (decompressed) data from the input files.
+* 'parse': parsing the data into records or batches, including creating the
+  record objects.
+* 'format': formatting records into a write buffer.
+* 'compress': handing formatted data to the output files, including
+  compression (or waiting for it, when compression runs in other threads).
+
+It also counts the records and batches read or written, the bytes read from
+the (decompressed) input and the bytes written to the (uncompressed) output.
+Each timer is only ever updated by one thread, and all of them are summed
+when the statistics are read.
+
+When statistics are off, readers and writers use their normal (untimed)
+methods, so there is no overhead.
+"""
+from time import perf_counter
+
+STAGES = ('decompress', 'parse', 'format', 'compress')
+
+DEFAULT_INTERVAL = 1000000
+"""Default number of records between calls to a :class:`Stats` callback."""
+
+class Timer(object):
+    """Accumulates the time spent in one stage by one thread, and the number
+    of bytes processed.
+    """
+    __slots__ = ('stage', 'seconds', 'bytes')
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.seconds = 0.0
+        self.bytes = 0
+
+class Stats(object):
+    """Counters and stage timings of one reader or writer (or a pair of them).
+
+    Args:
+        callback: A function that is called with the current statistics (see
+            :meth:`as_dict`) every `interval` records.
+        interval: The number of records between calls to `callback`.
+    """
+    def __init__(self, callback=None, interval: int = DEFAULT_INTERVAL):
+        if interval < 1:
+            raise ValueError("'interval' must be >= 1")
+        self.callback = callback
+        self.interval = interval
+        self.records = 0
+        self.batches = 0
+        self._timers = []
+        self._next_report = interval
+
+    def timer(self, stage: str) -> Timer:
+        """Returns a new timer for a stage, which must only be updated by one
+        thread.
+        """
+        if stage not in STAGES:
+            raise ValueError("Unknown stage {!r}".format(stage))
+        timer = Timer(stage)
+        self._timers.append(timer)
+        return timer
+
+    def count(self, records: int, batches: int = 0):
+        """Counts records and batches, and calls the callback if another
+        `interval` records have been counted.
+        """
+        self.records += records
+        self.batches += batches
+        if self.callback is not None and self.records >= self._next_report:
+            self._next_report = (
+                self.records // self.interval + 1) * self.interval
+            self.callback(self.as_dict())
+
+    @property
+    def seconds(self) -> dict:
+        """The total time spent in each stage.
+        """
+        totals = dict.fromkeys(STAGES, 0.0)
+        for timer in self._timers:
+            totals[timer.stage] += timer.seconds
+        return totals
+
+    @property
+    def bytes_in(self) -> int:
+        return sum(t.bytes for t in self._timers if t.stage == 'decompress')
+
+    @property
+    def bytes_out(self) -> int:
+        return sum(t.bytes for t in self._timers if t.stage == 'compress')
+
+    def as_dict(self) -> dict:
+        return dict(
+            records=self.records, batches=self.batches,
+            bytes_in=self.bytes_in, bytes_out=self.bytes_out,
+            seconds=self.seconds)
+
+    def __repr__(self):
+        return "<Stats({})>".format(", ".join(
+            "{}={!r}".format(key, value)
+            for key, value in self.as_dict().items()))
+
+def get_stats(stats):
+    """Returns a :class:`Stats` object for a `stats` argument: None if it is
+    false, a new object if it is True, and otherwise the object itself.
+    """
+    if stats is True:
+        return Stats()
+    return stats or None
+
+class TimedFile(object):
+    """Wraps a binary file, timing reads (or writes) and counting their bytes
+    with a :class:`Timer`. Other attributes are those of the file.
+    """
+    def __init__(self, fileobj, timer: Timer):
+        self.fileobj = fileobj
+        self.timer = timer
+
+    def read(self, size: int = -1) -> bytes:
+        start = perf_counter()
+        data = self.fileobj.read(size)
+        self.timer.seconds += perf_counter() - start
+        self.timer.bytes += len(data)
+        return data
+
+    def readline(self, size: int = -1) -> bytes:
+        start = perf_counter()
+        line = self.fileobj.readline(size)
+        self.timer.seconds += perf_counter() - start
+        self.timer.bytes += len(line)
+        return line
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> bytes:
+        line = self.readline()
+        if not line:
+            raise StopIteration()
+        return line
+
+    def write(self, data) -> int:
+        start = perf_counter()
+        result = self.fileobj.write(data)
+        self.timer.seconds += perf_counter() - start
+        self.timer.bytes += len(data)
+        return result
+
+    def flush(self):
+        start = perf_counter()
+        self.fileobj.flush()
+        self.timer.seconds += perf_counter() - start
+
+    def close(self):
+        start = perf_counter()
+        self.fileobj.close()
+        self.timer.seconds += perf_counter() - start
+
+    def __getattr__(self, name):
+        return getattr(self.fileobj, name)
+
+def timed_iter(iterable, timer: Timer, read_timers=(), stats: Stats = None,
+               records_per_item: int = 1, batches: bool = False):
+    """Iterates over records or batches, adding the time spent producing each
+    one (less the time spent waiting for input, as measured by `read_timers`)
+    to `timer`. Must be consumed by the thread that updates `read_timers`.
+
+    Args:
+        stats: The statistics in which to count the items, or None to not
+            count them (e.g. if they are counted by another thread).
+        records_per_item: The number of records per item, e.g. 2 for pairs.
+        batches: Whether the items are batches (or tuples of aligned
+            batches), in which case the records of each batch are counted.
+    """
+    iterator = iter(iterable)
+    read_timers = tuple(read_timers)
+    while True:
+        waited = 0.0
+        for read_timer in read_timers:
+            waited -= read_timer.seconds
+        start = perf_counter()
+        item = next(iterator, None)
+        elapsed = perf_counter() - start
+        for read_timer in read_timers:
+            waited += read_timer.seconds
+        timer.seconds += elapsed - waited
+        if item is None:
+            return
+        if stats is not None:
+            if batches:
+                first = item[0] if isinstance(item, tuple) else item
+                stats.count(len(first) * records_per_item, records_per_item)
+            else:
+                stats.count(records_per_item)
+        yield item
+
+def instrument_writer(writer, stats: Stats):
+    """Times the formatting and compression of a writer with a `fileobj`
+    attribute, and counts the records it writes. The timed `write` and
+    `write_batch` methods shadow those of the writer's class, so that writers
+    without statistics are not slowed down.
+    """
+    format_timer = stats.timer('format')
+    compress_timer = stats.timer('compress')
+    writer.fileobj = TimedFile(writer.fileobj, compress_timer)
+    write = writer.write
+    write_batch = writer.write_batch
+    def timed(method, *args):
+        compressed = compress_timer.seconds
+        start = perf_counter()
+        method(*args)
+        format_timer.seconds += perf_counter() - start - (
+            compress_timer.seconds - compressed)
+    def timed_write(*records):
+        timed(write, *records)
+        stats.count(len(records))
+    def timed_write_batch(*batches):
+        # batches may be iterators, which are counted before being consumed
+        batches = tuple(
+            batch if hasattr(batch, '__len__') else list(batch)
+            for batch in batches)
+        timed(write_batch, *batches)
+        stats.count(sum(len(batch) for batch in batches), len(batches))
+    writer.write = timed_write
+    writer.write_batch = timed_write_batch
@@ -6,3 +6,9 @@ FileArg = Union[PathOrFile, Iterable[PathOrFile], PathSpec]
 
 FileListArg = Iterable[FileArg]
 """"""
+
+FilesArg = Union[PathSpec, PathOrFile, Iterable[PathOrFile]]
+"""A path, iterable of paths, or :class:`xphyle.paths.PathSpec`."""
+
+FormatArg = Union[str, object]
+"""A format name or implementation."""
@@ -2,25 +2,47 @@
 """Utility classes/methods.
 """
 from importlib import import_module
+from queue import Queue, Empty, Full
+from threading import Event, Thread
 
 class OptionalDependency(object):
-    """Subclass property to make classmethod properties possible.
+    """Descriptor for a module that is imported on first access, so that
+    classes can declare dependencies that are only required when used.
+    
+    Args:
+        name: The module name.
+        extra: The name of the seqio extra that installs the module.
     """
-    def __init__(self, name):
+    def __init__(self, name, extra: str = None):
         self.name = name
+        self.extra = extra
+        self._lib = None
     
-    @property
-    def lib(self):
-        """Loads the python module and replaces itself with that module.
+    def __get__(self, instance, owner):
+        """Loads the python module on first access.
         
         Returns:
             The module
+        
+        Raises:
+            ImportError if the module is not installed.
         """
-        lib = import_module(self.name)
-        self.lib = lib
-        lib
+        if self._lib is None:
+            try:
+                self._lib = import_module(self.name)
+            except ImportError as err:
+                message = "{} is not installed".format(self.name)
+                if self.extra:
+                    message += (
+                        "; install it with 'pip install seqio[{}]'".format(
+                            self.extra))
+                raise ImportError(message) from err
+        return self._lib
 
 class BatchIterator(object):
+    """Iterates over lists of up to `size` records. For columnar batches that
+    avoid creating per-record objects, use `reader.iter_batches` instead.
+    """
     def __init__(self, reader, size, max_reads=None):
         self.reader = reader
         self.iterable = enumerate(reader, 1)
@@ -70,6 +92,76 @@ class BatchIterator(object):
         self.done = True
         self.reader.close()
 
+class BackgroundIterator(object):
+    """Consumes an iterable in a daemon thread and hands its items to the
+    calling thread through a bounded queue, so that producing the next items
+    (e.g. decompressing and parsing) overlaps with consuming the current one.
+    Exceptions raised by the iterable are re-raised in the calling thread.
+    
+    Args:
+        iterable: The iterable to consume.
+        queue_size: The maximum number of items produced but not yet consumed.
+        name: A name for the thread.
+    """
+    _DONE = object()
+    
+    def __init__(self, iterable, queue_size: int = 4, name: str = None):
+        self.queue = Queue(maxsize=queue_size)
+        self._stopped = Event()
+        self._finished = False
+        self.thread = Thread(
+            target=self._run, args=(iterable,), name=name, daemon=True)
+        self.thread.start()
+    
+    def _put(self, item) -> bool:
+        while not self._stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+    
+    def _run(self, iterable):
+        try:
+            for item in iterable:
+                if not self._put((item, None)):
+                    return
+            self._put((self._DONE, None))
+        except BaseException as err:
+            self._put((self._DONE, err))
+        finally:
+            # release resources held by a generator in the thread that ran it
+            close = getattr(iterable, 'close', None)
+            if close is not None:
+                close()
+    
+    def __iter__(self):
+        return self
+    
+    def __next__(self):
+        if self._finished:
+            raise StopIteration()
+        item, err = self.queue.get()
+        if item is self._DONE:
+            self._finished = True
+            if err is not None:
+                raise err
+            raise StopIteration()
+        return item
+    
+    def close(self):
+        """Stops the thread, discarding any items that have not been consumed.
+        """
+        self._finished = True
+        self._stopped.set()
+        while True:
+            try:
+                self.queue.get_nowait()
+            except Empty:
+                break
+        self.thread.join()
+
 def sequence_names_match(r1, r2):
     """Check whether the sequences r1 and r2 have identical names, ignoring a
     suffix of '1' or '2'. Some old paired-end reads have names that end in '/1'
@@ -1,68 +1,313 @@
-complement = {
-    b'A' : b'T',
-    b'C' : b'G',
-    b'R' : b'Y',
-    b'S' : b'S',
-    b'W' : b'W',
-    b'K' : b'M',
-    b'B' : b'V',
-    b'D' : b'H',
-    b'N' : b'N'
-}
-for k,v in list(complement.items()):
-    complement[v] = k
-    complement[k.lower()] = v.lower()
-    complement[v.lower()] = k.lower()
-
-def complement(seq):
-    return b''.join(complement[base] for base in seq)
-
-def reverse_complement(seq):
-    return b''.join(complement[base] for base in reversed(seq))
-
-# http://nbviewer.jupyter.org/urls/gist.github.com/Jorge-C/d51b48d3e18897c46ea2/raw/73d7e11e4b72d6ba90e0021931afa230e63031e9/cython+sequences.ipynb?create=1
-cdef class CySeq3(object):
-    """Translation using a LUT, cythonized, uses numpy but str as input"""
-    arr = np.array([  0,   0,   0,   0,   0,   0,   0,   0,   0,   0,   0,   0,   0,
-                      0,   0,   0,   0,   0,   0,   0,   0,   0,   0,   0,   0,   0,
-                      0,   0,   0,   0,   0,   0,   0,   0,   0,   0,   0,   0,   0,
-                      0,   0,   0,   0,   0,   0,   0,   0,   0,   0,   0,   0,   0,
-                      0,   0,   0,   0,   0,   0,   0,   0,   0,   0,   0,   0,   0,
-                     84,  86,  71,  72,   0,   0,  67,  68,   0,   0,  77,   0,  75,
-                     78,   0,   0,   0,  89,  83,  65,   0,  66,  87,   0,  82,   0,
-                      0,   0,   0,   0,   0,   0, 116, 118, 103, 104,   0,   0,  99,
-                    100,   0,   0, 109,   0, 107, 110,   0,   0,   0, 121, 115,  97,
-                      0,  98, 119,   0, 114,   0,   0,   0,   0,   0,   0], dtype=np.uint8)
-    cdef public cnp.ndarray seq
-    cdef int length
-    
-    def __cinit__(self, str seq):
-        self.seq = np.array(seq, dtype='c').view(np.uint8)
-        self.length = len(seq)
+# kate: syntax Python;
+# cython: profile=False, emit_code_comments=False
+# cython: language_level=3
+# cython: boundscheck=False
+# cython: wraparound=False
+"""Cython implementations of sequence utilities, compiled as `seqio._utils`.
+
+Complement functions accept any contiguous byte buffer (bytes, bytearray,
+memoryview, or a NumPy uint8 array) without copying it.
+"""
+from collections import namedtuple
+import math
+from cpython.bytes cimport (
+    PyBytes_AS_STRING, PyBytes_CheckExact, PyBytes_FromStringAndSize,
+    PyBytes_GET_SIZE)
+from libc.stdint cimport int64_t, uint64_t
+from libc.string cimport memcpy
+
+import numpy as np
+
+# Complement
+
+IUPAC_COMPLEMENTS = (
+    b'AT', b'CG', b'RY', b'KM', b'SS', b'WW', b'BV', b'DH', b'NN')
+"""Pairs of complementary IUPAC nucleotide codes."""
+
+def _make_complement_table():
+    table = bytearray(range(256))
+    for base1, base2 in IUPAC_COMPLEMENTS:
+        for src, dest in ((base1, base2), (base2, base1)):
+            table[src] = dest
+            table[src | 0x20] = dest | 0x20
+    # U (RNA) complements to A, but A complements to T
+    table[ord('U')] = ord('A')
+    table[ord('u')] = ord('a')
+    return bytes(table)
+
+COMPLEMENT = _make_complement_table()
+"""256-byte translation table that maps each IUPAC nucleotide code to its
+complement, preserving case. Other bytes (e.g. gaps) map to themselves."""
+
+cdef unsigned char[256] COMPLEMENT_TABLE
+cdef unsigned char[256] IDENTITY_TABLE
+for _i in range(256):
+    COMPLEMENT_TABLE[_i] = COMPLEMENT[_i]
+    IDENTITY_TABLE[_i] = _i
+
+cdef inline void _translate(
+        const unsigned char* src, unsigned char* dest, Py_ssize_t size,
+        const unsigned char* table, bint reverse) noexcept nogil:
+    cdef Py_ssize_t i
+    if reverse:
+        for i in range(size):
+            dest[i] = table[src[size - 1 - i]]
+    else:
+        for i in range(size):
+            dest[i] = table[src[i]]
+
+cdef inline void _translate_inplace(
+        unsigned char* data, Py_ssize_t size, const unsigned char* table,
+        bint reverse) noexcept nogil:
+    cdef:
+        Py_ssize_t i, j
+        unsigned char tmp
+    if reverse:
+        i = 0
+        j = size - 1
+        while i < j:
+            tmp = table[data[i]]
+            data[i] = table[data[j]]
+            data[j] = tmp
+            i += 1
+            j -= 1
+        if i == j:
+            data[i] = table[data[i]]
+    else:
+        for i in range(size):
+            data[i] = table[data[i]]
+
+cdef bytes _translate_bytes(seq, const unsigned char* table, bint reverse):
+    cdef:
+        const unsigned char[::1] view
+        const unsigned char* src
+        Py_ssize_t size
+        bytes result
+        unsigned char* dest
+    if PyBytes_CheckExact(seq):
+        # avoid the overhead of acquiring a buffer for the common case
+        src = <const unsigned char*>PyBytes_AS_STRING(seq)
+        size = PyBytes_GET_SIZE(seq)
+    else:
+        view = seq
+        size = view.shape[0]
+        src = &view[0] if size else NULL
+    result = PyBytes_FromStringAndSize(NULL, size)
+    dest = <unsigned char*>PyBytes_AS_STRING(result)
+    if size:
+        with nogil:
+            _translate(src, dest, size, table, reverse)
+    return result
+
+def complement(seq) -> bytes:
+    """Returns the complement of a sequence.
+    """
+    return _translate_bytes(seq, COMPLEMENT_TABLE, False)
+
+def reverse_complement(seq) -> bytes:
+    """Returns the reverse complement of a sequence.
+    """
+    return _translate_bytes(seq, COMPLEMENT_TABLE, True)
+
+def complement_inplace(unsigned char[::1] seq):
+    """Complements a writable buffer (e.g. a bytearray) in place.
+    """
+    if seq.shape[0]:
+        with nogil:
+            _translate_inplace(
+                &seq[0], seq.shape[0], COMPLEMENT_TABLE, False)
+
+def reverse_complement_inplace(unsigned char[::1] seq):
+    """Reverse-complements a writable buffer (e.g. a bytearray) in place.
+    """
+    if seq.shape[0]:
+        with nogil:
+            _translate_inplace(
+                &seq[0], seq.shape[0], COMPLEMENT_TABLE, True)
+
+cdef object _reverse_records(
+        data, offsets, const unsigned char* table, bint inplace):
+    cdef:
+        const uint64_t[::1] bounds = np.asarray(offsets).astype(
+            np.uint64, copy=False)
+        const unsigned char[::1] src
+        unsigned char[::1] dest
+        Py_ssize_t i
+        uint64_t start, end
+    if inplace:
+        result = data
+        dest = data
+    else:
+        src = data
+        result = np.empty(src.shape[0], dtype=np.uint8)
+        dest = result
+    with nogil:
+        for i in range(bounds.shape[0] - 1):
+            start = bounds[i]
+            end = bounds[i + 1]
+            if end <= start:
+                continue
+            if inplace:
+                _translate_inplace(&dest[start], end - start, table, True)
+            else:
+                _translate(&src[start], &dest[start], end - start, table, True)
+    return result
+
+def reverse_complement_batch(data, offsets, bint inplace=False):
+    """Reverse-complements every record of a concatenated buffer, such as the
+    `sequences` of a :class:`seqio.batch.RecordBatch`.
+
+    Args:
+        data: The buffer.
+        offsets: The record boundaries (one more than the number of records).
+        inplace: Whether to modify `data`, which must be writable, rather than
+            a copy.
+
+    Returns:
+        `data` if `inplace`, otherwise a new NumPy uint8 array.
+    """
+    return _reverse_records(data, offsets, COMPLEMENT_TABLE, inplace)
+
+def reverse_batch(data, offsets, bint inplace=False):
+    """Reverses every record of a concatenated buffer, such as the
+    `qualities` of a :class:`seqio.batch.RecordBatch`. Arguments are as for
+    :func:`reverse_complement_batch`.
+    """
+    return _reverse_records(data, offsets, IDENTITY_TABLE, inplace)
+
+def gather_ranges(data, starts, lengths) -> np.ndarray:
+    """Concatenates ranges of a buffer, e.g. to select or trim the records of
+    a batch.
+
+    Args:
+        data: The buffer.
+        starts, lengths: The start and length of each range.
+
+    Returns:
+        A new NumPy uint8 array.
+    """
+    cdef:
+        const unsigned char[::1] src = data
+        const int64_t[::1] range_starts = np.asarray(starts).astype(
+            np.int64, copy=False)
+        const int64_t[::1] range_lengths = np.asarray(lengths).astype(
+            np.int64, copy=False)
+        unsigned char[::1] dest
+        Py_ssize_t i, pos = 0
+    result = np.empty(int(np.sum(range_lengths)), dtype=np.uint8)
+    dest = result
+    with nogil:
+        for i in range(range_starts.shape[0]):
+            if range_lengths[i] > 0:
+                memcpy(&dest[pos], &src[range_starts[i]], range_lengths[i])
+                pos += range_lengths[i]
+    return result
+
+def pad_ranges(data, offsets, Py_ssize_t width) -> np.ndarray:
+    """Copies each record of a concatenated buffer into a row of a
+    zero-filled 2D array, e.g. to compare records as fixed-width byte strings
+    (`result.view('S{width}')`). Records longer than `width` are truncated.
+
+    Args:
+        data: The buffer.
+        offsets: The record boundaries (one more than the number of records).
+        width: The number of columns.
+
+    Returns:
+        A new NumPy uint8 array of shape (records, width).
+    """
+    cdef:
+        const unsigned char[::1] src = data
+        const uint64_t[::1] bounds = np.asarray(offsets).astype(
+            np.uint64, copy=False)
+        unsigned char[:, ::1] dest
+        Py_ssize_t i, size
+    result = np.zeros((max(bounds.shape[0] - 1, 0), width), dtype=np.uint8)
+    dest = result
+    with nogil:
+        for i in range(dest.shape[0]):
+            size = min(<Py_ssize_t>(bounds[i + 1] - bounds[i]), width)
+            if size > 0:
+                memcpy(&dest[i, 0], &src[bounds[i]], size)
+    return result
+
+# Minimizers
+
+cdef unsigned char[256] BASE_CODES
+for _i in range(256):
+    BASE_CODES[_i] = 4
+for _i, _base in enumerate('ACGT'):
+    BASE_CODES[ord(_base)] = BASE_CODES[ord(_base.lower())] = _i
 
+cdef inline uint64_t _mix64(uint64_t x) noexcept nogil:
+    # the MurmurHash3 finalizer, so that minimizers are not biased towards
+    # low-complexity (e.g. poly-A) k-mers
+    x ^= x >> 33
+    x *= 0xff51afd7ed558ccdULL
+    x ^= x >> 33
+    x *= 0xc4ceb9fe1a85ec53ULL
+    x ^= x >> 33
+    return x
 
-    @cython.boundscheck(False)
-    cdef _rc(self):
-        cdef cnp.ndarray[cnp.uint8_t, ndim=1] arr = self.arr
-        cdef cnp.ndarray[cnp.uint8_t, ndim=1] seq = self.seq
-        cdef cnp.ndarray[cnp.uint8_t, ndim=1] result = np.empty_like(seq)
-        cdef int i
-        for i in reversed(range(self.length)):
-            result[-i-1] = arr[seq[i]]
-        return result.view('c')
+def minimizers(sequences, offsets, int k=31) -> np.ndarray:
+    """Returns the smallest hash of the canonical k-mers (the lesser of a
+    k-mer and its reverse complement) of each record of a concatenated
+    buffer, as a uint64 array. K-mers containing bases other than A, C, G and
+    T are skipped; records without any k-mer get the maximum uint64 value.
+    Records with the same minimizer are likely to overlap, in either
+    orientation.
+
+    Args:
+        sequences: The buffer.
+        offsets: The record boundaries (one more than the number of records).
+        k: The k-mer length (1-32).
+    """
+    if not 1 <= k <= 32:
+        raise ValueError("'k' must be between 1 and 32")
+    cdef:
+        const unsigned char[::1] data = sequences
+        const uint64_t[::1] bounds = np.asarray(offsets).astype(
+            np.uint64, copy=False)
+        uint64_t[::1] dest
+        uint64_t mask = (<uint64_t>-1) >> (64 - 2 * k)
+        uint64_t shift = 2 * (k - 1)
+        uint64_t forward, reverse, value, best, i, j
+        unsigned char code
+        int valid
+    result = np.empty(max(bounds.shape[0] - 1, 0), dtype=np.uint64)
+    dest = result
+    with nogil:
+        for i in range(<uint64_t>dest.shape[0]):
+            best = <uint64_t>-1
+            forward = reverse = 0
+            valid = 0
+            for j in range(bounds[i], bounds[i + 1]):
+                code = BASE_CODES[data[j]]
+                if code > 3:
+                    valid = 0
+                    continue
+                forward = ((forward << 2) | code) & mask
+                reverse = (reverse >> 2) | (<uint64_t>(3 - code) << shift)
+                if valid < k:
+                    valid += 1
+                if valid == k:
+                    value = _mix64(forward if forward < reverse else reverse)
+                    if value < best:
+                        best = value
+            dest[i] = best
+    return result
 
-    def rc(self):
-        return self._rc()
+# Qualities
 
 def qual2prob(qual):
     """Convert a phred-scale integer to a probability.
     """
-    return 10 ** (-q / 10)
+    return 10 ** (-qual / 10)
 
 def prob2qual(prob):
     """Convert a probability to a phred-scale integer.
     """
-    if p < 0:
+    if prob < 0:
         raise ValueError("Probability must be >= 0")
     return round(-10 * math.log10(prob))
 
@@ -80,50 +325,196 @@ def guess_quality_type(q):
         return 'asc'
     if isinstance(q, bytes):
         return 'asc'
-    raise ValueError("Cannot guess quailty type: {}".format(q))
+    raise ValueError("Cannot guess quality type: {}".format(q))
+
+cdef int _lookup_uint8(
+        const unsigned char* table, const unsigned char* invalid,
+        const unsigned char* src, unsigned char* dest,
+        Py_ssize_t size) noexcept nogil:
+    cdef:
+        Py_ssize_t i
+        unsigned char bad = 0
+    for i in range(size):
+        bad |= invalid[src[i]]
+        dest[i] = table[src[i]]
+    return bad
+
+cdef int _lookup_float(
+        const float* table, const unsigned char* invalid,
+        const unsigned char* src, float* dest, Py_ssize_t size) noexcept nogil:
+    cdef:
+        Py_ssize_t i
+        unsigned char bad = 0
+    for i in range(size):
+        bad |= invalid[src[i]]
+        dest[i] = table[src[i]]
+    return bad
 
 class QualityConversion(object):
     """Converts between phred-scaled int scores, ascii-encoded phred scores,
-    and probabilities.
+    and probabilities. Conversions from ascii go through 256-entry lookup
+    tables, and accept a single record's qualities or the `qualities` buffer
+    of a whole :class:`seqio.batch.RecordBatch` (the result is then aligned
+    with the batch's offsets).
     
     Args:
         base: The base for ascii-to-int conversion. Typically 33 unless
             older Illumina qualities are used, in which case the base
             should be 64.
-        max_asc: The max ascii value to allow. Must be <= 255.
+        max_asc: The max ascii value to allow. Must be <= 255. Higher scores
+            are capped.
     """
     def __init__(self, base=33, max_asc=255):
         if max_asc is None or max_asc < 0 or max_asc > 255:
             raise ValueError("'max_asc' must be 0 < i <= 255")
-        #if base not in (33, 64):
-            #this should be a warning
-            #pass
+        if not 0 <= base <= max_asc:
+            raise ValueError("'base' must be 0 <= i <= max_asc")
         self.base = base
         self.max_i = max_asc - base
-        self.int_table = {}
-        self.asc_table = {}
-
-    def convert_iter(quals, dest, src=None):
+        ascii_values = np.arange(256)
+        phred = np.clip(ascii_values - base, 0, self.max_i)
+        self.invalid_table = (ascii_values < base).astype(np.uint8)
+        self.phred_table = phred.astype(np.uint8)
+        self.prob_table = (10.0 ** (-phred / 10)).astype(np.float32)
+        self.ascii_table = (
+            np.minimum(ascii_values, self.max_i) + base).astype(np.uint8)
+    
+    def _check(self, bint bad):
+        if bad:
+            raise ValueError(
+                "Phred score must be >= 0 (ascii >= {})".format(self.base))
+    
+    def to_phred(self, qualities) -> np.ndarray:
+        """Converts ascii-encoded qualities (any bytes-like object) to a uint8
+        array of phred scores.
+        """
+        cdef:
+            const unsigned char[::1] src = qualities
+            const unsigned char[::1] table = self.phred_table
+            const unsigned char[::1] invalid = self.invalid_table
+            Py_ssize_t size = src.shape[0]
+            unsigned char[::1] dest
+            int bad = 0
+        result = np.empty(size, dtype=np.uint8)
+        dest = result
+        if size:
+            with nogil:
+                bad = _lookup_uint8(
+                    &table[0], &invalid[0], &src[0], &dest[0], size)
+        self._check(bad)
+        return result
+    
+    def to_prob(self, qualities) -> np.ndarray:
+        """Converts ascii-encoded qualities (any bytes-like object) to a
+        float32 array of error probabilities.
+        """
+        cdef:
+            const unsigned char[::1] src = qualities
+            const float[::1] table = self.prob_table
+            const unsigned char[::1] invalid = self.invalid_table
+            Py_ssize_t size = src.shape[0]
+            float[::1] dest
+            int bad = 0
+        result = np.empty(size, dtype=np.float32)
+        dest = result
+        if size:
+            with nogil:
+                bad = _lookup_float(
+                    &table[0], &invalid[0], &src[0], &dest[0], size)
+        self._check(bad)
+        return result
+    
+    def recode(self, qualities, int base=33, bint inplace=False):
+        """Re-encodes ascii-encoded qualities with a different base (e.g.
+        phred+64 to phred+33) in a single table lookup.
+        
+        Args:
+            qualities: A bytes-like object.
+            base: The base of the output encoding.
+            inplace: Whether to modify `qualities`, which must be writable,
+                rather than a copy.
+        
+        Returns:
+            `qualities` if `inplace`, otherwise a uint8 array.
+        """
+        cdef:
+            const unsigned char[::1] src
+            unsigned char[::1] dest
+            const unsigned char[::1] table = np.minimum(
+                self.phred_table.astype(np.int64) + base, 255).astype(
+                np.uint8)
+            const unsigned char[::1] invalid = self.invalid_table
+            int bad = 0
+        if inplace:
+            result = qualities
+            dest = qualities
+            src = dest
+        else:
+            src = qualities
+            result = np.empty(src.shape[0], dtype=np.uint8)
+            dest = result
+        if src.shape[0]:
+            with nogil:
+                bad = _lookup_uint8(
+                    &table[0], &invalid[0], &src[0], &dest[0], src.shape[0])
+        self._check(bad)
+        return result
+    
+    def convert_iter(self, quals, dest, src=None):
         """Convert qualities from one format to another.
         
         Args:
-            quals: An iterable of qualities
+            quals: A bytes-like object of ascii-encoded qualities, or a
+                sequence or array of int or probability qualities
             dest: The destination format ('int', 'asc', 'prob')
             src: The source format -- one of the above or None if it should be
                 guessed
-            base: The base for ascii-to-int conversion
         
         Returns:
-            An iterable of converted qualities
+            A uint8 array of phred scores ('int'), a float32 array of
+            probabilities ('prob') or bytes ('asc').
         """
-        if not quals:
-            return ()
         if src is None:
-            src = guess_quality_type(quals[0])
-        if src == prob:
-            quals = (prob2qual(q) for q in quals)
-            src = 'int'
-        return (self.convert(q, dest, src) for q in quals)
+            if isinstance(quals, (bytes, bytearray, memoryview)):
+                src = 'asc'
+            elif isinstance(quals, np.ndarray):
+                # e.g. the output of to_phred or to_prob, whose elements are
+                # NumPy scalars rather than ints or floats
+                if np.issubdtype(quals.dtype, np.integer):
+                    src = 'int'
+                elif np.issubdtype(quals.dtype, np.floating):
+                    src = 'prob'
+                else:
+                    raise ValueError(
+                        "Cannot guess quality type of {} array".format(
+                            quals.dtype))
+            elif len(quals) == 0:
+                src = 'int'
+            else:
+                src = guess_quality_type(quals[0])
+        if src == 'asc':
+            if dest == 'int':
+                return self.to_phred(quals)
+            if dest == 'prob':
+                return self.to_prob(quals)
+            return bytes(quals)
+        if src == 'prob':
+            probs = np.asarray(quals, dtype=np.float64)
+            if (probs < 0).any():
+                raise ValueError("Probability must be >= 0")
+            with np.errstate(divide='ignore'):
+                phred = np.where(
+                    probs == 0, self.max_i, np.round(-10 * np.log10(probs)))
+        else:
+            phred = np.asarray(quals)
+        phred = np.minimum(phred.astype(np.int64), self.max_i)
+        if (phred < 0).any():
+            raise ValueError("Phred score must be >= 0")
+        if dest == 'int':
+            return phred.astype(np.uint8)
+        if dest == 'prob':
+            return self.prob_table[phred + self.base]
+        return self.ascii_table[phred].tobytes()
     
     def convert(self, qual, dest, src=None):
         """Convert a quality score from one format to another.
@@ -139,37 +530,25 @@ class QualityConversion(object):
         """
         if src is None:
             src = guess_quality_type(qual)
-        
-        a = None
-        
         if src == 'prob':
-            p = qual
-            if p == 0:
-                i = self.max_i
-            else:
-                i = prob2qual(p)
-            src = 'int'
-        
-        if src == 'int':
-            if qual in self.int_table:
-                return getattr(self.int_table[qual], dest)
+            i = self.max_i if qual == 0 else prob2qual(qual)
+        elif src == 'int':
             i = qual
         else:
-            if qual in self.asc_table:
-                return getattr(self.asc_table[qual], dest)
             i = ord(qual) - self.base
-            a = qual
-        
         if i < 0:
             raise ValueError("Phred score must be >= 0")
-        
         i = min(i, self.max_i)
-        p = qual2prob(i)
-        if a is None:
-            a = chr(i + self.base).encode()
-        
-        record = QualityValue(i, p, a)
-        self.int_table[i] = record
-        self.asc_table[a] = record
-        
-        return getattr(record, dest)
+        return getattr(QualityValue(
+            i, float(self.prob_table[i + self.base]),
+            bytes((i + self.base,))), dest)
+
+_conversions = {}
+
+def get_quality_conversion(int base=33) -> QualityConversion:
+    """Returns a shared :class:`QualityConversion` for a base.
+    """
+    conversion = _conversions.get(base)
+    if conversion is None:
+        conversion = _conversions[base] = QualityConversion(base)
+    return conversion
@@ -0,0 +1,257 @@
+# kate: syntax Python;
+# cython: profile=False, emit_code_comments=False
+# cython: language_level=3
+# cython: boundscheck=False
+# cython: wraparound=False
+"""Cython implementation of zero-copy record views into a
+:class:`seqio.batch.RecordBatch`.
+"""
+from cpython.bytes cimport PyBytes_FromStringAndSize
+from libc.stdint cimport uint64_t
+
+import sys
+import numpy as np
+from seqio.sequences cimport Sequence
+
+cdef class BatchBuffers(object):
+    """Raw access to the buffers of a batch, shared by all of its views. Holds
+    a reference to the batch, so the buffers stay valid as long as any view
+    does.
+    """
+    cdef:
+        readonly object batch
+        const unsigned char[::1] names
+        const unsigned char[::1] sequences
+        const unsigned char[::1] qualities
+        bint has_qualities
+
+    def __init__(self, batch):
+        self.batch = batch
+        self.names = batch.names
+        self.sequences = batch.sequences
+        self.has_qualities = batch.qualities is not None
+        if self.has_qualities:
+            self.qualities = batch.qualities
+
+    cdef inline bytes get(
+            self, const unsigned char[::1] buf, Py_ssize_t start,
+            Py_ssize_t length):
+        if length == 0:
+            return b''
+        return PyBytes_FromStringAndSize(<const char*>&buf[start], length)
+
+cdef class SequenceView(object):
+    """A read-only record whose fields are views (offset and length) into the
+    buffers of a :class:`seqio.batch.RecordBatch`. Creating a view does not
+    copy any data; a field is copied into an independent `bytes` object only
+    when it is first accessed, and is then cached. Records that are only
+    inspected through the `*_view` memoryviews, or that are dropped, are never
+    copied at all.
+
+    A view keeps its whole batch alive. Call `materialize` on records that are
+    retained after the batch has been processed.
+    """
+    cdef:
+        BatchBuffers buffers
+        Py_ssize_t name_start
+        Py_ssize_t name_len
+        Py_ssize_t seq_start
+        readonly Py_ssize_t length
+        bytes _name
+        bytes _sequence
+        bytes _qualities
+
+    def __init__(self):
+        raise TypeError("SequenceViews are created by RecordBatch.iter_views")
+
+    @property
+    def name(self):
+        if self._name is None:
+            self._name = self.buffers.get(
+                self.buffers.names, self.name_start, self.name_len)
+        return self._name
+
+    @property
+    def sequence(self):
+        if self._sequence is None:
+            self._sequence = self.buffers.get(
+                self.buffers.sequences, self.seq_start, self.length)
+        return self._sequence
+
+    @property
+    def qualities(self):
+        if self._qualities is None and self.buffers.has_qualities:
+            self._qualities = self.buffers.get(
+                self.buffers.qualities, self.seq_start, self.length)
+        return self._qualities
+
+    @property
+    def has_qualities(self):
+        return self.buffers.has_qualities
+
+    @property
+    def name_view(self):
+        """The name as a memoryview into the batch buffer.
+        """
+        return memoryview(self.buffers.batch.names)[
+            self.name_start:self.name_start + self.name_len]
+
+    @property
+    def sequence_view(self):
+        """The sequence as a memoryview into the batch buffer.
+        """
+        return memoryview(self.buffers.batch.sequences)[
+            self.seq_start:self.seq_start + self.length]
+
+    @property
+    def qualities_view(self):
+        """The qualities as a memoryview into the batch buffer, or None.
+        """
+        if not self.buffers.has_qualities:
+            return None
+        return memoryview(self.buffers.batch.qualities)[
+            self.seq_start:self.seq_start + self.length]
+
+    def materialize(self):
+        """Copies the fields into a new, independent record of the batch's
+        `sequence_class`.
+        """
+        return self.buffers.batch.sequence_class(
+            self.name, self.sequence, self.qualities)
+
+    def get_name_str(self, **kwargs):
+        return self.name.decode(**kwargs)
+
+    def get_sequence_str(self, **kwargs):
+        return self.sequence.decode(**kwargs)
+
+    def get_qualities_str(self, **kwargs):
+        return self.qualities.decode(**kwargs)
+
+    def __getitem__(self, key):
+        """Returns a new record of the batch's `sequence_class` with the
+        sequence and qualities sliced according to `key`.
+        """
+        return self.buffers.batch.sequence_class(
+            self.name,
+            self.sequence[key],
+            self.qualities[key] if self.has_qualities else None)
+
+    def __len__(self):
+        return self.length
+
+    def __sizeof__(self):
+        """The memory used by the view and any fields it has copied; the
+        batch buffers are shared and not included.
+        """
+        size = object.__sizeof__(self)
+        for field in (self._name, self._sequence, self._qualities):
+            if field is not None:
+                size += sys.getsizeof(field)
+        return size
+
+    def __richcmp__(self, other, int op):
+        """Implements == and !=.
+        """
+        if 2 <= op <= 3:
+            eq = (self.name == other.name and
+                self.sequence == other.sequence and
+                self.qualities == other.qualities)
+            if op == 2:
+                return eq
+            else:
+                return not eq
+        else:
+            raise NotImplementedError()
+
+    def __reduce__(self):
+        return self.materialize().__reduce__()
+
+    def __repr__(self):
+        return "<SequenceView(name={0!r}, length={1})>".format(
+            self.name, self.length)
+
+cdef class ViewIterator(object):
+    """Iterates over :class:`SequenceView`s of the records in a batch.
+
+    Args:
+        batch: A :class:`seqio.batch.RecordBatch`.
+    """
+    cdef:
+        BatchBuffers buffers
+        const uint64_t[::1] name_offsets
+        const uint64_t[::1] offsets
+        Py_ssize_t index
+        Py_ssize_t count
+
+    def __init__(self, batch):
+        self.buffers = BatchBuffers(batch)
+        # offsets are uint32 or uint64; widen once so indexing is uniform
+        self.name_offsets = batch.name_offsets.astype(np.uint64, copy=False)
+        self.offsets = batch.offsets.astype(np.uint64, copy=False)
+        self.index = 0
+        self.count = len(batch)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        cdef:
+            Py_ssize_t i = self.index
+            SequenceView view
+        if i >= self.count:
+            raise StopIteration()
+        view = SequenceView.__new__(SequenceView)
+        view.buffers = self.buffers
+        view.name_start = self.name_offsets[i]
+        view.name_len = self.name_offsets[i + 1] - self.name_offsets[i]
+        view.seq_start = self.offsets[i]
+        view.length = self.offsets[i + 1] - self.offsets[i]
+        self.index = i + 1
+        return view
+
+    def __len__(self):
+        return self.count - self.index
+
+cdef class RecordIterator(ViewIterator):
+    """Iterates over the records in a batch as new, independent instances of
+    the batch's `sequence_class`.
+
+    Args:
+        batch: A :class:`seqio.batch.RecordBatch`.
+    """
+    cdef:
+        object sequence_class
+        bint create_sequence
+
+    def __init__(self, batch):
+        super(RecordIterator, self).__init__(batch)
+        self.sequence_class = batch.sequence_class
+        self.create_sequence = self.sequence_class is Sequence
+
+    def __next__(self):
+        cdef:
+            Py_ssize_t i = self.index
+            Py_ssize_t start, length
+            bytes name, sequence, qualities = None
+            Sequence record
+        if i >= self.count:
+            raise StopIteration()
+        start = self.offsets[i]
+        length = self.offsets[i + 1] - start
+        name = self.buffers.get(
+            self.buffers.names, self.name_offsets[i],
+            self.name_offsets[i + 1] - self.name_offsets[i])
+        sequence = self.buffers.get(self.buffers.sequences, start, length)
+        if self.buffers.has_qualities:
+            qualities = self.buffers.get(
+                self.buffers.qualities, start, length)
+        self.index = i + 1
+        if self.create_sequence:
+            record = Sequence.__new__(Sequence)
+            record.name = name
+            record.sequence = sequence
+            record.qualities = qualities
+            record.length = length
+            return record
+        return self.sequence_class(name, sequence, qualities)
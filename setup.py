@@ -18,8 +18,8 @@ import versioneer
 
 MIN_CYTHON_VERSION = '0.25'
 
-if sys.version_info < (3, 3):
-    sys.stdout.write("At least Python 3.3 is required.\n")
+if sys.version_info < (3, 10):
+    sys.stdout.write("At least Python 3.10 is required.\n")
     sys.exit(1)
 
 def out_of_date(extensions):
@@ -80,7 +80,13 @@ def check_cython_version():
         sys.exit(1)
 
 extensions = [
-    Extension('seqio.sequence', sources=['seqio/sequence.pyx'])
+    Extension('seqio.sequences', sources=['seqio/sequences.pyx']),
+    Extension('seqio.parsers', sources=['seqio/parsers.pyx']),
+    Extension('seqio.views', sources=['seqio/views.pyx']),
+    Extension('seqio.formatters', sources=['seqio/formatters.pyx']),
+    Extension('seqio.qc', sources=['seqio/qc.pyx']),
+    # seqio/utils.py holds the pure-Python utilities
+    Extension('seqio._utils', sources=['seqio/utils.pyx'])
 ]
 
 cmdclass = versioneer.get_cmdclass()
@@ -124,11 +130,16 @@ setup(
     cmdclass = cmdclass,
     ext_modules = extensions,
     packages = ['seqio'],
+    python_requires = '>=3.10',
     install_requires = [
+        'numpy',
         'xphyle'
-    ]
+    ],
     extras_require = {
-        'sam' : ['pysam']
+        'sam' : ['pysam'],
+        'isal' : ['isal'],
+        'zlib-ng' : ['zlib-ng'],
+        'index' : ['indexed_gzip']
     },
     classifiers = [
         "Development Status :: 2 - Pre-Alpha",
@@ -138,10 +149,11 @@ setup(
         "License :: Public Domain",
         "Natural Language :: English",
         "Programming Language :: Cython",
-        "Programming Language :: Python :: 3.3",
-        "Programming Language :: Python :: 3.4",
-        "Programming Language :: Python :: 3.5",
-        'Programming Language :: Python :: 3.6',
+        "Programming Language :: Python :: 3",
+        "Programming Language :: Python :: 3 :: Only",
+        "Programming Language :: Python :: 3.10",
+        "Programming Language :: Python :: 3.11",
+        "Programming Language :: Python :: 3.12",
         "Topic :: Scientific/Engineering :: Bio-Informatics"
     ]
 )
@@ -1,6 +1,10 @@
 #!/usr/bin/env python
+import bz2
+import gzip
+import lzma
 from xphyle import open_
 from random import choices
+import numpy as np
 
 def gen_seq(length, qualities=True):
     seq = ''.join(choices('ACGT', k=length))
@@ -27,7 +31,86 @@ def gen_fastq_series(m, name_template, n, id_template, length):
 
 fastq = gen_fastq_series(2, 'test{}.{}.fq.gz', 2, 'rec{}', 8)
 
+# Synthetic data for benchmarks. Records are tuples (name, sequence,
+# qualities) of bytes, generated from a seeded NumPy generator so that the
+# same arguments always give the same data.
+
+BASES = np.frombuffer(b'ACGT', dtype=np.uint8)
+
+def random_bases(rng, length):
+    return BASES[rng.integers(0, 4, length)].tobytes()
+
+def random_qualities(rng, length, low=2, high=41):
+    return (rng.integers(low, high + 1, length) + 33).astype(np.uint8).tobytes()
+
+def gen_short_reads(n, length=150, paired=False, seed=0):
+    """Illumina-like reads of a fixed length. If `paired`, yields tuples
+    (read1, read2) of mates with the same name.
+    """
+    rng = np.random.default_rng(seed)
+    for i in range(n):
+        name = b'SIM:1:FCX:1:%d:%d:%d' % (i // 4000 + 1, i % 4000, i)
+        reads = tuple(
+            (name, random_bases(rng, length), random_qualities(rng, length))
+            for _ in range(2 if paired else 1))
+        yield reads if paired else reads[0]
+
+def gen_long_reads(n, mean_length=10000, seed=0):
+    """Nanopore-like reads with log-normally distributed lengths.
+    """
+    rng = np.random.default_rng(seed)
+    lengths = np.maximum(
+        rng.lognormal(np.log(mean_length), 0.5, n).astype(np.int64), 100)
+    for i, length in enumerate(lengths):
+        yield (
+            b'read%d runid=0 ch=%d' % (i, i % 512), random_bases(rng, length),
+            random_qualities(rng, length, 3, 30))
+
+def gen_chromosomes(lengths, seed=0):
+    """Chromosome-scale sequences (without qualities) of the given lengths.
+    """
+    rng = np.random.default_rng(seed)
+    for i, length in enumerate(lengths, 1):
+        yield (b'chr%d' % i, random_bases(rng, length), None)
+
+def format_fastq(records):
+    for name, seq, qual in records:
+        yield b'@%s\n%s\n+\n%s\n' % (name, seq, qual)
+
+def format_fasta(records, line_length=60):
+    for name, seq, _ in records:
+        lines = (
+            seq[i:i + line_length] for i in range(0, len(seq), line_length))
+        yield b'>%s\n%s\n' % (name, b'\n'.join(lines))
+
+def format_sam(records, flag=4):
+    for name, seq, qual in records:
+        yield b'%s\t%d\t*\t0\t0\t*\t*\t0\t0\t%s\t%s\n' % (
+            name.split(b' ', 1)[0], flag, seq, qual)
+
+OPENERS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+
+def write_data(path, chunks, level=None):
+    """Writes chunks of bytes to a file, compressed according to its
+    extension at the given compression level (or the default level).
+    """
+    path = str(path)
+    opener = next(
+        (opener for ext, opener in OPENERS.items() if path.endswith(ext)),
+        None)
+    if opener is None:
+        out = open(path, 'wb')
+    elif level is None:
+        out = opener(path, 'wb')
+    elif opener is lzma.open:
+        out = opener(path, 'wb', preset=level)
+    else:
+        out = opener(path, 'wb', compresslevel=level)
+    with out:
+        for chunk in chunks:
+            out.write(chunk)
+
 if __name__ == '__main__':
     for fname, content in fastq.items():
         with open_(fname, 'w') as o:
-            o.write('\n'.join("{}\n{}\n+\n{}".format(*rec) for rec in content))
+            o.write(''.join("@{}\n{}\n+\n{}\n".format(*rec) for rec in content))
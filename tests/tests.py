@@ -1,49 +1,1142 @@
+import asyncio
+import gzip
+from functools import partial
+import os
+import subprocess
+import sys
+from io import BytesIO
 from unittest import TestCase, skipIf
-from . import *
-from seqio import reader
-from xphyle.paths import TempDir, PathSpec, FileSpec, PathVar
+import numpy as np
+import seqio
+import seqio.sam
+from seqio.batch import RecordBatch
+from seqio.compression import (
+    BGZF_EOF, BgzfReader, BlockCompressedWriter, deflate_bgzf_block,
+    get_decompressor, is_bgzf, open_decompressed)
+from seqio.faidx import FastaIndex, build_fai
+from seqio.fasta import Fasta
+from seqio.fastq import Fastq
+from seqio.fqidx import FastqIndex
+from seqio.io import (
+    FormatError, InterleavedFileWriter, PairedFileReader, SequenceWriter,
+    SingleFileReader)
+import seqio.fasta
+import seqio.aio
+import seqio.fastq
+import seqio.qc
+from seqio.parallel import (
+    iter_chunks, iter_interleaved_chunks, iter_paired_chunks)
+from seqio.utils import BackgroundIterator
+from seqio._utils import (
+    QualityConversion, complement, complement_inplace, minimizers,
+    pad_ranges, reverse_complement, reverse_complement_batch,
+    reverse_complement_inplace)
+from seqio.pipeline import Pipeline, SharedBatch
+from seqio.parsers import (
+    FastqParser, find_record_start, rfind_record_start, count_records)
+from seqio.sequences import MutableSequence, Sequence
+from seqio.sniff import guess_format_from_name, sniff_bytes, sniff_file
+from seqio.stats import Stats
+from xphyle.paths import TempDir
 
 class Tests(TestCase):
     def setUp(self):
         self.data_dir = os.path.join(os.path.dirname(__file__), 'data')
     
     def test_reader(self):
-        # The following are equivalent
-        r1 = reader(
-            os.path.join(self.data_dir, 'test*.1.fq.gz'),
-            os.path.join(self.data_dir, 'test*.2.fq.gz'))
-        self.assertEquals(FileType.FASTQ, r1.file_type)
-        self.assertTrue(r1.paired)
-        r2 = reader(
-            [os.path.join(self.data_dir, f) for f in (
-                'testA.1.fq.gz', 'testB.1.fq.gz')],
-            [os.path.join(self.data_dir, f) for f in (
-                'testA.2.fq.gz', 'testB.2.fq.gz')])
-        self.assertEquals(FileType.FASTQ, r2.file_type)
-        self.assertTrue(r2.paired)
-        r3 = reader(PathSpec(
-            self.data_dir,
-            FileSpec(
-                PathVar('library'),
-                PathVar('pair'),
-                template='test{library}.{pair}.fq.gz')))
-        self.assertEquals(FileType.FASTQ, r3.file_type)
-        self.assertTrue(r3.paired)
-        
-        records1 = list(r1)
-        records2 = list(r2)
-        records3 = list(r3)
-        self.assertListEqual(records1, records2)
-        self.assertListEqual(records1, records3)
-        
-        names = [rec.name for rec in records1]
-        self.assertListEqual(['rec1', 'rec2', 'rec3', 'rec4'], names)
-        seqs = [rec.seq for rec in records1]
+        files1, files2 = (
+            [os.path.join(self.data_dir, 'test{}.{}.fq.gz'.format(lib, pair))
+             for lib in 'AB']
+            for pair in (1, 2))
+        with seqio.open(files1, files2) as reader:
+            self.assertEqual('fastq', reader.file_format.name)
+            self.assertTrue(reader.paired)
+            pairs = list(reader)
         self.assertListEqual(
-            [b'CCTGTGGG', b'AAGACTTG', b'ATCGGTAG', b'CGCCTGCC'], seqs)
-        
-        names = [rec.name for rec in records2]
-        self.assertListEqual(['rec1', 'rec2', 'rec3', 'rec4'], names)
-        seqs = [rec.seq for rec in records2]
+            [b'rec1', b'rec2', b'rec3', b'rec4'],
+            [read1.name for read1, _ in pairs])
         self.assertListEqual(
-            [b'CTGTAAGT', b'GCGCAGGG', b'AGATCTCG', b'TGCAAGAA'], seqs)
+            [b'CCTGTGGG', b'AAGACTTG', b'ATCGGTAG', b'CGCCTGCC'],
+            [read1.sequence for read1, _ in pairs])
+        self.assertListEqual(
+            [b'CTGTAAGT', b'GCGCAGGG', b'AGATCTCG', b'TGCAAGAA'],
+            [read2.sequence for _, read2 in pairs])
+    
+    def test_name(self):
+        path1, path2 = (
+            os.path.join(self.data_dir, 'testA.{}.fq.gz'.format(pair))
+            for pair in (1, 2))
+        with seqio.open(path1) as reader:
+            self.assertEqual(path1, reader.name)
+            self.assertIn(repr(path1), repr(reader))
+        with seqio.fastq.open((path1, path2), interleaved=False) as reader:
+            self.assertEqual((path1, path2), reader.name)
+        with seqio.open(path1, path2) as reader:
+            self.assertEqual(path1, reader.read1.name)
+            self.assertEqual(path2, reader.read2.name)
+        with open(path1, 'rb') as fileobj:
+            with seqio.fastq.open(fileobj) as reader:
+                self.assertEqual(path1, reader.name)
+
+class PairedFileReaderTests(TestCase):
+    def setUp(self):
+        self.records = [
+            Sequence(b'r%d' % i, b'ACGT', b'IIII') for i in range(5)]
+    
+    def read_pairs(self, records1, records2, threads, batches=False):
+        """Reads the pairs before the first FormatError, which is returned.
+        """
+        pairs = []
+        with TempDir() as temp:
+            paths = [
+                temp.make_file(suffix=suffix) for suffix in ('.1.fq', '.2.fq')]
+            for path, records in zip(paths, (records1, records2)):
+                with seqio.fastq.open(path, mode='w') as writer:
+                    writer.write_batch(records)
+            mates = (SingleFileReader(path, file_format=Fastq())
+                     for path in paths)
+            reader = PairedFileReader(
+                'pairs', *mates, Fastq(), threads=threads,
+                thread_batch_size=2)
+            with reader:
+                try:
+                    if batches:
+                        for batch1, batch2 in reader.iter_batches(2):
+                            pairs.extend(zip(batch1, batch2))
+                    else:
+                        pairs.extend(reader)
+                except FormatError as err:
+                    return pairs, err
+        return pairs, None
+    
+    def test_different_counts(self):
+        for threads in (True, False):
+            for batches in (True, False):
+                # the last batch of read1 has one more record
+                pairs, err = self.read_pairs(
+                    self.records, self.records[:4], threads, batches)
+                self.assertEqual(4, len(pairs))
+                self.assertIn('different numbers', str(err))
+                # read2 ends within a batch
+                pairs, err = self.read_pairs(
+                    self.records[:4], self.records[:3], threads, batches)
+                self.assertListEqual(
+                    list(zip(self.records[:3], self.records[:3])), pairs)
+                self.assertIn('different numbers', str(err))
+    
+    def test_different_names(self):
+        records2 = list(self.records)
+        records2[3] = Sequence(b'x3', b'ACGT', b'IIII')
+        for threads in (True, False):
+            pairs, err = self.read_pairs(self.records, records2, threads)
+            self.assertListEqual(
+                list(zip(self.records[:3], self.records[:3])), pairs)
+            self.assertIn('same name', str(err))
+            # the name is checked before the numbers of records
+            pairs, err = self.read_pairs(
+                self.records[:4], records2[:5], threads)
+            self.assertEqual(3, len(pairs))
+            self.assertIn('same name', str(err))
+
+class FastqParserTests(TestCase):
+    def test_block_edges(self):
+        data = b"@r1 x\nACGT\n+\nIIII\n@r2\r\nAC\r\n+r2\r\nII\r\n@r3\nA\n+\nI"
+        # a tiny buffer forces records to span blocks and the buffer to grow
+        for buffer_size in (1, 7, 1024):
+            records = list(FastqParser(BytesIO(data), buffer_size=buffer_size))
+            self.assertListEqual(
+                [b'r1 x', b'r2', b'r3'], [rec.name for rec in records])
+            self.assertListEqual(
+                [b'ACGT', b'AC', b'A'], [rec.sequence for rec in records])
+            self.assertListEqual(
+                [b'IIII', b'II', b'I'], [rec.qualities for rec in records])
+    
+    def test_format_errors(self):
+        for data in (
+                b"r1\nAC\n+\nII\n",
+                b"@r1\nAC\n-\nII\n",
+                b"@r1\nAC\n+r2\nII\n",
+                b"@r1\nAC\n+\nI\n",
+                b"@r1\nAC\n+\n"):
+            with self.assertRaises(FormatError):
+                list(FastqParser(BytesIO(data)))
+    
+    def test_next_batch(self):
+        data = b"@r1\nACGT\n+\nIIII\n@r2\nAC\n+\nII\n@r3\nA\n+\nI\n"
+        parser = FastqParser(BytesIO(data), buffer_size=5)
+        batch = parser.next_batch(2)
+        self.assertEqual(2, len(batch))
+        self.assertEqual(b'r1r2', batch.names.tobytes())
+        self.assertListEqual([0, 2, 4], list(batch.name_offsets))
+        self.assertEqual(b'ACGTAC', batch.sequences.tobytes())
+        self.assertEqual(b'IIIIII', batch.qualities.tobytes())
+        self.assertListEqual([0, 4, 6], list(batch.offsets))
+        batch = RecordBatch.concat([batch, parser.next_batch(2)])
+        self.assertIsNone(parser.next_batch(2))
+        self.assertListEqual([b'r1', b'r2', b'r3'], [r.name for r in batch])
+        subset = batch.take([2, 0])
+        self.assertListEqual([b'r3', b'r1'], [r.name for r in subset])
+        self.assertListEqual([b'A', b'ACGT'], [r.sequence for r in subset])
+    
+    def test_views(self):
+        data = b"@r1\nACGT\n+\nIIII\n@r2\nAC\n+\nHH\n"
+        batch = FastqParser(BytesIO(data)).next_batch(10)
+        views = list(batch.iter_views())
+        self.assertEqual(2, len(views))
+        self.assertEqual(b'AC', bytes(views[1].sequence_view))
+        self.assertEqual(b'r2', views[1].name)
+        self.assertEqual(b'HH', views[1].qualities)
+        self.assertEqual(4, len(views[0]))
+        record = views[0].materialize()
+        self.assertEqual(views[0], record)
+        self.assertEqual(b'CG', views[0][1:3].sequence)
+
+class ParallelTests(TestCase):
+    # '@' is also a quality character
+    data = b"@r1\nACGT\n+\n@III\n@r2\nAC\n+\n@I\n@r3\nA\n+\nI\n"
+    
+    def test_record_start(self):
+        self.assertEqual(0, find_record_start(self.data))
+        self.assertEqual(16, find_record_start(self.data, 1))
+        self.assertEqual(28, rfind_record_start(self.data))
+        # the last record is incomplete, so it cannot be verified
+        self.assertEqual(16, rfind_record_start(self.data[:-1]))
+        self.assertEqual(-1, rfind_record_start(b"@r1\nA\n+\n"))
+    
+    def test_count_records(self):
+        self.assertEqual((3, 38), count_records(self.data))
+        self.assertEqual((2, 28), count_records(self.data, 2))
+        self.assertEqual((2, 28), count_records(self.data[:-1]))
+    
+    def test_chunks(self):
+        for chunk_size in (1, 10, 100):
+            chunks = list(iter_chunks(BytesIO(self.data), chunk_size))
+            self.assertEqual(self.data, b''.join(chunks))
+            for chunk in chunks:
+                self.assertEqual(0, find_record_start(chunk))
+        chunks = list(iter_interleaved_chunks(BytesIO(self.data), 10))
+        self.assertListEqual([self.data[:28], self.data[28:]], chunks)
+    
+    def test_paired_chunks(self):
+        # read2 is four times as long as read1
+        data1 = b''.join(
+            b'@r%d\nACGT\n+\nIIII\n' % i for i in range(1000))
+        data2 = b''.join(
+            b'@r%d\n%s\n+\n%s\n' % (i, b'A' * 16, b'I' * 16)
+            for i in range(1000))
+        inputs = (BytesIO(data1), BytesIO(data2))
+        chunks = []
+        for chunk1, chunk2 in iter_paired_chunks(*inputs, 100):
+            self.assertEqual(count_records(chunk1), (
+                count_records(chunk2)[0], len(chunk1)))
+            chunks.append((chunk1, chunk2))
+            # the bytes read ahead of the yielded chunks stay bounded
+            for fileobj, i in zip(inputs, (0, 1)):
+                read_ahead = fileobj.tell() - sum(
+                    len(chunk[i]) for chunk in chunks)
+                self.assertLessEqual(read_ahead, 200)
+        self.assertEqual(data1, b''.join(chunk1 for chunk1, _ in chunks))
+        self.assertEqual(data2, b''.join(chunk2 for _, chunk2 in chunks))
+        # the last records lack a newline
+        chunks = list(iter_paired_chunks(
+            BytesIO(data1[:-1]), BytesIO(data2[:-1]), 100))
+        self.assertEqual(data1[:-1], b''.join(chunk1 for chunk1, _ in chunks))
+        self.assertEqual(data2[:-1], b''.join(chunk2 for _, chunk2 in chunks))
+    
+    def test_open(self):
+        records = [
+            Sequence(b'r%d' % i, b'ACGT' * (i % 5 + 1), b'I' * 4 * (i % 5 + 1))
+            for i in range(500)]
+        mates = [
+            Sequence(b'r%d' % i, b'TTGCA' * 10, b'5' * 50) for i in range(500)]
+        format_args = dict(chunk_size=1000)
+        with TempDir() as temp:
+            paths = [
+                temp.make_file(suffix=suffix)
+                for suffix in ('.fq', '.1.fq', '.2.fq', '.interleaved.fq')]
+            with seqio.fastq.open(paths[0], mode='w') as writer:
+                writer.write_batch(records)
+            with seqio.fastq.open(*paths[1:3], mode='w') as writer:
+                writer.write_batch(records, mates)
+            with seqio.fastq.open(
+                    paths[3], mode='w', interleaved=True) as writer:
+                writer.write_batch(records, mates)
+            with seqio.open(
+                    paths[0], workers=2, format_args=format_args) as reader:
+                self.assertListEqual(records, list(reader))
+            with seqio.open(
+                    paths[1], paths[2], workers=2,
+                    format_args=format_args) as reader:
+                self.assertListEqual(
+                    list(zip(records, mates)), list(reader))
+            with seqio.open(
+                    paths[3], workers=2, format_args=format_args) as reader:
+                self.assertTrue(reader.paired)
+                self.assertListEqual(
+                    list(zip(records, mates)), list(reader))
+
+class ImportTests(TestCase):
+    # upper bound on the time to import seqio in a fresh interpreter
+    IMPORT_TIME_LIMIT = 0.1
+    
+    def run_python(self, code):
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(
+            os.path.dirname(os.path.abspath(seqio.sam.__file__))))
+        return subprocess.check_output(
+            [sys.executable, '-c', code], env=env).decode().strip()
+    
+    def test_lazy_imports(self):
+        imported = self.run_python(
+            "import sys, seqio; print(' '.join(sorted(sys.modules)))").split()
+        for module in ('numpy', 'pysam', 'xphyle', 'seqio.fastq', 'seqio.sam'):
+            self.assertNotIn(module, imported)
+    
+    def test_import_time(self):
+        elapsed = min(float(self.run_python(
+            "import time; start = time.perf_counter(); import seqio; "
+            "print(time.perf_counter() - start)")) for i in range(3))
+        self.assertLess(elapsed, self.IMPORT_TIME_LIMIT)
+    
+    def test_formats(self):
+        formats = seqio.Formats()
+        formats.register('fastq', 'seqio.fastq')
+        self.assertIs(seqio.fastq, formats.get('fastq'))
+        with self.assertRaises(ValueError):
+            formats.get('foo')
+
+class BackgroundIteratorTests(TestCase):
+    def test_iterate(self):
+        self.assertListEqual(
+            list(range(100)), list(BackgroundIterator(range(100), 2)))
+    
+    def test_error(self):
+        def fail():
+            yield 1
+            raise FormatError("bad record")
+        itr = BackgroundIterator(fail())
+        self.assertEqual(1, next(itr))
+        with self.assertRaises(FormatError):
+            next(itr)
+    
+    def test_close(self):
+        itr = BackgroundIterator(iter(int, 1), 1)
+        self.assertEqual(0, next(itr))
+        itr.close()
+        self.assertFalse(itr.thread.is_alive())
+        with self.assertRaises(StopIteration):
+            next(itr)
+
+class ComplementTests(TestCase):
+    def test_complement(self):
+        self.assertEqual(b'TGCAYRNn-', complement(b'ACGTRYNn-'))
+        self.assertEqual(b'-nNRYACGT', reverse_complement(b'ACGTRYNn-'))
+        self.assertEqual(b'aAaT', reverse_complement(bytearray(b'AuTt')))
+        self.assertEqual(b'GTT', reverse_complement(memoryview(b'AAC')))
+        self.assertEqual(b'', reverse_complement(b''))
+        for seq in (b'ACGTA', b'ACGT'):
+            buf = bytearray(seq)
+            reverse_complement_inplace(buf)
+            self.assertEqual(reverse_complement(seq), buf)
+            complement_inplace(buf)
+            self.assertEqual(seq[::-1], buf)
+    
+    def test_batch(self):
+        record = Sequence(b'r', b'AACG', b'ABCD')
+        self.assertEqual(
+            Sequence(b'r', b'CGTT', b'DCBA'), record.reverse_complement())
+        batch = RecordBatch.from_records([
+            record, Sequence(b's', b'', b''), Sequence(b't', b'TGA', b'III')])
+        reverse = batch.reverse_complement()
+        self.assertEqual(b'CGTTTCA', reverse.sequences.tobytes())
+        self.assertEqual(b'DCBAIII', reverse.qualities.tobytes())
+        data = bytearray(b'AACGTGA')
+        reverse_complement_batch(data, batch.offsets, inplace=True)
+        self.assertEqual(b'CGTTTCA', data)
+    
+    def test_minimizers(self):
+        seqs = [b'ACGTTGCAAGGN', b'ccttgcaacgt', b'ACGNN', b'']
+        batch = RecordBatch.from_records([
+            Sequence(b'r', seq, None) for seq in seqs])
+        result = minimizers(batch.sequences, batch.offsets, 5)
+        # the second sequence is the reverse complement of the first
+        self.assertEqual(result[0], result[1])
+        self.assertEqual([2 ** 64 - 1] * 2, result[2:].tolist())
+        with self.assertRaises(ValueError):
+            minimizers(batch.sequences, batch.offsets, 33)
+        self.assertEqual(
+            [b'ACGT', b'cctt', b'ACGN', b''],
+            pad_ranges(batch.sequences, batch.offsets, 4).view('S4')
+            .ravel().tolist())
+
+class SequenceTests(TestCase):
+    def test_decode_cache(self):
+        record = Sequence(b'read1', b'ACGT', b'IIII')
+        size = sys.getsizeof(record)
+        self.assertEqual('read1', record.get_name_str())
+        self.assertGreater(sys.getsizeof(record), size)
+        self.assertIs(record.get_name_str(), record.get_name_str())
+        self.assertEqual('ACGT', record.get_sequence_str())
+        self.assertEqual([40] * 4, list(record.get_qualities_int()))
+        self.assertEqual([9] * 4, list(record.get_qualities_int(64)))
+    
+    def test_view_size(self):
+        batch = RecordBatch.from_records([Sequence(b'read1', b'ACGT', b'IIII')])
+        view = next(batch.iter_views())
+        size = sys.getsizeof(view)
+        self.assertEqual(b'ACGT', view.sequence)
+        self.assertEqual(size + sys.getsizeof(b'ACGT'), sys.getsizeof(view))
+
+class MutableSequenceTests(TestCase):
+    def test_trim(self):
+        record = MutableSequence(b'read1', b'AACCGGTTAC', b'ABCDEFGHIJ')
+        self.assertIs(record, record[2:8])
+        self.assertEqual(6, len(record))
+        self.assertEqual(b'CCGGTT', record.sequence)
+        self.assertEqual(b'CDEFGH', record.qualities)
+        self.assertEqual(
+            [(8, 10, b'AC', b'IJ'), (0, 2, b'AA', b'AB')],
+            [(e.start, e.stop, e.bases, e.quals) for e in record.edits])
+    
+    def test_edit(self):
+        record = MutableSequence(b'read1', b'AACCGGTTAC', b'ABCDEFGHIJ')
+        record.delete(stop=2)
+        record.insert(2, b'NN', b'!!', 'insertion')
+        record.delete(start=8, description='quality')
+        self.assertEqual(b'CCNNGGTT', record.sequence)
+        self.assertEqual(b'CD!!EFGH', record.qualities)
+        edits = record.edits
+        self.assertEqual(3, len(edits))
+        self.assertEqual(('insertion', 2), (
+            edits[1].description, edits[1].size_change))
+        self.assertEqual(b'AC', edits[2].bases)
+        self.assertEqual(
+            Sequence(b'read1', b'AACCGGTTAC', b'ABCDEFGHIJ'),
+            record.get_original())
+        record.reverse_complement_inplace()
+        self.assertEqual(b'AACCNNGG', record.sequence)
+        with self.assertRaises(ValueError):
+            record.edit(2, 20)
+        with self.assertRaises(ValueError):
+            record.insert(0, b'A', b'')
+
+class QualityConversionTests(TestCase):
+    def test_arrays(self):
+        conversion = QualityConversion()
+        self.assertEqual([0, 10, 40], list(conversion.to_phred(b'!+I')))
+        self.assertTrue(np.allclose(
+            [1.0, 0.1, 0.0001], conversion.to_prob(bytearray(b'!+I'))))
+        batch = np.frombuffer(b'hh@', dtype=np.uint8)
+        self.assertEqual(
+            b'II!', QualityConversion(64).recode(batch, 33).tobytes())
+        with self.assertRaises(ValueError):
+            QualityConversion(64).to_phred(b'h!')
+        self.assertEqual(
+            [40, 0], list(Sequence(b'r', b'AC', b'I!').get_qualities_int()))
+    
+    def test_convert(self):
+        conversion = QualityConversion()
+        self.assertEqual(40, conversion.convert(b'I', 'int'))
+        self.assertEqual(b'I', conversion.convert(40, 'asc'))
+        self.assertEqual(30, conversion.convert(0.001, 'int'))
+        self.assertEqual(
+            b'+I', conversion.convert_iter([0.1, 0.0001], 'asc'))
+        self.assertEqual([40, 2], list(conversion.convert_iter(b'I#', 'int')))
+        # arrays from to_phred and to_prob are recognized by their dtype
+        self.assertEqual(
+            b'+I', conversion.convert_iter(conversion.to_phred(b'+I'), 'asc'))
+        self.assertEqual(
+            b'+I', conversion.convert_iter(conversion.to_prob(b'+I'), 'asc'))
+        self.assertEqual(
+            [10, 40], list(conversion.convert_iter(
+                conversion.to_prob(b'+I'), 'int')))
+
+class QcTests(TestCase):
+    def setUp(self):
+        self.batch = RecordBatch.from_records([
+            Sequence(b'r0', b'NACGTN', b'IIII##'),
+            Sequence(b'r1', b'ACGTAC', b'5555II'),
+            Sequence(b'r2', b'', b'')])
+    
+    def test_statistics(self):
+        mean = seqio.qc.mean_quality(self.batch)
+        self.assertAlmostEqual(164 / 6, mean[0], places=4)
+        self.assertAlmostEqual(160 / 6, mean[1], places=4)
+        self.assertTrue(np.isnan(mean[2]))
+        self.assertEqual([2, 20, 0], list(seqio.qc.min_quality(self.batch)))
+        self.assertEqual(
+            [1, 0, 0], list(seqio.qc.n_content(self.batch) * 3))
+        self.assertEqual(
+            [True, True, False], list(seqio.qc.length_mask(self.batch, 1)))
+    
+    def test_trim(self):
+        starts, stops = seqio.qc.quality_trim(self.batch, 10)
+        self.assertEqual([4, 6, 0], list(stops))
+        starts, stops = seqio.qc.quality_trim(self.batch, 10, 30)
+        self.assertEqual(([0, 4, 0], [4, 6, 0]), (list(starts), list(stops)))
+        trimmed = self.batch.trim(*seqio.qc.end_trim(self.batch))
+        self.assertEqual(b'ACGT', trimmed.get_sequence(0))
+        self.assertEqual(b'III#', trimmed.get_qualities(0))
+        self.assertEqual(b'ACGTAC', trimmed.get_sequence(1))
+        self.assertEqual(b'r1', trimmed.get_name(1))
+    
+    def test_filter_pairs(self):
+        batch2 = self.batch.reverse_complement()
+        mask1 = np.array([True, True, False])
+        mask2 = np.array([False, True, True])
+        filtered = seqio.qc.filter_pairs(self.batch, batch2, mask1, mask2)
+        self.assertEqual([1, 1], [len(batch) for batch in filtered])
+        self.assertTrue(filtered[0].names_equal(filtered[1]))
+        filtered = seqio.qc.filter_pairs(
+            self.batch, batch2, mask1, mask2, both=False)
+        self.assertEqual(3, len(filtered[1]))
+        with self.assertRaises(ValueError):
+            self.batch.filter([True])
+
+class PipelineTests(TestCase):
+    def setUp(self):
+        self.records = [
+            Sequence(b'read%d' % i, b'ACGTACGT'[:i], b'I5I5I5I5'[:i])
+            for i in range(9)]
+        self.batch = RecordBatch.from_records(self.records)
+    
+    def test_shared_batch(self):
+        shared = SharedBatch.create(self.batch)
+        shared.close()
+        loaded = shared.load()
+        self.assertTrue(loaded.names_equal(self.batch))
+        self.assertEqual(self.batch.get_qualities(8), loaded.get_qualities(8))
+        fasta = RecordBatch(
+            self.batch.names, self.batch.name_offsets,
+            self.batch.sequences, self.batch.offsets)
+        self.assertIsNone(SharedBatch.create(fasta).load().qualities)
+    
+    def test_map(self):
+        batches = [self.batch.slice(i, i + 2) for i in range(0, 9, 2)]
+        for ordered in (True, False):
+            pipeline = Pipeline(
+                seqio.qc.min_quality, processes=2, ordered=ordered,
+                in_flight=2)
+            lengths = [len(result) for result in pipeline.map(batches)]
+            self.assertEqual(9, sum(lengths))
+            if ordered:
+                self.assertEqual([2, 2, 2, 2, 1], lengths)
+        pairs = Pipeline(RecordBatch.interleave, processes=2).map(
+            [(batch, batch.reverse_complement()) for batch in batches])
+        interleaved = next(pairs)
+        self.assertEqual(
+            [b'read0', b'read0', b'read1', b'read1'],
+            [interleaved.get_name(i) for i in range(4)])
+        self.assertEqual(b'T', interleaved.get_sequence(3))
+    
+    def test_reader(self):
+        with TempDir() as temp:
+            path = temp.make_file(suffix='.fq')
+            with open(path, 'wb') as out:
+                out.write(Fastq().format_batch(self.batch))
+            with seqio.fastq.open(path) as reader:
+                means = list(reader.map(
+                    seqio.qc.mean_quality, processes=2, size=4))
+            self.assertEqual([4, 4, 1], [len(mean) for mean in means])
+            self.assertAlmostEqual(30, means[1][2], places=4)
+            outpath = temp.make_file(suffix='.fq')
+            with seqio.fastq.open(path) as reader, \
+                    SequenceWriter(outpath, Fastq()) as writer:
+                count = reader.filter(
+                    partial(seqio.qc.length_mask, min_length=5),
+                    processes=2, size=4, writer=writer)
+            self.assertEqual(4, count)
+            with open(outpath, 'rb') as inp:
+                self.assertEqual(
+                    [b'@read5', b'@read6', b'@read7', b'@read8', b''],
+                    inp.read().split(b'\n')[0::4])
+
+class AsyncTests(TestCase):
+    def setUp(self):
+        self.records = [
+            Sequence(b'read%d' % i, b'ACGTACGT'[:i + 1], b'I5I5I5I5'[:i + 1])
+            for i in range(7)]
+        self.fastq = Fastq().format_batch(self.records)
+    
+    def test_read(self):
+        async def read(path):
+            async with seqio.aio.open(path, size=3) as reader:
+                records = [record async for record in reader]
+            batches = []
+            reader = await seqio.aio.open(path, size=3)
+            # a cancelled wait for a batch does not lose the batch
+            task = asyncio.ensure_future(reader.next_batch())
+            await asyncio.sleep(0)
+            task.cancel()
+            async for batch in reader.iter_batches():
+                batches.append(batch)
+            await reader.aclose()
+            self.assertTrue(reader.closed)
+            with self.assertRaises(ValueError):
+                await reader.next_batch()
+            return records, batches
+        with TempDir() as temp:
+            path = temp.make_file(suffix='.fq')
+            with open(path, 'wb') as out:
+                out.write(self.fastq)
+            records, batches = asyncio.run(read(path))
+        self.assertEqual(
+            [record.name for record in self.records],
+            [record.name for record in records])
+        self.assertEqual([3, 3, 1], [len(batch) for batch in batches])
+        self.assertEqual(b'read6', batches[2].get_name(0))
+    
+    def test_write(self):
+        async def write(path):
+            async with seqio.aio.open(
+                    path, mode='wb', file_format='fastq', size=2) as writer:
+                for record in self.records[:3]:
+                    await writer.write(record)
+                await writer.write_batch(
+                    RecordBatch.from_records(self.records[3:6]))
+                await writer.write(self.records[6])
+        with TempDir() as temp:
+            path = temp.make_file(suffix='.fq.gz')
+            asyncio.run(write(path))
+            with gzip.open(path, 'rb') as inp:
+                self.assertEqual(bytes(self.fastq), inp.read())
+    
+    def test_write_error(self):
+        async def write(path):
+            writer = await seqio.aio.open(
+                path, mode='wb', file_format='fastq', size=10)
+            await writer.write(self.records[0])
+            # a record without qualities cannot be written as FASTQ
+            await writer.write(Sequence(b'noqual', b'ACGT'))
+            with self.assertRaises(TypeError):
+                await writer.aclose()
+            self.assertTrue(writer.closed)
+            self.assertTrue(writer.seqio.fileobj.closed)
+        with TempDir() as temp:
+            path = temp.make_file(suffix='.fq')
+            asyncio.run(write(path))
+
+class StatsTests(TestCase):
+    def setUp(self):
+        self.records = [
+            Sequence(b'read%d' % i, b'ACGT', b'IIII') for i in range(10)]
+    
+    def test_stats(self):
+        reports = []
+        with TempDir() as temp:
+            paths = [
+                temp.make_file(suffix=suffix)
+                for suffix in ('.1.fq.gz', '.2.fq.gz')]
+            with seqio.fastq.open(
+                    *paths, mode='w', io_args=dict(stats=True)) as writer:
+                writer.write(self.records[0], self.records[0])
+                writer.write_batch(self.records[1:], self.records[1:])
+            stats = writer.stats()
+            self.assertEqual(20, stats['records'])
+            self.assertEqual(2, stats['batches'])
+            self.assertEqual(2 * 10 * 19, stats['bytes_out'])
+            self.assertGreater(stats['seconds']['format'], 0)
+            self.assertEqual(0, stats['seconds']['parse'])
+            with seqio.fastq.open(*paths) as reader:
+                self.assertIsNone(reader.stats())
+            for threads in (True, False):
+                with seqio.fastq.open(*paths, io_args=dict(
+                        stats=Stats(reports.append, 4))) as reader:
+                    reader.threads = threads
+                    self.assertEqual(10, sum(1 for _ in reader))
+                    stats = reader.stats()
+                self.assertEqual(20, stats['records'])
+                self.assertEqual(2 * 10 * 19, stats['bytes_in'])
+                self.assertGreater(stats['seconds']['parse'], 0)
+            self.assertTrue(all(
+                report['records'] % 4 == 0 for report in reports))
+            with seqio.fastq.open(
+                    paths[0], io_args=dict(stats=True)) as reader:
+                self.assertEqual(
+                    [3, 3, 3, 1],
+                    [len(batch) for batch in reader.iter_batches(3)])
+                self.assertEqual(4, reader.stats()['batches'])
+    
+    def test_write_iterator(self):
+        with TempDir() as temp:
+            path = temp.make_file(suffix='.fq')
+            with seqio.fastq.open(
+                    path, mode='w', io_args=dict(stats=True)) as writer:
+                writer.write_batch(record for record in self.records)
+            self.assertEqual(10, writer.stats()['records'])
+            with open(path, 'rb') as inp:
+                self.assertEqual(10 * 19, len(inp.read()))
+
+class SortTests(TestCase):
+    def setUp(self):
+        self.records = [
+            Sequence(b'read%d' % (i * 7 % 20), b'ACGT'[i % 4:] + b'GA' * i,
+                     b'I' * (4 - i % 4 + 2 * i))
+            for i in range(20)]
+    
+    def test_sort(self):
+        with TempDir() as temp:
+            path = temp.make_file(suffix='.fq.gz')
+            with seqio.fastq.open(path, mode='w') as writer:
+                writer.write_batch(self.records)
+            for key, attr in (('name', 'name'), ('sequence', 'sequence')):
+                # a tiny memory limit spills many runs and merges them in
+                # several passes
+                for memory in ('1G', 1000):
+                    out = temp.make_file(suffix='.fq')
+                    self.assertEqual(20, seqio.sort(
+                        path, out, key=key, memory=memory, threads=2))
+                    with seqio.open(out) as reader:
+                        values = [getattr(record, attr) for record in reader]
+                    self.assertEqual(
+                        sorted(getattr(record, attr)
+                               for record in self.records),
+                        values)
+            out = temp.make_file(suffix='.fq')
+            seqio.sort(path, out, key='minimizer', k=3, memory=1000)
+            with seqio.open(out) as reader:
+                batch = RecordBatch.concat(list(reader.iter_batches()))
+            keys = minimizers(batch.sequences, batch.offsets, 3)
+            self.assertEqual(sorted(keys), keys.tolist())
+            with self.assertRaises(ValueError):
+                seqio.sort(path, out, key='quality')
+    
+    def test_paired(self):
+        mates = [
+            Sequence(record.name, record.sequence[::-1], record.qualities)
+            for record in self.records]
+        with TempDir() as temp:
+            paths = [
+                temp.make_file(suffix=suffix)
+                for suffix in ('.1.fq', '.2.fq')]
+            with seqio.fastq.open(*paths, mode='w') as writer:
+                writer.write_batch(self.records, mates)
+            out = temp.make_file(suffix='.fq')
+            with self.assertRaises(ValueError):
+                seqio.sort(paths, out)
+            self.assertEqual(20, seqio.sort(
+                paths, out, key='sequence', memory=1000,
+                output_args=dict(interleaved=True)))
+            with seqio.fastq.open(out, interleaved=True) as reader:
+                pairs = list(reader)
+            self.assertEqual(
+                sorted(record.sequence for record in self.records),
+                [read1.sequence for read1, _ in pairs])
+            self.assertTrue(all(
+                read2.sequence == read1.sequence[::-1]
+                for read1, read2 in pairs))
+
+class CompressionTests(TestCase):
+    def test_get_decompressor(self):
+        self.assertEqual('zlib', get_decompressor('zlib').name)
+        self.assertTrue(get_decompressor().available())
+        with self.assertRaises(ValueError):
+            get_decompressor('foo')
+    
+    def test_open_decompressed(self):
+        data = b''.join(b'line %d\n' % i for i in range(1000))
+        with TempDir() as temp:
+            path = temp.make_file(suffix='.gz')
+            with gzip.open(path, 'wb') as out:
+                out.write(data)
+            for threads in (True, False):
+                fileobj, backend = open_decompressed(
+                    path, 'zlib', threads=threads, block_size=100)
+                self.assertEqual('zlib', backend.name)
+                with fileobj:
+                    self.assertEqual(b'line 0\n', fileobj.readline())
+                    self.assertEqual(data[7:], fileobj.read())
+            path = temp.make_file()
+            with open(path, 'wb') as out:
+                out.write(data)
+            fileobj, backend = open_decompressed(path)
+            self.assertIsNone(backend)
+            with fileobj:
+                self.assertEqual(data, fileobj.read())
+    
+    def test_bgzf(self):
+        lines = [b'line %d\n' % i for i in range(1000)]
+        data = b''.join(lines)
+        with TempDir() as temp:
+            path = temp.make_file(suffix='.gz')
+            with open(path, 'wb') as out:
+                for i in range(0, len(data), 1000):
+                    out.write(deflate_bgzf_block(data[i:i + 1000]))
+                out.write(BGZF_EOF)
+            self.assertTrue(is_bgzf(path))
+            self.assertEqual(data, gzip.open(path).read())
+            fileobj, backend = open_decompressed(path, threads=2)
+            self.assertEqual('bgzf', backend.name)
+            with fileobj:
+                self.assertEqual(data, fileobj.read())
+            for threads in (0, 2):
+                with BgzfReader(path, threads) as fileobj:
+                    offsets = []
+                    for line in lines:
+                        offsets.append(fileobj.tell_virtual())
+                        self.assertEqual(line, fileobj.readline())
+                    for i in (999, 0, 500, 123):
+                        fileobj.seek_virtual(offsets[i])
+                        self.assertEqual(lines[i], fileobj.readline())
+    
+    def test_block_compression(self):
+        data = b''.join(b'line %d\n' % i for i in range(10000))
+        with TempDir() as temp:
+            for compression in ('gzip', 'bgzf'):
+                for threads in (0, 2):
+                    path = temp.make_file(suffix='.gz')
+                    with BlockCompressedWriter(
+                            path, compression, threads, block_size=1000,
+                            level=1) as out:
+                        for i in range(0, len(data), 3000):
+                            out.write(data[i:i + 3000])
+                    with gzip.open(path, 'rb') as inp:
+                        self.assertEqual(data, inp.read())
+                    self.assertEqual(compression == 'bgzf', is_bgzf(path))
+            with self.assertRaises(ValueError):
+                BlockCompressedWriter(path, 'bgzf', block_size=65536)
+
+class SniffTests(TestCase):
+    def test_sniff_bytes(self):
+        fastq = b'@a\nAC\n+\nII\n@b\nAC\n+\nII\n'
+        result = sniff_bytes(fastq)
+        self.assertEqual(('fastq', None, False), tuple(result))
+        self.assertTrue(sniff_bytes(fastq.replace(b'b', b'a')).interleaved)
+        self.assertEqual(
+            ('fastq', 'gzip', False), tuple(sniff_bytes(gzip.compress(fastq))))
+        self.assertEqual(
+            ('fasta', 'bgzf', False),
+            tuple(sniff_bytes(deflate_bgzf_block(b'>a\nACGT\n'))))
+        self.assertEqual('sam', sniff_bytes(b'@HD\tVN:1.6\n').file_format)
+        self.assertEqual(
+            'sam', sniff_bytes(deflate_bgzf_block(b'BAM\x01')).file_format)
+        self.assertIsNone(sniff_bytes(b'foo').file_format)
+        self.assertEqual('fastq', guess_format_from_name('x.fq.gz'))
+        self.assertEqual('sam', guess_format_from_name('x.bam'))
+    
+    def test_sniff_file(self):
+        with TempDir() as temp:
+            path = temp.make_file(suffix='.gz')
+            with gzip.open(path, 'wb') as out:
+                out.write(b'>a\nACGT\n')
+            self.assertEqual('fasta', sniff_file(path).file_format)
+            with open(path, 'rb') as fileobj:
+                self.assertEqual('gzip', sniff_file(fileobj).compression)
+                self.assertEqual(0, fileobj.tell())
+            # the cached result is discarded when the file changes
+            with open(path, 'wb') as out:
+                out.write(b'@a\nAC\n+\nII\n')
+            self.assertEqual(
+                ('fastq', None), tuple(sniff_file(path))[:2])
+    
+    def test_cache_size(self):
+        cache_size = seqio.sniff.CACHE_SIZE
+        seqio.sniff.CACHE_SIZE = 2
+        seqio.sniff.clear_cache()
+        try:
+            with TempDir() as temp:
+                paths = [
+                    str(temp.make_file(suffix='.fa')) for _ in range(4)]
+                for path in paths:
+                    with open(path, 'wb') as out:
+                        out.write(b'>a\nACGT\n')
+                for path in paths[:3]:
+                    sniff_file(path)
+                self.assertListEqual(paths[1:3], list(seqio.sniff._cache))
+                # the least recently used path is evicted
+                sniff_file(paths[1])
+                sniff_file(paths[3])
+                self.assertListEqual(
+                    [paths[1], paths[3]], list(seqio.sniff._cache))
+        finally:
+            seqio.sniff.CACHE_SIZE = cache_size
+            seqio.sniff.clear_cache()
+    
+    def test_empty_file(self):
+        # empty files are identified by their extension
+        with TempDir() as temp:
+            for suffix in ('.fq', '.fq.gz'):
+                path = temp.make_file(suffix=suffix)
+                if suffix == '.fq.gz':
+                    with gzip.open(path, 'wb'):
+                        pass
+                with seqio.open(path) as reader:
+                    self.assertEqual('fastq', reader.file_format.name)
+                    self.assertEqual([], list(reader))
+            with self.assertRaises(ValueError):
+                seqio.open(temp.make_file(suffix='.txt'))
+
+class FastaIndexTests(TestCase):
+    fasta = (
+        b'>chr1 first\nACGTA\nCGTAC\nGT\n'
+        b'>chr2\nAAAAA\nCCC\n')
+    
+    def test_build_fai(self):
+        entries = build_fai(BytesIO(self.fasta))
+        self.assertListEqual(
+            [('chr1', 12, 12, 5, 6), ('chr2', 8, 33, 5, 6)],
+            [tuple(entry) for entry in entries.values()])
+        with self.assertRaises(FormatError):
+            build_fai(BytesIO(b'>chr1\nACG\nACGTA\n'))
+    
+    def test_fetch(self):
+        with TempDir() as temp:
+            plain = temp.make_file(suffix='.fa')
+            with open(plain, 'wb') as out:
+                out.write(self.fasta)
+            bgzf = temp.make_file(suffix='.fa.gz')
+            with open(bgzf, 'wb') as out:
+                for i in range(0, len(self.fasta), 10):
+                    out.write(deflate_bgzf_block(self.fasta[i:i + 10]))
+                out.write(BGZF_EOF)
+            for path in (plain, bgzf):
+                with FastaIndex(path) as index:
+                    self.assertEqual(b'ACGTACGTACGT', index.fetch('chr1'))
+                    self.assertEqual(b'TACG', index.fetch('chr1', 3, 7))
+                    self.assertEqual(b'CC', index.fetch('chr2', 6, 100))
+                    self.assertEqual(b'', index.fetch('chr2', 4, 4))
+                    self.assertListEqual(
+                        [b'CCC', b'A', b'GT'],
+                        index.fetch_many([
+                            ('chr2', 5, 8), ('chr1', 0, 1), ('chr1', 10)]))
+                # the saved index is reused
+                self.assertTrue(os.path.exists(str(path) + '.fai'))
+                with FastaIndex(path, build=False) as index:
+                    self.assertEqual(b'AAAAA', index.fetch('chr2', 0, 5))
+
+try:
+    import indexed_gzip
+except ImportError:
+    indexed_gzip = None
+
+class FastaQualTests(TestCase):
+    def test_round_trip(self):
+        records = [
+            Sequence(b'read1', b'ACGT', b'!+5I'),
+            Sequence(b'read2', b'', b''),
+            Sequence(b'read3', b'GG', b'#I')]
+        with TempDir() as temp:
+            fasta_path = temp.make_file(suffix='.fa')
+            qual_path = temp.make_file(suffix='.qual')
+            with seqio.fasta.open(fasta_path, qual_path, mode='w') as writer:
+                writer.write(records[0])
+                writer.write_batch(RecordBatch.from_records(records[1:]))
+            with open(qual_path, 'rb') as inp:
+                self.assertEqual(
+                    b'>read1\n0 10 20 40\n>read2\n\n>read3\n2 40\n',
+                    inp.read())
+            with seqio.fasta.open(fasta_path, qual_path) as reader:
+                self.assertEqual(
+                    [(r.name, r.sequence, r.qualities) for r in records],
+                    [(r.name, r.sequence, r.qualities) for r in reader])
+            with self.assertRaises(ValueError):
+                with seqio.fasta.open(
+                        fasta_path, qual_path, mode='w') as writer:
+                    writer.write(Sequence(b'read1', b'ACGT'))
+
+class FastqIndexTests(TestCase):
+    def make_fastq(self, start, stop):
+        return b''.join(
+            b'@read%d comment\nACGT\n+\nIIII\n' % i
+            for i in range(start, stop))
+    
+    def test_index(self):
+        data = self.make_fastq(0, 20)
+        with TempDir() as temp:
+            plain = temp.make_file(suffix='.fq')
+            with open(plain, 'wb') as out:
+                out.write(data)
+            bgzf = temp.make_file(suffix='.fq.gz')
+            with open(bgzf, 'wb') as out:
+                for i in range(0, len(data), 100):
+                    out.write(deflate_bgzf_block(data[i:i + 100]))
+                out.write(BGZF_EOF)
+            for path in (plain, bgzf):
+                with FastqIndex(path, stride=3, names=True) as index:
+                    self.assertEqual(20, len(index))
+                    for i in (0, 2, 3, 19, -1, 7):
+                        self.assertEqual(
+                            b'read%d comment' % (i % 20),
+                            index.get_record(i).name)
+                    with self.assertRaises(IndexError):
+                        index.get_record(20)
+                    self.assertEqual(
+                        b'read11 comment', index.get('read11').name)
+                    with self.assertRaises(KeyError):
+                        index.get('read20')
+                    records = index.get_many([b'read9 x', 'nope', 'read1'])
+                    self.assertEqual(b'read9 comment', records[0].name)
+                    self.assertIsNone(records[1])
+                    self.assertEqual(b'read1 comment', records[2].name)
+                self.assertTrue(os.path.exists(str(path) + '.fqi'))
+    
+    def test_append(self):
+        with TempDir() as temp:
+            path = temp.make_file(suffix='.fq')
+            with open(path, 'wb') as out:
+                out.write(self.make_fastq(0, 10))
+            with FastqIndex(path, stride=4, names=True) as index:
+                self.assertEqual(10, len(index))
+            with open(path, 'ab') as out:
+                out.write(self.make_fastq(10, 25))
+            with self.assertRaises(IOError):
+                FastqIndex(path, stride=4, build=False)
+            with FastqIndex(path, stride=4) as index:
+                self.assertEqual(25, len(index))
+                self.assertTrue(index.names)
+                self.assertEqual(
+                    b'read17 comment', index.get_record(17).name)
+                self.assertEqual(b'read22 comment', index.get('read22').name)
+    
+    @skipIf(indexed_gzip is None, "indexed_gzip is not installed")
+    def test_gzip(self):
+        with TempDir() as temp:
+            path = temp.make_file(suffix='.fq.gz')
+            with gzip.open(path, 'wb') as out:
+                out.write(self.make_fastq(0, 10))
+            with FastqIndex(path, stride=4, names=True) as index:
+                self.assertEqual(10, len(index))
+            # the saved checkpoints are imported by a new index
+            with FastqIndex(path, stride=4, build=False) as index:
+                self.assertEqual(b'read6 comment', index.get_record(6).name)
+            # appending a gzip member extends the index
+            with gzip.open(path, 'ab') as out:
+                out.write(self.make_fastq(10, 25))
+            with FastqIndex(path, stride=4) as index:
+                self.assertEqual(25, len(index))
+                self.assertEqual(
+                    b'read17 comment', index.get_record(17).name)
+                self.assertEqual(b'read22 comment', index.get('read22').name)
+                self.assertEqual(b'read3 comment', index.get_record(3).name)
+            with FastqIndex(path, stride=4, build=False) as index:
+                self.assertEqual(
+                    b'read24 comment', index.get_record(24).name)
+
+try:
+    import pysam
+except ImportError:
+    pysam = None
+
+@skipIf(pysam is None, "pysam is not installed")
+class SamTests(TestCase):
+    def make_bam(self, path, flags):
+        header = pysam.AlignmentHeader.from_dict({'HD': {'VN': '1.6'}})
+        with pysam.AlignmentFile(str(path), 'wb', header=header) as out:
+            for i, flag in enumerate(flags):
+                record = pysam.AlignedSegment(header)
+                record.query_name = 'read{}'.format(i // 2)
+                record.query_sequence = 'AACG'[:i % 4 + 1]
+                record.query_qualities = pysam.qualitystring_to_array(
+                    'ABCD'[:i % 4 + 1])
+                record.flag = flag
+                out.write(record)
+    
+    def test_read(self):
+        with TempDir() as temp:
+            path = temp.make_file(suffix='.bam')
+            self.make_bam(path, (77, 141, 77 | 0x10, 141, 0x100 | 77))
+            with seqio.sam.open(path) as reader:
+                records = list(reader)
+            self.assertEqual(4, len(records))
+            self.assertEqual(b'read1', records[2].name)
+            self.assertEqual(b'GTT', records[2].sequence)
+            self.assertEqual(b'CBA', records[2].qualities)
+            with seqio.sam.open(path) as reader:
+                batch = next(reader.iter_batches(3))
+            self.assertEqual(b'AAAGTT', batch.sequences.tobytes())
+            self.assertEqual(b'AABCBA', batch.qualities.tobytes())
+            with seqio.sam.open(path, paired=True) as reader:
+                batches = list(reader.iter_batches(1))
+                self.assertEqual(2, len(batches))
+                batch1, batch2 = batches[1]
+                self.assertEqual(b'read1', batch1.get_name(0))
+                self.assertEqual(b'CBA', batch1.get_qualities(0))
+                self.assertEqual(b'AACG', batch2.get_sequence(0))
+    
+    def test_write(self):
+        records = [
+            Sequence(b'read%d' % i, b'ACGTN'[:i + 1], b'ABCDE'[:i + 1])
+            for i in range(4)]
+        batch = RecordBatch.from_records(records)
+        with TempDir() as temp:
+            path = temp.make_file(suffix='.bam')
+            with seqio.sam.open(path, 'wb') as writer:
+                writer.write(records[0])
+                writer.write_batch(batch.slice(1, 4))
+            with pysam.AlignmentFile(str(path), check_sq=False) as bam:
+                self.assertIn('GO:query', str(bam.header))
+                written = list(bam)
+            self.assertEqual(4, len(written))
+            self.assertEqual('read3', written[3].query_name)
+            self.assertEqual('ACGT', written[3].query_sequence)
+            self.assertEqual([32, 33, 34, 35], list(written[3].query_qualities))
+            self.assertEqual(4, written[3].flag)
+            mates = [
+                Sequence(b'pair%d' % (i // 2), r.sequence, r.qualities)
+                for i, r in enumerate(records)]
+            batch = RecordBatch.from_records(mates)
+            path = temp.make_file(suffix='.bam')
+            with seqio.sam.open(path, 'wb', paired=True) as writer:
+                writer.write(mates[0], mates[1])
+                writer.write_batch(batch.slice(2, 3), batch.slice(3, 4))
+            with seqio.sam.open(path, paired=True) as reader:
+                pairs = list(reader)
+            self.assertEqual(2, len(pairs))
+            self.assertEqual(b'ACGT', pairs[1][1].sequence)
+            with pysam.AlignmentFile(str(path), check_sq=False) as bam:
+                self.assertEqual(
+                    [77, 141, 77, 141], [record.flag for record in bam])
+        with self.assertRaises(ValueError):
+            seqio.sam.open('x.sam', 'w')
+
+class WriterTests(TestCase):
+    def setUp(self):
+        self.records = [
+            Sequence(b'read%d' % i, b'ACGTA'[:i + 1], b'IIIII'[:i + 1])
+            for i in range(5)]
+        self.fastq = b''.join(
+            b'@%s\n%s\n+\n%s\n' % (r.name, r.sequence, r.qualities)
+            for r in self.records)
+    
+    def test_format_batch(self):
+        batch = RecordBatch.from_records(self.records)
+        self.assertEqual(self.fastq, Fastq().format_batch(batch))
+        self.assertEqual(self.fastq, Fastq().format_batch(self.records))
+        self.assertEqual(
+            b'@read0\nA\n+read0\nI\n',
+            bytes(Fastq(write_name2=True).format_batch(batch.slice(0, 1))))
+        self.assertEqual(
+            b'>read0\nA\n>read4\nACG\nTA\n',
+            bytes(Fasta(line_length=3).format_batch(batch.take([0, 4]))))
+    
+    def test_write(self):
+        batch = RecordBatch.from_records(self.records)
+        with TempDir() as temp:
+            path = temp.make_file(suffix='.fq.gz')
+            writer = SequenceWriter(path, Fastq(), buffer_size=40)
+            for record in self.records[:2]:
+                writer.write(record)
+            writer.write_batch(batch.slice(2, 5))
+            writer.close()
+            with gzip.open(path, 'rb') as inp:
+                self.assertEqual(self.fastq, inp.read())
+            path = temp.make_file(suffix='.fq')
+            with InterleavedFileWriter(path, Fastq()) as writer:
+                writer.write(self.records[0], self.records[1])
+                writer.write_batch(batch.slice(2, 4), batch.slice(3, 5))
+            with open(path, 'rb') as inp:
+                names = inp.read().split(b'\n')[0::4]
+            self.assertEqual(
+                [b'@read0', b'@read1', b'@read2', b'@read3', b'@read3',
+                 b'@read4', b''],
+                names)
+    
+    def test_block_compression(self):
+        with TempDir() as temp:
+            path = temp.make_file(suffix='.fq.gz')
+            with SequenceWriter(
+                    path, Fastq(), compression='bgzf', threads=2,
+                    block_size=20) as writer:
+                writer.write_batch(self.records)
+            with FastqIndex(path, stride=2, names=True) as index:
+                self.assertEqual(5, len(index))
+                self.assertEqual(b'ACG', index.get('read2').sequence)